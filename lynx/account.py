@@ -1,21 +1,10 @@
 # account.py
 from message import Message, SignedMessage
-import threading
-import binascii
-from hdwallet import BIP44HDWallet
-from hdwallet.cryptocurrencies import EthereumMainnet
-from hdwallet.derivations import BIP44Derivation
-from hdwallet.utils import generate_mnemonic
+from log import get_logger
 from typing import Optional
 from hashlib import sha3_256
-from ecdsa.util import sigencode_der
-from ecdsa.curves import SECP256k1
-from ecdsa.keys import SigningKey
 
-
-def display_debug(msg):
-    """Prints a message to the screen with the name of the current thread"""
-    print("[%s] %s" % (str(threading.currentThread().getName()), msg))
+logger = get_logger(__name__)
 
 
 class Account:
@@ -25,9 +14,38 @@ class Account:
     """
 
     # ------------------------------------------------------------------------------
-    def __init__(self) -> None:
+    def __init__(self, pub_key: str = None, priv_key: str = None, address: str = None, debug: bool = True) -> None:
         # --------------------------------------------------------------------------
-        """Generates a 1024-bit RSA key pair made up of a public and private key"""
+        """Generates a new HD wallet and derives the first account from it. If keys
+        are given (e.g. by a KeyPool), they are used as-is and no wallet is built.
+        """
+
+        self.debug = debug
+
+        if pub_key is None or priv_key is None or address is None:
+            self.__init_wallet()
+        else:
+            self.pub_key = pub_key
+            self.priv_key = priv_key
+            self.address = address
+
+        self.nonce = 0
+        self.balance = 0
+        self.contract_code = ''
+        # self.storage = ?
+
+    # ------------------------------------------------------------------------------
+    def __init_wallet(self) -> None:
+        # --------------------------------------------------------------------------
+        """Generates a mnemonic, builds a BIP44 wallet and derives m/44'/60'/0'/0/0.
+        The wallet libraries are imported here so that nodes which never create
+        an account do not pay for loading them.
+        """
+        from hdwallet import BIP44HDWallet
+        from hdwallet.cryptocurrencies import EthereumMainnet
+        from hdwallet.derivations import BIP44Derivation
+        from hdwallet.utils import generate_mnemonic
+
         # TODO Change from 128 bit strength to 512 bit strength
         MNEMONIC: str = generate_mnemonic(language="english", strength=128)
         PASSPHRASE: Optional[str] = None  # "meherett
@@ -36,8 +54,7 @@ class Account:
         bip44_hdwallet.from_mnemonic(
             mnemonic=MNEMONIC, language="english", passphrase=PASSPHRASE)
         bip44_hdwallet.clean_derivation()
-        print("Mnemonic:", bip44_hdwallet.mnemonic())
-        print("Base HD Path:  m/44'/60'/0'/0/0")
+        self.__debug("Base HD Path:  m/44'/60'/0'/0/0")
         bip44_derivation: BIP44Derivation = BIP44Derivation(
             cryptocurrency=EthereumMainnet, account=0, change=False, address=0)
         bip44_hdwallet.from_path(path=bip44_derivation)
@@ -47,28 +64,20 @@ class Account:
         self.address = bip44_hdwallet.address()
 
         self.__debug('Account Created!')
-        self.__debug('Seed Phrase (%s)' % (MNEMONIC))
-        self.__debug("Path: %s" % bip44_hdwallet.path())
-        self.__debug("Public Key: %s" % self.pub_key)
-        self.__debug("Address: %s" % self.address)
-        self.__debug("Private key: %s" % bip44_hdwallet.private_key())
-        self.__debug("Signing key: %s" % bytearray.fromhex(self.priv_key))
+        self.__debug("Path: %s", bip44_hdwallet.path())
+        self.__debug("Public Key: %s", self.pub_key)
+        self.__debug("Address: %s", self.address)
         bip44_hdwallet.clean_derivation()
 
         # self.__debug('Public Key: (%s)' % (bip32_root_key_obj.ExtendedKey()))
-        # self.__debug('Private Key: (n: %s, d: %s)\n' % (bip32_child_key_obj.ExtendedKey()))
         # self.__debug("Address: %s" % (bip32_child_key_obj.Address()))
 
-        self.nonce = 0
-        self.balance = 0
-        self.contract_code = ''
-        # self.storage = ?
-
     # ------------------------------------------------------------------------------
-    def __debug(self, message) -> None:
+    def __debug(self, message, *args) -> None:
         # --------------------------------------------------------------------------
-        if self.__debug:
-            display_debug(message)
+        """Logs at debug level, unless debugging was turned off for this account"""
+        if self.debug:
+            logger.debug(message, *args)
 
     # ------------------------------------------------------------------------------
     def sign_message(self, message: Message) -> SignedMessage:
@@ -84,7 +93,7 @@ class Account:
         signature = pow(message_hash, int(('0x' + self.pub_key),
                         16), int(('0x' + self.pub_key), 16))
         signed_message = SignedMessage(message=message, signature=signature)
-        self.__debug('Signature: %s' % hex(signed_message.signature))
+        self.__debug('Signature: %x', signed_message.signature)
 
         return signed_message
 
@@ -0,0 +1,262 @@
+# account_snapshot.py
+from __future__ import annotations
+from state_store import StateStore
+from tip_index import TipIndex
+from log import get_logger
+import threading
+import argparse
+import os
+
+# Imported by the first AccountSnapshot, importing this module stays cheap
+numpy = None
+
+logger = get_logger(__name__)
+
+
+class AccountSnapshot:
+    """Columnar snapshot of every account tip for aggregate queries: parallel
+    NumPy arrays of addresses, tip nonces and balances, where the row of an
+    account is its address id. It is built from the tip index, follows the
+    StateStore the index is attached to (changed accounts are refreshed on the
+    next query) and is saved as .npy files that load memory-mapped.
+
+    Requires numpy, which is otherwise not needed by the node.
+    """
+
+    COLUMNS = ('addresses', 'nonces', 'balances')
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, tip_index: TipIndex, directory: str = '../snapshot') -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an empty AccountSnapshot of tip_index stored in directory"""
+
+        global numpy
+        if numpy is None:
+            try:
+                import numpy
+            except ImportError:
+                raise ImportError('AccountSnapshot requires numpy') from None
+
+        self.tip_index = tip_index
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.addresses = numpy.empty(0, dtype='S1')
+        self.nonces = numpy.empty(0, dtype=numpy.int64)
+        self.balances = numpy.empty(0, dtype=numpy.float64)
+        self.rows = {}
+        self.dirty = set()
+        self.loaded = False
+        if tip_index.state_store is not None:
+            tip_index.state_store.add_batch_listener(self.__on_states_stored)
+
+    # ------------------------------------------------------------------------------
+    def __on_states_stored(self, items: list) -> None:
+        # --------------------------------------------------------------------------
+        with self.lock:
+            self.dirty.update(account for account, _ in items)
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __nonce(self, entry: dict) -> int:
+        # --------------------------------------------------------------------------
+        try:
+            return int(entry['nonce'])
+        except (TypeError, ValueError):
+            return -1
+
+    # ------------------------------------------------------------------------------
+    def build(self) -> int:
+        # --------------------------------------------------------------------------
+        """Builds the columns from every account in the tip index. Returns the
+        number of accounts.
+        """
+
+        with self.tip_index.lock:
+            if not self.tip_index.loaded:
+                self.tip_index.load()
+            tips = list(self.tip_index.tips.items())
+
+        with self.lock:
+            self.addresses = numpy.array(
+                [account.encode() for account, _ in tips], dtype='S')
+            self.nonces = numpy.fromiter((self.__nonce(entry) for _, entry in tips),
+                                         dtype=numpy.int64, count=len(tips))
+            self.balances = numpy.fromiter((entry['balance'] for _, entry in tips),
+                                           dtype=numpy.float64, count=len(tips))
+            self.rows = {account: row for row, (account, _) in enumerate(tips)}
+            self.dirty.clear()
+            self.loaded = True
+
+        return len(tips)
+
+    # ------------------------------------------------------------------------------
+    def refresh(self) -> int:
+        # --------------------------------------------------------------------------
+        """Updates the rows of accounts written since the last refresh and appends
+        new accounts. Returns the number of accounts refreshed.
+        """
+
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if len(self.dirty) == 0:
+                return 0
+            dirty, self.dirty = self.dirty, set()
+
+            updates = [(account, self.tip_index.get(account))
+                       for account in dirty]
+            updates = [(account, entry)
+                       for account, entry in updates if entry is not None]
+            new_accounts = [(account, entry) for account, entry in updates
+                            if account not in self.rows]
+            # Memory-mapped columns are read-only, copy them before writing
+            if not self.nonces.flags.writeable:
+                self.addresses = numpy.array(self.addresses)
+                self.nonces = numpy.array(self.nonces)
+                self.balances = numpy.array(self.balances)
+
+            existing = [(self.rows[account], entry)
+                        for account, entry in updates if account in self.rows]
+            if len(existing) > 0:
+                rows = numpy.fromiter((row for row, _ in existing),
+                                      dtype=numpy.int64, count=len(existing))
+                self.nonces[rows] = [self.__nonce(entry) for _, entry in existing]
+                self.balances[rows] = [entry['balance'] for _, entry in existing]
+
+            if len(new_accounts) > 0:
+                first_row = len(self.addresses)
+                self.addresses = numpy.concatenate((self.addresses, numpy.array(
+                    [account.encode() for account, _ in new_accounts], dtype='S')))
+                self.nonces = numpy.concatenate((self.nonces, numpy.array(
+                    [self.__nonce(entry) for _, entry in new_accounts], dtype=numpy.int64)))
+                self.balances = numpy.concatenate((self.balances, numpy.array(
+                    [entry['balance'] for _, entry in new_accounts], dtype=numpy.float64)))
+                self.rows.update((account, first_row + index)
+                                 for index, (account, _) in enumerate(new_accounts))
+
+            return len(updates)
+
+    # ------------------------------------------------------------------------------
+    def save(self) -> None:
+        # --------------------------------------------------------------------------
+        """Writes each column to <directory>/<column>.npy"""
+
+        with self.lock:
+            if not self.loaded:
+                self.build()
+            os.makedirs(self.directory, exist_ok=True)
+            for column in self.COLUMNS:
+                path = os.path.join(self.directory, column + '.npy')
+                with open(path + '.tmp', 'wb') as column_file:
+                    numpy.save(column_file, getattr(self, column),
+                               allow_pickle=False)
+                os.replace(path + '.tmp', path)
+
+    # ------------------------------------------------------------------------------
+    def load(self, mmap: bool = True) -> bool:
+        # --------------------------------------------------------------------------
+        """Loads the saved columns (memory-mapped unless mmap is False), or builds
+        them from the tip index if there are none. Accounts written since the
+        snapshot was saved are not known, so a loaded snapshot is only as fresh
+        as its last save; call build() to start over.
+        """
+
+        with self.lock:
+            try:
+                columns = [numpy.load(os.path.join(self.directory, column + '.npy'),
+                                      mmap_mode='r' if mmap else None, allow_pickle=False)
+                           for column in self.COLUMNS]
+            except (OSError, ValueError):
+                self.build()
+                return False
+
+            if not len(columns[0]) == len(columns[1]) == len(columns[2]):
+                logger.warning('Account snapshot in %s is inconsistent, rebuilding it',
+                               self.directory)
+                self.build()
+                return False
+
+            self.addresses, self.nonces, self.balances = columns
+            self.rows = {address.decode(): row for row,
+                         address in enumerate(self.addresses)}
+            self.loaded = True
+            return True
+
+    # ------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        # --------------------------------------------------------------------------
+        self.refresh()
+        return len(self.addresses)
+
+    # ------------------------------------------------------------------------------
+    def total_balance(self) -> float:
+        # --------------------------------------------------------------------------
+        self.refresh()
+        return float(self.balances.sum())
+
+    # ------------------------------------------------------------------------------
+    def top_accounts(self, count: int = 10) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the (address, balance) of the count richest accounts"""
+
+        self.refresh()
+        count = min(int(count), len(self.balances))
+        if count <= 0:
+            return []
+        rows = numpy.argpartition(self.balances, -count)[-count:]
+        rows = rows[numpy.argsort(self.balances[rows])[::-1]]
+        return [(self.addresses[row].decode(), float(self.balances[row])) for row in rows]
+
+    # ------------------------------------------------------------------------------
+    def balance_histogram(self, bins=10) -> tuple:
+        # --------------------------------------------------------------------------
+        """Returns (counts, bin edges) of the balance distribution, see
+        numpy.histogram.
+        """
+
+        self.refresh()
+        return numpy.histogram(self.balances, bins=bins)
+
+    # ------------------------------------------------------------------------------
+    def balance_percentiles(self, percentiles=(50, 90, 99)) -> list:
+        # --------------------------------------------------------------------------
+        self.refresh()
+        if len(self.balances) == 0:
+            return [None] * len(percentiles)
+        return [float(value) for value in numpy.percentile(self.balances, percentiles)]
+
+    # ------------------------------------------------------------------------------
+    def count_above(self, balance: float) -> int:
+        # --------------------------------------------------------------------------
+        """Returns the number of accounts holding more than balance"""
+
+        self.refresh()
+        return int(numpy.count_nonzero(self.balances > balance))
+
+# end AccountSnapshot class
+
+
+# ------------------------------------------------------------------------------
+def main() -> None:
+    # --------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(
+        description='Builds the account snapshot and prints a balance report.')
+    parser.add_argument('--accounts-directory', type=str, default='../accounts')
+    parser.add_argument('--index', type=str, default='../tip_index.json')
+    parser.add_argument('--snapshot', type=str, default='../snapshot')
+    parser.add_argument('--top', type=int, default=10)
+    arguments = parser.parse_args()
+
+    snapshot = AccountSnapshot(TipIndex(arguments.index, StateStore(
+        arguments.accounts_directory)), arguments.snapshot)
+    snapshot.build()
+    snapshot.save()
+    print('Accounts: {}'.format(len(snapshot)))
+    print('Total Balance: {}'.format(snapshot.total_balance()))
+    print('Balance p50/p90/p99: {}'.format(snapshot.balance_percentiles()))
+    for address, balance in snapshot.top_accounts(arguments.top):
+        print('\t{}  {}'.format(address, balance))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,16 @@
 import random
-import glob
-import os
-import json
+from tip_index import TipIndex
 
 class Accounts:
-    def __init__(self):
+    def __init__(self, tip_index: TipIndex):
+        #tip_index is the one the node keeps current (Server.tip_index), so balances follow its writes
         self.address = hex(random.getrandbits(512))
         self.contractCode = None
         self.storage = None
+        self.tip_index = tip_index
         self.balance = self.getBalance()
 
 
     def getBalance(self):
-        try:
-            #opens as json and reads the balance of the state chain object
-            file_list = os.listdir(f"./accounts/{self.address}/states/")
-
-            with open(f"./accounts/{self.address}/states/{file_list[-1]}") as datfile:
-                data = json.load(datfile)
-
-            #returns most recent blance which is set to the self.balance attribute
-            return data["balance"]
-        except:
-            return None
-
-
+        #reads the balance at the tip of the account's state chain from the tip index
+        return self.tip_index.get_balance(self.address)
@@ -0,0 +1,188 @@
+# admission.py
+from ipaddress import ip_address
+from collections import OrderedDict
+from typing import Callable
+import threading
+import time
+
+# (tokens per second, burst) per request flag
+DEFAULT_RATE_LIMITS = {
+    1: (2.0, 5),     # version
+    2: (1.0, 5),     # address
+    3: (5.0, 10),    # states
+    4: (10.0, 20),   # data
+    5: (2.0, 10),    # heartbeat
+}
+DEFAULT_RATE_LIMIT = (10.0, 20)
+
+
+class TokenBucket:
+    """Allows rate events per second on average with bursts of up to capacity"""
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a full TokenBucket"""
+
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = now
+
+    # ------------------------------------------------------------------------------
+    def refill(self, now: float) -> None:
+        # --------------------------------------------------------------------------
+        """Adds the tokens earned since the last update"""
+
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+
+    # ------------------------------------------------------------------------------
+    def consume(self, now: float, amount: float = 1) -> bool:
+        # --------------------------------------------------------------------------
+        """Takes amount tokens if available. Returns False if the bucket is empty."""
+
+        self.refill(now)
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    # ------------------------------------------------------------------------------
+    def is_full(self, now: float) -> bool:
+        # --------------------------------------------------------------------------
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+# end TokenBucket class
+
+
+class AdmissionControl:
+    """Decides which inbound connections and requests a server handles. Caps the
+    number of concurrent inbound connections in total and per host, and rate
+    limits requests per host and message flag with token buckets. Rejections
+    are decided before a handler thread is started so an overloaded server
+    sheds load cheaply.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, max_connections: int = 64, max_connections_per_host: int = 8, rate_limits: dict = None,
+                 default_rate_limit: tuple = DEFAULT_RATE_LIMIT, read_timeout: float = 10.0, idle_timeout: float = 30.0,
+                 max_tracked_buckets: int = 10000, exempt_loopback: bool = True, clock: Callable = time.monotonic) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes AdmissionControl. rate_limits maps a request flag to
+        (tokens per second, burst); flags without an entry use
+        default_rate_limit. A limit of None disables rate limiting for that flag.
+        read_timeout is the number of seconds an admitted connection has to
+        deliver its first message, and to write the replies to each message;
+        idle_timeout is the number of seconds a stream may wait for its next
+        message. A connection that misses either is dropped. With exempt_loopback, connections from this
+        machine (local tools, benchmarks) only count towards max_connections.
+        """
+
+        self.max_connections = int(max_connections)
+        self.max_connections_per_host = int(max_connections_per_host)
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits)
+        self.default_rate_limit = default_rate_limit
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.max_tracked_buckets = int(max_tracked_buckets)
+        self.exempt_loopback = exempt_loopback
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.host_connections = {}
+        # (host, flag) -> TokenBucket, least recently used first
+        self.buckets = OrderedDict()
+
+    # ------------------------------------------------------------------------------
+    def admit(self, host: str) -> str:
+        # --------------------------------------------------------------------------
+        """Reserves a connection slot for host. Returns None if the connection is
+        admitted, otherwise the reason it was rejected ('overloaded' or
+        'host_limit'). Every admitted connection must be released.
+        """
+
+        with self.lock:
+            if self.max_connections > 0 and self.connections >= self.max_connections:
+                return 'overloaded'
+            host_count = self.host_connections.get(host, 0)
+            if self.max_connections_per_host > 0 and host_count >= self.max_connections_per_host \
+                    and not self.__is_exempt(host):
+                return 'host_limit'
+            self.connections += 1
+            self.host_connections[host] = host_count + 1
+
+        return None
+
+    # ------------------------------------------------------------------------------
+    def release(self, host: str) -> None:
+        # --------------------------------------------------------------------------
+        """Frees the connection slot reserved by admit()"""
+
+        with self.lock:
+            self.connections -= 1
+            host_count = self.host_connections.get(host, 0) - 1
+            if host_count > 0:
+                self.host_connections[host] = host_count
+            else:
+                self.host_connections.pop(host, None)
+
+    # ------------------------------------------------------------------------------
+    def allow_message(self, host: str, flag: int) -> bool:
+        # --------------------------------------------------------------------------
+        """Returns True if host may send another request with the given flag"""
+
+        limit = self.rate_limits.get(flag, self.default_rate_limit)
+        if limit is None or self.__is_exempt(host):
+            return True
+
+        now = self.clock()
+        key = (host, flag)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_tracked_buckets:
+                    self.__prune_buckets(now)
+                bucket = self.buckets[key] = TokenBucket(*limit, now=now)
+            else:
+                self.buckets.move_to_end(key)
+            return bucket.consume(now)
+
+    # ------------------------------------------------------------------------------
+    def __is_exempt(self, host: str) -> bool:
+        # --------------------------------------------------------------------------
+        if not self.exempt_loopback:
+            return False
+        try:
+            return ip_address(host).is_loopback
+        except ValueError:
+            return False
+
+    # ------------------------------------------------------------------------------
+    def __prune_buckets(self, now: float) -> None:
+        # --------------------------------------------------------------------------
+        """Forgets buckets that have refilled completely, since a new bucket would
+        start in the same state. If that does not make room for a new bucket, the
+        least recently used ones are evicted, so at most max_tracked_buckets are
+        ever tracked. Called with the lock held.
+        """
+
+        for key in [key for key, bucket in self.buckets.items() if bucket.is_full(now)]:
+            del self.buckets[key]
+        while len(self.buckets) > 0 and len(self.buckets) >= self.max_tracked_buckets:
+            self.buckets.popitem(last=False)
+
+    # ------------------------------------------------------------------------------
+    def status(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Returns the current connection counts"""
+
+        with self.lock:
+            return {'connections': self.connections, 'hosts': len(self.host_connections),
+                    'tracked_buckets': len(self.buckets)}
+
+# end AdmissionControl class
@@ -0,0 +1,140 @@
+# bench_memory.py
+"""Measures the memory held per object for what a node keeps in bulk: pending
+inventory items, peer tables, cached states and messages. Each slotted class
+is compared with the same fields kept in an instance __dict__, the layout
+these classes had before they were given __slots__.
+
+    python bench_memory.py                                  # 1,000,000 of each
+    python bench_memory.py --count 100000 --output bench_memory.json
+
+Field values are created before measuring and shared between objects, so the
+numbers are the cost of the objects themselves; the strings they point to
+cost the same in either layout.
+"""
+from inventory import InventoryItem
+from message import Message
+from state import State
+from peer import Peer
+from constants import PROTOCOL_VERSION, NODE_SERVICES, SUB_VERSION
+import tracemalloc
+import argparse
+import random
+import json
+import time
+import sys
+import gc
+
+# Distinct values per field; objects cycle through them
+VALUE_POOL_SIZE = 1000
+
+
+# ------------------------------------------------------------------------------
+def random_reference() -> str:
+    # --------------------------------------------------------------------------
+    return hex(random.getrandbits(256))
+
+
+# ------------------------------------------------------------------------------
+def sample_values() -> dict:
+    # --------------------------------------------------------------------------
+    """Returns {class: [field values of one object, ...]} with VALUE_POOL_SIZE
+    value tuples per class, in the order of the class's __slots__.
+    """
+
+    values = {InventoryItem: [], Peer: [], State: [], Message: []}
+    for index in range(VALUE_POOL_SIZE):
+        account = hex(random.getrandbits(160))
+        reference = random_reference()
+        host = '10.{}.{}.{}'.format(index // 65536, index // 256 % 256, index % 256)
+        peer = {'host': host, 'port': '6969', 'address': host + ':6969', 'network': 'IPv4',
+                'services': NODE_SERVICES, 'version': PROTOCOL_VERSION, 'sub_version': SUB_VERSION,
+                'timestamp': str(time.time()), 'nonce': random_reference(), 'start_accounts_count': 10,
+                'relay': False, 'max_states_in_transit': 10, 'states_requested': [], 'id': index}
+        state = {'nonce': str(index), 'previous_reference': random_reference(),
+                 'current_reference': reference, 'balance': random.getrandbits(40)}
+        message = {'type': 'request', 'flag': 4, 'timestamp': str(time.time()),
+                   'data': {'inventory_count': 1, 'inventory': ['{}/{}'.format(account, reference)]}}
+        item = {'type': 'state', 'account': account, 'data': reference}
+
+        for cls, fields in ((InventoryItem, item), (Peer, peer), (State, state), (Message, message)):
+            values[cls].append(tuple(fields[name] for name in cls.__slots__))
+
+    return values
+
+
+# ------------------------------------------------------------------------------
+def dict_backed(cls) -> type:
+    # --------------------------------------------------------------------------
+    """Returns a class holding the fields of cls in an instance __dict__"""
+
+    return type('DictBacked' + cls.__name__, (), {})
+
+
+# ------------------------------------------------------------------------------
+def measure(cls, fields: tuple, values: list, count: int) -> float:
+    # --------------------------------------------------------------------------
+    """Creates count instances of cls with fields set from values and returns
+    the bytes allocated per instance.
+    """
+
+    objects = [None] * count
+    gc.collect()
+    tracemalloc.start()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    for index in range(count):
+        instance = cls.__new__(cls)
+        for name, value in zip(fields, values[index % len(values)]):
+            setattr(instance, name, value)
+        objects[index] = instance
+    allocated = tracemalloc.get_traced_memory()[0] - start_bytes
+    tracemalloc.stop()
+
+    del objects
+    gc.collect()
+    return allocated / count
+
+
+# ------------------------------------------------------------------------------
+def run(count: int = 1000000) -> dict:
+    # --------------------------------------------------------------------------
+    """Returns {class name: {'slots': bytes, 'dict': bytes}} per object"""
+
+    results = {}
+    for cls, values in sample_values().items():
+        fields = cls.__slots__
+        results[cls.__name__] = {
+            'slots': measure(cls, fields, values, count),
+            'dict': measure(dict_backed(cls), fields, values, count),
+        }
+
+    return results
+
+
+# ------------------------------------------------------------------------------
+def main() -> None:
+    # --------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=1000000,
+                        help='objects of each kind to create')
+    parser.add_argument('--output', type=str, default=None,
+                        help='write the results to this JSON file')
+    arguments = parser.parse_args()
+
+    results = run(arguments.count)
+
+    print('{:<16} {:>12} {:>12} {:>8} {:>14} {:>14}'.format('Object', 'slots B/obj', 'dict B/obj', 'saved',
+                                                         'slots MB', 'dict MB'))
+    for name, result in results.items():
+        print('{:<16} {:>12.1f} {:>12.1f} {:>8.1%} {:>14.1f} {:>14.1f}'.format(
+            name, result['slots'], result['dict'], 1 - result['slots'] / result['dict'],
+            result['slots'] * arguments.count / 1e6, result['dict'] * arguments.count / 1e6))
+
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as output_file:
+            json.dump({'python': sys.version, 'created': time.time(), 'count': arguments.count,
+                       'results': results}, output_file, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
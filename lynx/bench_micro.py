@@ -0,0 +1,279 @@
+# bench_micro.py
+"""Microbenchmarks for the per-message primitives: message (de)serialization,
+signed message round trips, message validation, state parsing, peer
+construction and inventory operations.
+
+    python bench_micro.py                         # run and print results
+    python bench_micro.py --save bench_micro.json # store results as a baseline
+    python bench_micro.py --compare bench_micro.json --threshold 0.15
+
+In compare mode every benchmark slower than the baseline by more than the
+threshold is flagged and the exit code is 1.
+"""
+from message import Message, SignedMessage
+from message_validation import MessageValidation
+from inventory import Inventory
+from state import State
+from constants import PROTOCOL_VERSION, NODE_SERVICES, SUB_VERSION
+from typing import Callable
+import statistics
+import argparse
+import tempfile
+import random
+import json
+import time
+import sys
+import os
+
+INVENTORY_SIZES = (10, 1000, 100000, 1000000)
+BATCH_SIZE = 100
+
+
+# ------------------------------------------------------------------------------
+def measure(function: Callable, number: int, repeat: int = 5) -> float:
+    # --------------------------------------------------------------------------
+    """Calls function number times per round and returns the median seconds per
+    call over repeat rounds.
+    """
+
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start_time) / number)
+
+    return statistics.median(timings)
+
+
+# ------------------------------------------------------------------------------
+def calibrate(function: Callable, target: float = 0.05) -> int:
+    # --------------------------------------------------------------------------
+    """Returns how many calls of function take roughly target seconds"""
+
+    number = 1
+    while True:
+        start_time = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start_time
+        if elapsed >= target or number >= 1000000:
+            return number
+        number = number * 10 if elapsed < target / 10 else int(number * target / elapsed) + 1
+
+
+# ------------------------------------------------------------------------------
+def random_reference() -> str:
+    # --------------------------------------------------------------------------
+    return hex(random.getrandbits(256))
+
+
+# ------------------------------------------------------------------------------
+def sample_messages() -> dict:
+    # --------------------------------------------------------------------------
+    """Returns one valid message for each validate_* method"""
+
+    account = hex(random.getrandbits(160))
+    inventory = ['{}/{}'.format(account, random_reference()) for _ in range(10)]
+    return {
+        'version_request': Message('request', 1, {'version': PROTOCOL_VERSION, 'services': NODE_SERVICES,
+                                                  'timestamp': str(time.time()), 'nonce': random_reference(),
+                                                  'address_from': '127.0.0.1:6969', 'address_receive': '127.0.0.1:6968',
+                                                  'sub_version': SUB_VERSION, 'start_accounts_count': 10,
+                                                  'max_states_in_transit': 10, 'relay': False}),
+        'version_response': Message('response', 1, None),
+        'address_request': Message('request', 2, {'address_count': 1, 'address_list': ['127.0.0.1:6969']}),
+        'address_response': Message('response', 2, {'address_count': 10,
+                                                     'address_list': ['127.0.0.{}:6969'.format(i) for i in range(10)]}),
+        'states_request': Message('request', 3, {'version': PROTOCOL_VERSION, 'account': account,
+                                                 'best_state': random_reference()}),
+        'states_response': Message('response', 3, {'inventory_count': len(inventory), 'inventory': inventory}),
+        'data_request': Message('request', 4, {'inventory_count': len(inventory), 'inventory': inventory}),
+    }
+
+
+# ------------------------------------------------------------------------------
+def write_state_file(directory: str) -> str:
+    # --------------------------------------------------------------------------
+    """Writes a state file in the same format as the files under accounts/"""
+
+    path = os.path.join(directory, 'state1.dat')
+    state = State(nonce=str(random.getrandbits(32)), previous_reference=random_reference(),
+                  current_reference=random_reference(), balance=random.getrandbits(40))
+    with open(path, 'w') as state_file:
+        state_file.write(state.to_JSON())
+    return path
+
+
+# ------------------------------------------------------------------------------
+def benchmarks(directory: str, sizes: tuple) -> dict:
+    # --------------------------------------------------------------------------
+    """Returns {name: (function, number)} for every benchmark. number is None when
+    the benchmark should be calibrated.
+    """
+
+    messages = sample_messages()
+    cases = {}
+
+    for name in ('version_request', 'states_response'):
+        message = messages[name]
+        message_JSON = message.to_JSON()
+        cases['message_to_JSON[{}]'.format(name)] = (message.to_JSON, None)
+        cases['message_from_JSON[{}]'.format(name)] = (
+            lambda message_JSON=message_JSON: Message.from_JSON(message_JSON), None)
+
+    signed_message = SignedMessage(
+        message=messages['states_request'], signature=random.getrandbits(1024))
+    cases['signed_message_round_trip'] = (
+        lambda: SignedMessage.from_JSON(signed_message.to_JSON()), None)
+
+    for name, message in messages.items():
+        validate = getattr(MessageValidation, 'validate_' + name)
+        cases['validate_{}'.format(name)] = (
+            lambda validate=validate, message=message: validate(message=message), None)
+
+    state_path = write_state_file(directory)
+
+    def parse_state():
+        with open(state_path, 'r') as state_file:
+            return State.from_File(state_file)
+    cases['state_from_File'] = (parse_state, None)
+
+    from peer import Peer
+    peer_arguments = {'host': '127.0.0.1', 'port': '6969', 'services': NODE_SERVICES, 'version': PROTOCOL_VERSION,
+                      'sub_version': SUB_VERSION, 'timestamp': str(time.time()), 'nonce': random_reference(),
+                      'start_accounts_count': 10, 'relay': False}
+    for index in range(100):
+        Peer(**dict(peer_arguments, host='10.0.0.{}'.format(index)))
+    cases['peer_construction[100 known]'] = (
+        lambda: Peer(**peer_arguments), None)
+
+    for size in sizes:
+        items = ['{}/{}'.format(hex(random.getrandbits(160)), random_reference())
+                 for _ in range(size)]
+
+        def extend(items=items):
+            inventory = Inventory(inventory=[], on_extension=lambda flag: None)
+            inventory.extend(items)
+        cases['inventory_extend[{}]'.format(size)] = (
+            extend, max(1, 100000 // size))
+
+        inventory = Inventory(inventory=list(items),
+                              on_extension=lambda flag: None)
+
+        def get_batch(inventory=inventory):
+            # Put the batch back so the inventory keeps its size
+            inventory.inventory.extend(inventory.get_batch(BATCH_SIZE))
+        cases['inventory_get_batch[{}]'.format(size)] = (
+            get_batch, max(1, 1000000 // size))
+
+        def extend_packed(items=items):
+            inventory = Inventory(inventory=[], on_extension=lambda flag: None, packed=True)
+            inventory.extend(items)
+        cases['inventory_extend_packed[{}]'.format(size)] = (
+            extend_packed, max(1, 100000 // size))
+
+        packed_inventory = Inventory(inventory=list(items),
+                                     on_extension=lambda flag: None, packed=True)
+
+        def get_batch_packed(inventory=packed_inventory):
+            inventory.inventory.extend(inventory.get_batch(BATCH_SIZE))
+        cases['inventory_get_batch_packed[{}]'.format(size)] = (
+            get_batch_packed, max(1, 1000000 // size))
+
+    return cases
+
+
+# ------------------------------------------------------------------------------
+def run(sizes: tuple = INVENTORY_SIZES, name_filter: str = None, repeat: int = 5) -> dict:
+    # --------------------------------------------------------------------------
+    """Runs all benchmarks and returns {name: nanoseconds per call}"""
+
+    from log import set_level
+    set_level('peer', 'ERROR')
+
+    results = {}
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-micro-') as directory:
+        # Peer reads and writes ../known_peers.json
+        run_directory = os.path.join(directory, 'run')
+        os.makedirs(run_directory)
+        os.chdir(run_directory)
+        try:
+            for name, (function, number) in benchmarks(directory, sizes).items():
+                if name_filter is not None and name_filter not in name:
+                    continue
+                if number is None:
+                    number = calibrate(function)
+                results[name] = measure(function, number, repeat) * 1e9
+        finally:
+            os.chdir(working_directory)
+
+    return results
+
+
+# ------------------------------------------------------------------------------
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    # --------------------------------------------------------------------------
+    """Returns (name, baseline ns, current ns, change) for every benchmark that
+    is slower than its baseline by more than threshold.
+    """
+
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is not None and previous > 0:
+            change = (current - previous) / previous
+            if change > threshold:
+                regressions.append((name, previous, current, change))
+
+    return regressions
+
+
+# ------------------------------------------------------------------------------
+def main() -> None:
+    # --------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', type=str, default=None,
+                        help='write the results to this baseline file')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='compare the results against this baseline file')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative slowdown that counts as a regression')
+    parser.add_argument('--filter', type=str, default=None)
+    parser.add_argument('--max-size', type=int, default=max(INVENTORY_SIZES))
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    sizes = tuple(size for size in INVENTORY_SIZES if size <= arguments.max_size)
+    results = run(sizes, arguments.filter, arguments.repeat)
+
+    baseline = None
+    if arguments.compare is not None:
+        with open(arguments.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    for name, nanoseconds in results.items():
+        line = '{:<48} {:>14.1f} ns'.format(name, nanoseconds)
+        if baseline is not None and baseline.get(name):
+            line += '  {:>+7.1%}'.format((nanoseconds -
+                                          baseline[name]) / baseline[name])
+        print(line)
+
+    if arguments.save is not None:
+        with open(arguments.save, 'w') as baseline_file:
+            json.dump({'python': sys.version, 'created': time.time(),
+                       'results': results}, baseline_file, indent=4, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, arguments.threshold)
+        for name, previous, current, change in regressions:
+            print('REGRESSION {}: {:.1f} ns -> {:.1f} ns ({:+.1%})'.format(name,
+                  previous, current, change))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+# bench_network.py
+"""Starts N nodes on loopback ports, each in its own process and data directory,
+and runs scripted scenarios against them:
+
+    handshake   version handshakes per second against a single node
+    gossip      time until every node has learned the address of every other node
+    sync        states request followed by data requests for M accounts
+
+Results (throughput, p50/p99 latency, per-node CPU and peak RSS) are written as
+JSON. Example:
+
+    python bench_network.py --nodes 4 --accounts 100 --states 5 --output bench.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from peer_connection import PeerConnection
+from constants import PROTOCOL_VERSION
+from server import Server
+import subprocess
+import threading
+import argparse
+import tempfile
+import random
+import shutil
+import socket
+import json
+import time
+import uuid
+import sys
+import os
+
+
+# ------------------------------------------------------------------------------
+def percentile(values: list, fraction: float) -> float:
+    # --------------------------------------------------------------------------
+    """Returns the value below which the given fraction of values fall"""
+
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+# ------------------------------------------------------------------------------
+def summarize(latencies: list, seconds: float, operations: int = None) -> dict:
+    # --------------------------------------------------------------------------
+    """Returns throughput and latency percentiles (in milliseconds)"""
+
+    operations = len(latencies) if operations is None else operations
+    return {'operations': operations,
+            'seconds': seconds,
+            'throughput': operations / seconds if seconds > 0 else None,
+            'latency_ms': {'p50': percentile(latencies, 0.50) * 1000 if latencies else None,
+                           'p99': percentile(latencies, 0.99) * 1000 if latencies else None,
+                           'mean': sum(latencies) / len(latencies) * 1000 if latencies else None}}
+
+
+# ------------------------------------------------------------------------------
+def request(host: str, port: int, flag: int, data: dict) -> list:
+    # --------------------------------------------------------------------------
+    """Sends a single request and returns every reply until the node hangs up"""
+
+    peer_connection = PeerConnection(peer_id=None, host=host, port=port)
+    try:
+        peer_connection.send_data('request', flag, data)
+        replies = []
+        reply = peer_connection.receive_data()
+        while reply is not None:
+            replies.append(reply)
+            reply = peer_connection.receive_data()
+        return replies
+    finally:
+        peer_connection.close()
+
+
+# ------------------------------------------------------------------------------
+def generate_node_directory(root: str, index: int, accounts: int, states: int) -> tuple:
+    # --------------------------------------------------------------------------
+    """Creates root/node<index>/ with an accounts directory holding a chain of
+    states for each account. Nodes resolve their data relative to '..', so the
+    node has to be run from the returned run directory. Returns (run directory,
+    [(account, first reference), ...]).
+    """
+
+    node_directory = os.path.join(root, 'node{}'.format(index))
+    run_directory = os.path.join(node_directory, 'run')
+    os.makedirs(run_directory)
+
+    generated = []
+    for _ in range(accounts):
+        account = hex(random.getrandbits(160))
+        state_directory = os.path.join(
+            node_directory, 'accounts', account, 'states')
+        os.makedirs(state_directory)
+        previous_reference = hex(random.getrandbits(256))
+        first_reference = None
+        for nonce in range(1, states + 1):
+            current_reference = hex(random.getrandbits(256))
+            if first_reference is None:
+                first_reference = current_reference
+            with open(os.path.join(state_directory, 'state{}.dat'.format(nonce)), 'w') as state_file:
+                json.dump({'nonce': str(nonce), 'previous_reference': previous_reference,
+                           'current_reference': current_reference, 'balance': nonce * 10}, state_file, indent=4)
+            previous_reference = current_reference
+        generated.append((account, first_reference))
+
+    return run_directory, generated
+
+
+# ------------------------------------------------------------------------------
+def wait_for_port(port: int, timeout: float = 30.0) -> bool:
+    # --------------------------------------------------------------------------
+    """Waits until something accepts connections on 127.0.0.1:port"""
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+class NodeProcess:
+    """A benchmark node running in a child process"""
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, run_directory: str, port: int, arguments: list = None) -> None:
+        # --------------------------------------------------------------------------
+        """Starts the node process in run_directory, listening on port"""
+
+        if arguments is None:
+            arguments = []
+        self.port = port
+        self.usage = None
+        environment = dict(os.environ, LYNX_LOG_LEVEL=os.environ.get(
+            'LYNX_LOG_LEVEL', 'WARNING'))
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', '--port', str(port)] + arguments,
+                                        cwd=run_directory, env=environment, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, text=True)
+
+    # ------------------------------------------------------------------------------
+    def send(self, line: str) -> None:
+        # --------------------------------------------------------------------------
+        """Writes a control line to the worker"""
+
+        self.process.stdin.write(line + '\n')
+        self.process.stdin.flush()
+
+    # ------------------------------------------------------------------------------
+    def read_result(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Reads the next JSON line printed by the worker"""
+
+        line = self.process.stdout.readline()
+        return json.loads(line) if line.strip() else None
+
+    # ------------------------------------------------------------------------------
+    def stop(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Stops the worker and returns its CPU time and peak RSS"""
+
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+        # Reap the child ourselves, wait4 is the only way to get its own rusage
+        deadline = time.time() + 10
+        while self.usage is None:
+            pid, status, usage = os.wait4(self.process.pid, os.WNOHANG)
+            if pid != 0:
+                self.usage = usage
+                self.process.returncode = os.waitstatus_to_exitcode(status)
+            elif time.time() > deadline:
+                self.process.kill()
+                deadline = float('inf')
+            else:
+                time.sleep(0.05)
+
+        result = {'port': self.port}
+        if self.usage is not None:
+            result['cpu_seconds'] = self.usage.ru_utime + self.usage.ru_stime
+            result['peak_rss_kb'] = self.usage.ru_maxrss
+        return result
+
+# end NodeProcess class
+
+
+class NetworkBenchmark:
+    """Owns the node processes and runs the scenarios against them"""
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, nodes: int = 4, accounts: int = 100, states: int = 5, base_port: int = 7100, work_directory: str = None) -> None:
+        # --------------------------------------------------------------------------
+        """Generates a data directory for each node and starts the nodes"""
+
+        self.root = work_directory if work_directory is not None else tempfile.mkdtemp(
+            prefix='lynx-bench-')
+        self.ports = [base_port + index for index in range(nodes)]
+        self.accounts = []
+        self.nodes = []
+
+        for index, port in enumerate(self.ports):
+            # Only the first node serves state data to sync from
+            run_directory, generated = generate_node_directory(
+                self.root, index, accounts if index == 0 else 0, states)
+            if index == 0:
+                self.accounts = generated
+            seed = [] if index == 0 else ['--seed', str(self.ports[0])]
+            self.nodes.append(NodeProcess(run_directory, port, seed + [
+                '--expected', str(nodes - 1), '--bench-ports', ','.join(map(str, self.ports))]))
+
+        for port in self.ports:
+            if not wait_for_port(port):
+                raise RuntimeError('Node on port {} did not start'.format(port))
+
+    # ------------------------------------------------------------------------------
+    def run_handshake(self, handshakes: int = 1000, concurrency: int = 8) -> dict:
+        # --------------------------------------------------------------------------
+        """Sends version requests from distinct fake peers to the first node"""
+
+        port = self.ports[0]
+        latencies = []
+        lock = threading.Lock()
+        # Only builds the version messages, it never listens. Peer reads and
+        # writes ../known_peers.json, so it is created from a run directory.
+        run_directory = os.path.join(self.root, 'client', 'run')
+        os.makedirs(run_directory, exist_ok=True)
+        working_directory = os.getcwd()
+        os.chdir(run_directory)
+        try:
+            client = Server(nonce='bench', host='127.0.0.2', port=20000, max_peers=0,
+                            accounts_directory=os.path.join(self.root, 'client', 'accounts'))
+        finally:
+            os.chdir(working_directory)
+
+        def handshake(index: int) -> None:
+            message = client.make_version_message('127.0.0.1:{}'.format(port),
+                                                  address_from='127.0.0.2:{}'.format(20000 + index),
+                                                  nonce=uuid.uuid4().hex + uuid.uuid1().hex)
+            start_time = time.perf_counter()
+            request('127.0.0.1', port, 1, message)
+            with lock:
+                latencies.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(handshake, range(handshakes)))
+        return summarize(latencies, time.perf_counter() - start_time)
+
+    # ------------------------------------------------------------------------------
+    def run_gossip(self, timeout: float = 60.0) -> dict:
+        # --------------------------------------------------------------------------
+        """Tells every node but the seed to bootstrap from the seed and waits until
+        each one knows the addresses of all other nodes.
+        """
+
+        start_time = time.perf_counter()
+        for node in self.nodes[1:]:
+            node.send('gossip {}'.format(timeout))
+        results = [node.read_result() for node in self.nodes[1:]]
+        seconds = time.perf_counter() - start_time
+
+        converged = [result['seconds'] for result in results if result and result['converged']]
+        return {'nodes': len(self.nodes),
+                'converged_nodes': len(converged),
+                'seconds': seconds,
+                'convergence_ms': {'p50': percentile(converged, 0.50) * 1000 if converged else None,
+                                   'p99': percentile(converged, 0.99) * 1000 if converged else None,
+                                   'max': max(converged) * 1000 if converged else None},
+                'messages': sum(result['messages'] for result in results if result)}
+
+    # ------------------------------------------------------------------------------
+    def run_sync(self, concurrency: int = 8) -> dict:
+        # --------------------------------------------------------------------------
+        """For every account of the first node, requests its states and then the
+        data of every advertised state.
+        """
+
+        port = self.ports[0]
+        latencies = []
+        states_received = [0]
+        lock = threading.Lock()
+
+        def sync_account(account_reference: tuple) -> None:
+            account, first_reference = account_reference
+            start_time = time.perf_counter()
+            replies = request('127.0.0.1', port, 3, {'version': PROTOCOL_VERSION,
+                                                      'account': account, 'best_state': first_reference})
+            inventory = replies[0].data['inventory'] if replies else []
+            received = 0
+            if len(inventory) > 0:
+                replies = request('127.0.0.1', port, 4, {'inventory_count': len(inventory),
+                                                          'inventory': inventory})
+                received = replies[0].data['inventory_count'] if replies else 0
+            with lock:
+                latencies.append(time.perf_counter() - start_time)
+                states_received[0] += received
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(sync_account, self.accounts))
+        seconds = time.perf_counter() - start_time
+
+        summary = summarize(latencies, seconds)
+        summary['states_received'] = states_received[0]
+        summary['states_per_second'] = states_received[0] / seconds if seconds > 0 else None
+        return summary
+
+    # ------------------------------------------------------------------------------
+    def stop(self, keep: bool = False) -> list:
+        # --------------------------------------------------------------------------
+        """Stops all nodes and returns their resource usage"""
+
+        usage = [node.stop() for node in self.nodes]
+        if not keep:
+            shutil.rmtree(self.root, ignore_errors=True)
+        return usage
+
+# end NetworkBenchmark class
+
+
+# ------------------------------------------------------------------------------
+def run_worker(arguments) -> None:
+    # --------------------------------------------------------------------------
+    """Runs a node and answers control lines from the benchmark on stdin"""
+
+    from node import Node
+    from log import configure_logging
+
+    # stdout is the result channel back to the benchmark
+    configure_logging(stream=sys.stderr)
+    node = Node(server_host='127.0.0.1',
+                server_port=arguments.port, max_peers=0)
+    threading.Thread(target=node.server.start_server_listen,
+                     name='Server Thread', daemon=True).start()
+
+    for line in sys.stdin:
+        command = line.split()
+        if len(command) > 0 and command[0] == 'gossip':
+            result = gossip(node, arguments, float(command[1]))
+            print(json.dumps(result), flush=True)
+
+    node.server.shutdown = True
+
+
+# ------------------------------------------------------------------------------
+def gossip(node, arguments, timeout: float) -> dict:
+    # --------------------------------------------------------------------------
+    """Handshakes the seed, then keeps asking known peers for addresses and
+    handshaking every new one, until all benchmark nodes are known.
+    """
+
+    server = node.server
+    own_address = '127.0.0.1:{}'.format(arguments.port)
+    bench_addresses = set('127.0.0.1:{}'.format(port)
+                          for port in arguments.bench_ports.split(',')) - {own_address}
+    known = set()
+    handshaken = set()
+    messages = 0
+
+    start_time = time.perf_counter()
+    pending = ['127.0.0.1:{}'.format(arguments.seed)]
+    while len(known & bench_addresses) < arguments.expected and time.perf_counter() - start_time < timeout:
+        for address in pending:
+            if address not in handshaken:
+                host, port = address.split(':')
+                server.connect_and_send(host, port, 'request', 1,
+                                        server.make_version_message(address), dispatch=False)
+                handshaken.add(address)
+                messages += 1
+            known.add(address)
+
+        target = random.choice(sorted(handshaken))
+        host, port = target.split(':')
+        replies = server.connect_and_send(host, port, 'request', 2,
+                                          server.make_address_request(known), dispatch=False)
+        messages += 1
+        pending = []
+        for reply in replies:
+            if reply.type == 'response' and reply.flag == 2:
+                pending.extend(address for address in reply.data['address_list']
+                               if address in bench_addresses)
+
+    seconds = time.perf_counter() - start_time
+    return {'converged': len(known & bench_addresses) >= arguments.expected,
+            'seconds': seconds, 'known': len(known & bench_addresses), 'messages': messages}
+
+
+# ------------------------------------------------------------------------------
+def main() -> None:
+    # --------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--accounts', type=int, default=100)
+    parser.add_argument('--states', type=int, default=5)
+    parser.add_argument('--handshakes', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--base-port', type=int, default=7100)
+    parser.add_argument('--scenarios', type=str, default='handshake,gossip,sync')
+    parser.add_argument('--work-directory', type=str, default=None)
+    parser.add_argument('--keep', action='store_true')
+    parser.add_argument('--output', type=str, default=None)
+    # Worker options, used by the benchmark when it starts the node processes
+    parser.add_argument('--worker', action='store_true')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--expected', type=int, default=0)
+    parser.add_argument('--bench-ports', type=str, default='')
+    arguments = parser.parse_args()
+
+    if arguments.worker:
+        run_worker(arguments)
+        return
+
+    scenarios = arguments.scenarios.split(',')
+    benchmark = NetworkBenchmark(nodes=arguments.nodes, accounts=arguments.accounts, states=arguments.states,
+                                 base_port=arguments.base_port, work_directory=arguments.work_directory)
+    results = {'config': {'nodes': arguments.nodes, 'accounts': arguments.accounts, 'states': arguments.states,
+                          'handshakes': arguments.handshakes, 'concurrency': arguments.concurrency},
+               'scenarios': {}}
+    try:
+        if 'handshake' in scenarios:
+            results['scenarios']['handshake'] = benchmark.run_handshake(
+                arguments.handshakes, arguments.concurrency)
+        if 'gossip' in scenarios and arguments.nodes > 1:
+            results['scenarios']['gossip'] = benchmark.run_gossip()
+        if 'sync' in scenarios:
+            results['scenarios']['sync'] = benchmark.run_sync(
+                arguments.concurrency)
+    finally:
+        results['nodes'] = benchmark.stop(keep=arguments.keep)
+
+    output = json.dumps(results, indent=4)
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as output_file:
+            output_file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# bloom_filter.py
+from hashlib import sha256
+import base64
+import math
+
+
+class BloomFilter:
+    """Fixed size set membership filter. Lookups can return false positives at
+    roughly the rate the filter was sized for, but never false negatives.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, size: int, hash_count: int, bits: bytes = None) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a BloomFilter of size bits using hash_count hashes"""
+
+        self.size = max(8, int(size))
+        self.hash_count = max(1, int(hash_count))
+        self.bits = bytearray(bits) if bits is not None else bytearray(
+            (self.size + 7) // 8)
+        if len(self.bits) != (self.size + 7) // 8:
+            raise ValueError('Bloom filter bits do not match its size')
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def for_capacity(self, capacity: int, false_positive_rate: float = 0.01):
+        # --------------------------------------------------------------------------
+        """Returns an empty BloomFilter sized for capacity items at the given
+        false positive rate.
+        """
+
+        capacity = max(1, capacity)
+        size = math.ceil(-capacity * math.log(false_positive_rate) /
+                         (math.log(2) ** 2))
+        hash_count = round(size / capacity * math.log(2))
+        return BloomFilter(size, hash_count)
+
+    # ------------------------------------------------------------------------------
+    def __positions(self, item: str):
+        # --------------------------------------------------------------------------
+        """Yields the bit positions of item (double hashing over one SHA-256)"""
+
+        digest = sha256(item.encode()).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:16], 'little') | 1
+        for index in range(self.hash_count):
+            yield (first + index * second) % self.size
+
+    # ------------------------------------------------------------------------------
+    def add(self, item: str) -> None:
+        # --------------------------------------------------------------------------
+        for position in self.__positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    # ------------------------------------------------------------------------------
+    def __contains__(self, item: str) -> bool:
+        # --------------------------------------------------------------------------
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.__positions(item))
+
+    # ------------------------------------------------------------------------------
+    def to_dict(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Returns the filter in the form sent inside messages"""
+
+        return {'size': self.size, 'hashes': self.hash_count,
+                'bits': base64.b64encode(bytes(self.bits)).decode()}
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def from_dict(self, data: dict):
+        # --------------------------------------------------------------------------
+        """Returns a BloomFilter from the form produced by to_dict(). Raises
+        ValueError if data does not describe a valid filter.
+        """
+
+        try:
+            return BloomFilter(int(data['size']), int(data['hashes']),
+                               base64.b64decode(data['bits'], validate=True))
+        except (KeyError, TypeError, ValueError) as error:
+            raise ValueError('Invalid bloom filter') from error
+
+# end BloomFilter class
@@ -0,0 +1,115 @@
+# broadcast.py
+from __future__ import annotations
+from peer_connection import PeerConnection
+from peer_sender import PeerSender
+from log import get_logger
+from typing import TYPE_CHECKING
+import threading
+if TYPE_CHECKING:
+    from server import Server
+
+logger = get_logger(__name__)
+
+
+class BroadcastResult:
+    """Outcome of one broadcast. Each target peer moves from pending to sent
+    once the message was written to it, or to failed with the reason
+    ('unknown_peer', 'queue_full', 'send_failed' or 'shutdown').
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, peer_ids: list) -> None:
+        # --------------------------------------------------------------------------
+        self.pending = set(peer_ids)
+        self.sent = []
+        self.failed = {}
+        self.condition = threading.Condition()
+
+    # ------------------------------------------------------------------------------
+    def mark_sent(self, peer_id: str) -> None:
+        # --------------------------------------------------------------------------
+        with self.condition:
+            self.pending.discard(peer_id)
+            self.sent.append(peer_id)
+            self.condition.notify_all()
+
+    # ------------------------------------------------------------------------------
+    def mark_failed(self, peer_id: str, reason: str) -> None:
+        # --------------------------------------------------------------------------
+        with self.condition:
+            self.pending.discard(peer_id)
+            self.failed[peer_id] = reason
+            self.condition.notify_all()
+
+    # ------------------------------------------------------------------------------
+    def wait(self, timeout: float = None) -> bool:
+        # --------------------------------------------------------------------------
+        """Waits until no peer is pending. Returns False on timeout."""
+
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.pending) == 0, timeout)
+
+# end BroadcastResult class
+
+
+class Broadcaster:
+    """Sends one message to many peers. The message is encoded once and the
+    same bytes are queued for every target on that peer's PeerSender, whose
+    thread writes them to a stream kept open to the peer. Broadcasting to n
+    peers therefore costs one serialization and, once the streams are open,
+    no connections or threads.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, server: Server, max_queue: int = 256, idle_timeout: float = None) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a Broadcaster for server queueing at most max_queue messages
+        per peer. Streams idle for idle_timeout seconds are closed, by default
+        before the peer's idle timeout would drop them.
+        """
+
+        self.server = server
+        self.max_queue = int(max_queue)
+        self.idle_timeout = float(idle_timeout) if idle_timeout is not None \
+            else server.admission.idle_timeout / 2
+        self.senders = {}
+        self.lock = threading.Lock()
+
+    # ------------------------------------------------------------------------------
+    def get_sender(self, peer_id: str, host: str, port: int) -> PeerSender:
+        # --------------------------------------------------------------------------
+        with self.lock:
+            sender = self.senders.get(peer_id)
+            if sender is None:
+                sender = PeerSender(self.server, peer_id, host, port, max_queue=self.max_queue,
+                                    idle_timeout=self.idle_timeout)
+                self.senders[peer_id] = sender
+            return sender
+
+    # ------------------------------------------------------------------------------
+    def broadcast(self, message_type: str, message_flag: int, message_data, peer_ids: list = None) -> BroadcastResult:
+        # --------------------------------------------------------------------------
+        """Queues a message for peer_ids (every peer by default) and returns at
+        once. Use the result's wait() to find out which peers it reached.
+        """
+
+        peers = dict(self.server.peers)
+        peer_ids = list(peers) if peer_ids is None else list(peer_ids)
+        result = BroadcastResult(peer_ids)
+        message_binary = PeerConnection.encode(
+            message_type, message_flag, message_data)
+        self.server.metrics.inc('broadcasts_total', flag=message_flag)
+
+        for peer_id in peer_ids:
+            peer = peers.get(peer_id)
+            if peer is None:
+                result.mark_failed(peer_id, 'unknown_peer')
+                continue
+            self.get_sender(peer_id, peer.host, peer.port).enqueue(
+                message_binary, message_type, message_flag, result)
+
+        logger.debug('Broadcast flag %s message (%s bytes) to %s peers',
+                     message_flag, len(message_binary), len(peer_ids))
+        return result
+
+# end Broadcaster class
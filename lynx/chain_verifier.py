@@ -0,0 +1,309 @@
+# chain_verifier.py
+from constants import FIRST_NONCE
+from state import State
+from metrics import Metrics
+from log import get_logger
+from collections import OrderedDict
+from typing import Callable
+import threading
+
+logger = get_logger(__name__)
+
+
+class ChainVerifier:
+    """Checks that states form valid account chains before they are stored:
+    a chain starts with a state of nonce FIRST_NONCE, and every later state
+    must follow its predecessor's current_reference, have a higher nonce than
+    it, and carry a non-negative numeric balance. Batches are
+    verified one account at a time in the calling thread: the checks are pure
+    Python and lookups share the state store's lock, so a thread pool would
+    only add overhead.
+
+    Results are dicts of the form {'account', 'checked', 'valid', 'rejected',
+    'orphaned'} where rejected lists {'reference', 'reason'} for every refused
+    state and orphaned the references of states whose predecessor is not known
+    yet. filter() holds orphaned states until their predecessor arrives.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, metrics: Metrics = None, max_orphans: int = 10000) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a ChainVerifier counting its results in metrics. filter()
+        holds at most max_orphans states; beyond that the accounts held longest
+        are dropped first. It also remembers as many of the states it accepted,
+        which may not be stored yet when their successors arrive.
+        """
+
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.max_orphans = int(max_orphans)
+        self.lock = threading.Lock()
+        # account -> {reference: State}, accounts held longest first
+        self.orphans = {}
+        self.orphan_count = 0
+        # (account, reference) -> State accepted by filter(), oldest first
+        self.accepted = OrderedDict()
+        # account -> (number of its states in accepted, last one accepted)
+        self.accepted_accounts = {}
+        self.metrics.register_gauge('orphaned_states', lambda: self.orphan_count)
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def check_state(self, state: State, previous: State = None) -> str:
+        # --------------------------------------------------------------------------
+        """Returns why state cannot follow previous (which may be unknown), or None
+        if it can.
+        """
+
+        if isinstance(state.balance, bool) or not isinstance(state.balance, (int, float)) \
+                or state.balance < 0:
+            return 'balance'
+        try:
+            nonce = int(state.nonce)
+        except (TypeError, ValueError):
+            return 'nonce'
+
+        if previous is not None:
+            if state.previous_reference != previous.current_reference:
+                return 'linkage'
+            try:
+                if nonce <= int(previous.nonce):
+                    return 'nonce'
+            except (TypeError, ValueError):
+                return 'nonce'
+
+        return None
+
+    # ------------------------------------------------------------------------------
+    def verify_segment(self, account: str, states: list, previous: State = None) -> dict:
+        # --------------------------------------------------------------------------
+        """Verifies states given oldest first, the first one following previous.
+        Everything from the first invalid state on is rejected so that stored
+        chains stay linked.
+        """
+
+        result = self.__verify_segment(account, states, previous)
+        self.__count(result)
+        return result
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __verify_segment(self, account: str, states: list, previous: State) -> dict:
+        # --------------------------------------------------------------------------
+        result = {'account': account, 'checked': len(states),
+                  'valid': len(states), 'rejected': []}
+        seen = set()
+        for index, state in enumerate(states):
+            reason = 'duplicate' if state.current_reference in seen else self.check_state(
+                state, previous)
+            if reason is not None:
+                result['valid'] = index
+                result['rejected'] = [{'reference': rejected.current_reference,
+                                       'reason': reason if rejected is state else 'after_invalid'}
+                                      for rejected in states[index:]]
+                break
+            seen.add(state.current_reference)
+            previous = state
+
+        return result
+
+    # ------------------------------------------------------------------------------
+    def verify_account(self, account: str, states: list, lookup: Callable, get_tip: Callable) -> dict:
+        # --------------------------------------------------------------------------
+        """Verifies states of one account that may arrive in any order. States are
+        linked into segments; a segment whose predecessor is already known
+        (lookup(account, reference) returns it) is checked against it. A segment
+        whose predecessor is unknown is checked on its own only if it starts
+        the account's chain: its first state has FIRST_NONCE and the account
+        has no stored states (get_tip(account) returns None). Otherwise such a
+        segment is rejected as a fork if it starts at FIRST_NONCE, and
+        orphaned, neither valid nor rejected, if not. Of two states claiming
+        the same predecessor the later one is rejected as a fork; repeated
+        states are ignored.
+        """
+
+        by_reference = {}
+        children = {}
+        result = {'account': account, 'checked': len(states),
+                  'valid': 0, 'rejected': [], 'orphaned': []}
+        for state in states:
+            if state.current_reference in by_reference:
+                continue
+            if state.previous_reference in children:
+                result['rejected'].append(
+                    {'reference': state.current_reference, 'reason': 'fork'})
+                continue
+            by_reference[state.current_reference] = state
+            children[state.previous_reference] = state
+
+        roots = [(root, lookup(account, root.previous_reference)) for root in by_reference.values()
+                 if root.previous_reference not in by_reference]
+        # Whether the account's chain already has its first state
+        started = any(previous is None and self.__is_first(root) for root, previous in roots) \
+            and get_tip(account) is not None
+
+        covered = set()
+        for root, previous in roots:
+            segment = [root]
+            while segment[-1].current_reference in children:
+                segment.append(children[segment[-1].current_reference])
+            covered.update(state.current_reference for state in segment)
+            if previous is None:
+                if not self.__is_first(root):
+                    result['orphaned'].extend(state.current_reference for state in segment)
+                    continue
+                if started:
+                    result['rejected'].extend({'reference': state.current_reference, 'reason': 'fork'}
+                                              for state in segment)
+                    continue
+                # The chain starts here, any other first state is a fork
+                started = True
+            segment_result = self.__verify_segment(account, segment, previous)
+            result['valid'] += segment_result['valid']
+            result['rejected'].extend(segment_result['rejected'])
+
+        # States linked in a cycle never hang off a root
+        result['rejected'].extend({'reference': reference, 'reason': 'linkage'}
+                                  for reference in by_reference if reference not in covered)
+
+        self.__count(result)
+        return result
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __is_first(self, state: State) -> bool:
+        # --------------------------------------------------------------------------
+        try:
+            return int(state.nonce) == FIRST_NONCE
+        except (TypeError, ValueError):
+            return False
+
+    # ------------------------------------------------------------------------------
+    def verify_batch(self, items: list, lookup: Callable, get_tip: Callable) -> dict:
+        # --------------------------------------------------------------------------
+        """Verifies a batch of (account, state) pairs, one account at a time.
+        Returns {account: result}.
+        """
+
+        accounts = {}
+        for account, state in items:
+            accounts.setdefault(account, []).append(state)
+
+        return {account: self.verify_account(account, states, lookup, get_tip)
+                for account, states in accounts.items()}
+
+    # ------------------------------------------------------------------------------
+    def filter(self, items: list, lookup: Callable, get_tip: Callable) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the (account, state) pairs of a batch that verified. States
+        accepted by earlier calls count as known even before they are stored.
+        Orphaned states are held back, verified again with later batches of
+        their account, and returned once their predecessor has arrived.
+        """
+
+        def lookup_accepted(account: str, reference: str) -> State:
+            state = lookup(account, reference)
+            return state if state is not None else self.accepted.get((account, reference))
+
+        def get_accepted_tip(account: str) -> State:
+            tip = get_tip(account)
+            if tip is None and account in self.accepted_accounts:
+                # Its first states are accepted but not stored yet
+                return self.accepted_accounts[account][1]
+            return tip
+
+        with self.lock:
+            held = []
+            for account in set(account for account, _ in items):
+                orphans = self.orphans.pop(account, None)
+                if orphans is not None:
+                    self.orphan_count -= len(orphans)
+                    held.extend((account, state) for state in orphans.values())
+
+        valid_items = []
+        pending = items + held if len(held) > 0 else items
+        while len(pending) > 0:
+            results = self.verify_batch(pending, lookup_accepted, get_accepted_tip)
+            excluded = {(account, item['reference'])
+                        for account, result in results.items() for item in result['rejected']}
+            orphaned = {(account, reference)
+                        for account, result in results.items() for reference in result['orphaned']}
+            for account, result in results.items():
+                if len(result['rejected']) > 0:
+                    logger.warning('Rejected %s states of %s (%s)', len(result['rejected']), account,
+                                   result['rejected'][0]['reason'])
+
+            accepted = [(account, state) for account, state in pending
+                        if (account, state.current_reference) not in excluded
+                        and (account, state.current_reference) not in orphaned]
+            self.__remember(accepted)
+            valid_items.extend(accepted)
+            pending = self.__hold([(account, state) for account, state in pending
+                                   if (account, state.current_reference) in orphaned])
+
+        return valid_items
+
+    # ------------------------------------------------------------------------------
+    def __remember(self, items: list) -> None:
+        # --------------------------------------------------------------------------
+        """Records accepted (account, state) pairs, forgetting the oldest beyond
+        max_orphans.
+        """
+
+        with self.lock:
+            for account, state in items:
+                key = (account, state.current_reference)
+                if key in self.accepted:
+                    self.accepted.move_to_end(key)
+                    continue
+                self.accepted[key] = state
+                count, _ = self.accepted_accounts.get(account, (0, None))
+                self.accepted_accounts[account] = (count + 1, state)
+            while len(self.accepted) > self.max_orphans:
+                (account, _), _ = self.accepted.popitem(last=False)
+                count, last = self.accepted_accounts[account]
+                if count > 1:
+                    self.accepted_accounts[account] = (count - 1, last)
+                else:
+                    del self.accepted_accounts[account]
+
+    # ------------------------------------------------------------------------------
+    def __hold(self, items: list) -> list:
+        # --------------------------------------------------------------------------
+        """Holds orphaned (account, state) pairs, dropping the accounts held
+        longest once more than max_orphans states are held. Returns the pairs of
+        accounts whose missing predecessor was accepted by another thread in
+        the meantime, to be verified again instead.
+        """
+
+        accounts = {}
+        for account, state in items:
+            accounts.setdefault(account, []).append(state)
+
+        retry = []
+        with self.lock:
+            for account, states in accounts.items():
+                if any((account, state.previous_reference) in self.accepted for state in states):
+                    retry.extend((account, state) for state in states)
+                    continue
+                orphans = self.orphans.setdefault(account, {})
+                for state in states:
+                    if state.current_reference not in orphans:
+                        orphans[state.current_reference] = state
+                        self.orphan_count += 1
+            while self.orphan_count > self.max_orphans:
+                account = next(iter(self.orphans))
+                dropped = self.orphans.pop(account)
+                self.orphan_count -= len(dropped)
+                self.metrics.inc('states_orphans_dropped_total', len(dropped))
+                logger.debug('Dropped %s orphaned states of %s', len(dropped), account)
+
+        return retry
+
+    # ------------------------------------------------------------------------------
+    def __count(self, result: dict) -> None:
+        # --------------------------------------------------------------------------
+        self.metrics.inc('states_verified_total', result['valid'])
+        for item in result['rejected']:
+            self.metrics.inc('states_rejected_total', reason=item['reason'])
+
+# end ChainVerifier class
@@ -1,3 +1,13 @@
 PROTOCOL_VERSION = 10001
-NODE_SERVICES = ['NODE_NETWORK']
+# Service of nodes that accept data requests with an encoded inventory (see
+# inventory_reference.encode_inventory)
+PACKED_INVENTORY_SERVICE = 'NODE_PACKED_INVENTORY'
+NODE_SERVICES = ['NODE_NETWORK', PACKED_INVENTORY_SERVICE]
 SUB_VERSION = '/LynxCore:0.0.0.1/'
+# Nonce of the first state of every account chain
+FIRST_NONCE = 1
+MAX_ADDRESSES_PER_RESPONSE = 100
+MAX_BLOOM_FILTER_BYTES = 36000
+MAX_BLOOM_FILTER_HASHES = 50
+MAX_REFERENCES_PER_RESPONSE = 2000
+MAX_STATES_PER_RESPONSE = 500
@@ -0,0 +1,145 @@
+# deadline.py
+from typing import Callable
+import threading
+import weakref
+import socket
+import time
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when an operation runs past its deadline"""
+
+
+class OperationCancelled(ConnectionAbortedError):
+    """Raised when an operation's deadline was cancelled"""
+
+
+class Deadline:
+    """The time by which an operation, and everything it does on the network,
+    must finish. A deadline made from a parent never outlives it, so a limit
+    set by a caller carries through to every connect, send and receive
+    underneath. Cancelling a deadline cancels its children and shuts down the
+    sockets attached to them, which releases any thread blocked on them.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, timeout: float = None, parent=None, clock: Callable = time.monotonic) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a Deadline expiring timeout seconds from now (never if
+        None), or with parent if that expires sooner.
+        """
+
+        self.clock = clock
+        self.expires_at = None if timeout is None else clock() + max(0.0, float(timeout))
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.sockets = set()
+        self.children = weakref.WeakSet()
+
+        if parent is not None:
+            if parent.expires_at is not None and (self.expires_at is None or parent.expires_at < self.expires_at):
+                self.expires_at = parent.expires_at
+            with parent.lock:
+                parent.children.add(self)
+                self.cancelled = parent.cancelled
+
+    # ------------------------------------------------------------------------------
+    def child(self, timeout: float = None):
+        # --------------------------------------------------------------------------
+        """Returns a Deadline expiring in timeout seconds or with this one"""
+
+        return Deadline(timeout, parent=self, clock=self.clock)
+
+    # ------------------------------------------------------------------------------
+    def remaining(self) -> float:
+        # --------------------------------------------------------------------------
+        """Returns the seconds left (never negative), or None without a limit"""
+
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - self.clock())
+
+    # ------------------------------------------------------------------------------
+    def expired(self) -> bool:
+        # --------------------------------------------------------------------------
+        return self.expires_at is not None and self.clock() >= self.expires_at
+
+    # ------------------------------------------------------------------------------
+    def done(self) -> bool:
+        # --------------------------------------------------------------------------
+        """Returns True once the deadline was cancelled or has expired"""
+
+        return self.cancelled or self.expired()
+
+    # ------------------------------------------------------------------------------
+    def check(self) -> None:
+        # --------------------------------------------------------------------------
+        """Raises OperationCancelled or DeadlineExceeded if the operation must stop"""
+
+        if self.cancelled:
+            raise OperationCancelled('Operation cancelled')
+        if self.expired():
+            raise DeadlineExceeded('Deadline exceeded')
+
+    # ------------------------------------------------------------------------------
+    def timeout(self, limit: float = None) -> float:
+        # --------------------------------------------------------------------------
+        """Returns the value to pass to settimeout() before a blocking call: the
+        seconds left, at most limit. Raises like check() if none are left.
+        """
+
+        self.check()
+        remaining = self.remaining()
+        if limit is None:
+            return remaining
+        return limit if remaining is None else min(limit, remaining)
+
+    # ------------------------------------------------------------------------------
+    def attach(self, sock) -> None:
+        # --------------------------------------------------------------------------
+        """Shuts down sock if this deadline is cancelled while it is attached. A
+        socket attached after cancellation is shut down at once.
+        """
+
+        with self.lock:
+            if not self.cancelled:
+                self.sockets.add(sock)
+                return
+        self.__abort(sock)
+
+    # ------------------------------------------------------------------------------
+    def detach(self, sock) -> None:
+        # --------------------------------------------------------------------------
+        with self.lock:
+            self.sockets.discard(sock)
+
+    # ------------------------------------------------------------------------------
+    def cancel(self) -> None:
+        # --------------------------------------------------------------------------
+        """Cancels this deadline and its children. Blocked sends and receives on
+        attached sockets return at once; later ones raise OperationCancelled.
+        """
+
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            sockets, self.sockets = self.sockets, set()
+            children = list(self.children)
+
+        for sock in sockets:
+            self.__abort(sock)
+        for child in children:
+            child.cancel()
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __abort(self, sock) -> None:
+        # --------------------------------------------------------------------------
+        # shutdown, unlike close, wakes a thread blocked in recv on the socket
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+# end Deadline class
@@ -0,0 +1,260 @@
+# event_loop.py
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from peer_connection import RECEIVE_BUFFER_SIZE, MessageTooLarge
+from log import get_logger
+from typing import TYPE_CHECKING
+from collections import deque
+import selectors
+import threading
+import socket
+import time
+if TYPE_CHECKING:
+    from peer_connection import PeerConnection
+    from server import Server
+
+logger = get_logger(__name__)
+
+
+class EventLoop:
+    """Multiplexes a server's listening socket and all inbound connections in a
+    single thread with selectors (epoll on Linux). Once a complete message has
+    been read from a connection it is handed to a worker pool, which handles it
+    through the server and closes the connection, so the number of open
+    connections no longer decides the number of threads. Streams (connections
+    the server keeps open) are handed back by the worker and read again.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, server: Server, listener, workers: int = 8, max_pending: int = None, sweep_interval: float = 1.0) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an EventLoop for server accepting on listener. At most
+        max_pending messages (4 per worker by default) wait for a worker before
+        new messages are rejected. Idle connections are checked every
+        sweep_interval seconds.
+        """
+
+        self.server = server
+        self.listener = listener
+        self.workers = int(workers)
+        self.max_pending = max_pending if max_pending is not None else self.workers * 4
+        self.sweep_interval = sweep_interval
+
+        self.selector = selectors.DefaultSelector()
+        self.executor = None
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        # PeerConnection -> time its read (or, for a stream, idle) deadline expires
+        self.deadlines = {}
+        # Streams handed back by workers, re-armed by the loop thread
+        self.resumed = deque()
+        self.wake_reader, self.wake_writer = socket.socketpair()
+
+    # ------------------------------------------------------------------------------
+    def run(self) -> None:
+        # --------------------------------------------------------------------------
+        """Serves connections until the server shuts down"""
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='Worker Thread')
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ, None)
+        self.wake_reader.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, self.resumed)
+        next_sweep = time.monotonic() + self.sweep_interval
+
+        try:
+            while not self.server.shutdown:
+                for key, _ in self.selector.select(timeout=self.sweep_interval):
+                    if key.data is None:
+                        self.__accept()
+                    elif key.data is self.resumed:
+                        self.__resume_streams()
+                    else:
+                        self.__read(key.data)
+
+                if time.monotonic() >= next_sweep:
+                    self.__sweep()
+                    next_sweep = time.monotonic() + self.sweep_interval
+        except KeyboardInterrupt:
+            logger.info('KeyboardInterrupt: stopping event loop')
+            self.server.shutdown = True
+        finally:
+            self.close()
+
+    # ------------------------------------------------------------------------------
+    def close(self) -> None:
+        # --------------------------------------------------------------------------
+        """Closes the listener and every connection still being read"""
+
+        for peer_connection in list(self.deadlines):
+            self.__drop(peer_connection)
+        try:
+            self.selector.unregister(self.listener)
+        except (KeyError, ValueError):
+            pass
+        for peer_connection in list(self.resumed):
+            self.server.close_inbound(peer_connection)
+        self.resumed.clear()
+        self.selector.close()
+        self.listener.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    # ------------------------------------------------------------------------------
+    def __accept(self) -> None:
+        # --------------------------------------------------------------------------
+        """Accepts every connection waiting on the listener"""
+
+        while True:
+            try:
+                client_socket, client_address = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                logger.warning('Unable to accept connection', exc_info=True)
+                return
+
+            peer_connection = self.server.open_inbound(
+                client_socket, client_address)
+            if peer_connection is None:
+                continue
+
+            client_socket.setblocking(False)
+            self.deadlines[peer_connection] = time.monotonic() + \
+                self.server.admission.read_timeout
+            self.selector.register(
+                client_socket, selectors.EVENT_READ, peer_connection)
+
+    # ------------------------------------------------------------------------------
+    def __read(self, peer_connection: PeerConnection) -> None:
+        # --------------------------------------------------------------------------
+        """Reads what is available on a connection and dispatches the message once
+        it is complete.
+        """
+
+        try:
+            message_binary = peer_connection.s.recv(RECEIVE_BUFFER_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.__drop(peer_connection)
+            return
+
+        try:
+            if message_binary:
+                message = peer_connection.feed_data(message_binary)
+                if message is None:
+                    return
+            else:
+                message = peer_connection.flush_data()
+        except MessageTooLarge:
+            logger.warning('Dropping %s:%s, message exceeds %s bytes', peer_connection.host,
+                           peer_connection.port, peer_connection.max_message_size)
+            self.__drop(peer_connection)
+            return
+        except Exception:
+            logger.debug('Unable to receive data', exc_info=True)
+            message = None
+
+        self.__unregister(peer_connection)
+        self.__dispatch(peer_connection, message)
+
+    # ------------------------------------------------------------------------------
+    def __dispatch(self, peer_connection: PeerConnection, message) -> None:
+        # --------------------------------------------------------------------------
+        """Hands a message to the worker pool, or rejects it if too many messages
+        are already waiting for a worker.
+        """
+
+        with self.pending_lock:
+            if self.pending >= self.max_pending:
+                overloaded = True
+            else:
+                overloaded = False
+                self.pending += 1
+
+        if overloaded:
+            self.server.metrics.inc(
+                'connections_rejected_total', reason='workers_busy')
+            self.server.close_inbound(peer_connection)
+            return
+
+        # Replies are written by the worker with ordinary blocking sends
+        peer_connection.s.settimeout(self.server.admission.read_timeout)
+        self.executor.submit(self.__work, peer_connection, message)
+
+    # ------------------------------------------------------------------------------
+    def __work(self, peer_connection: PeerConnection, message) -> None:
+        # --------------------------------------------------------------------------
+        try:
+            if self.server.handle_inbound(peer_connection, message):
+                self.resumed.append(peer_connection)
+                try:
+                    self.wake_writer.send(b'\0')
+                except OSError:
+                    pass
+        finally:
+            with self.pending_lock:
+                self.pending -= 1
+
+    # ------------------------------------------------------------------------------
+    def __resume_streams(self) -> None:
+        # --------------------------------------------------------------------------
+        """Reads streams again once a worker has handled their last message. A
+        message that already arrived with the previous one is dispatched now.
+        """
+
+        try:
+            while self.wake_reader.recv(RECEIVE_BUFFER_SIZE):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        while len(self.resumed) > 0:
+            peer_connection = self.resumed.popleft()
+            try:
+                peer_connection.s.setblocking(False)
+                message = peer_connection.feed_data(b'')
+            except Exception:
+                logger.debug('Unable to resume stream', exc_info=True)
+                self.server.close_inbound(peer_connection)
+                continue
+
+            if message is not None:
+                self.__dispatch(peer_connection, message)
+                continue
+            self.deadlines[peer_connection] = time.monotonic() + \
+                self.server.admission.idle_timeout
+            self.selector.register(
+                peer_connection.s, selectors.EVENT_READ, peer_connection)
+
+    # ------------------------------------------------------------------------------
+    def __sweep(self) -> None:
+        # --------------------------------------------------------------------------
+        """Drops connections that did not deliver a message before their deadline"""
+
+        now = time.monotonic()
+        for peer_connection, deadline in list(self.deadlines.items()):
+            if deadline <= now:
+                self.server.metrics.inc('connections_timed_out_total')
+                self.__drop(peer_connection)
+
+    # ------------------------------------------------------------------------------
+    def __unregister(self, peer_connection: PeerConnection) -> None:
+        # --------------------------------------------------------------------------
+        self.deadlines.pop(peer_connection, None)
+        try:
+            self.selector.unregister(peer_connection.s)
+        except (KeyError, ValueError):
+            pass
+
+    # ------------------------------------------------------------------------------
+    def __drop(self, peer_connection: PeerConnection) -> None:
+        # --------------------------------------------------------------------------
+        self.__unregister(peer_connection)
+        self.server.close_inbound(peer_connection)
+
+# end EventLoop class
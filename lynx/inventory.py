@@ -1,9 +1,15 @@
 from typing import Callable
 from peer import Peer
+from inventory_reference import ReferenceArray, pack_items
+from log import get_logger
+
+logger = get_logger(__name__)
 
 
 class InventoryItem:
 
+    __slots__ = ('type', 'account', 'data')
+
     # ------------------------------------------------------------------------------
     def __init__(self, type: str, account: str = None, data: str = None) -> None:
         # --------------------------------------------------------------------------
@@ -13,15 +19,36 @@ class InventoryItem:
         self.account = account
         self.data = data
 
+    # ------------------------------------------------------------------------------
+    def to_dict(self) -> dict:
+        # --------------------------------------------------------------------------
+        return {'type': self.type, 'account': self.account, 'data': self.data}
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def from_dict(self, data: dict):
+        # --------------------------------------------------------------------------
+        """Returns an InventoryItem given a dict like the one to_dict returns"""
+
+        return InventoryItem(type=data['type'], account=data.get('account'), data=data.get('data'))
+
 
 class Inventory:
 
     # ------------------------------------------------------------------------------
-    def __init__(self, inventory: list = [], on_extension: Callable[[int], None] = lambda: None) -> None:
+    def __init__(self, inventory: list = [], on_extension: Callable[[int], None] = lambda: None, packed: bool = False) -> None:
         # --------------------------------------------------------------------------
-        """Initializes an Inventory object"""
-
-        self.inventory = inventory
+        """Initializes an Inventory object. A packed inventory keeps its
+        'account/reference' items as InventoryReferences in a ReferenceArray and
+        returns them as InventoryReferences from get_batch. Items whose values
+        cannot be packed (see pack_items) are kept, and returned, as strings.
+        """
+
+        self.packed = packed
+        self.unpacked = []
+        self.inventory = ReferenceArray() if packed else inventory
+        if packed:
+            self.__pack(inventory)
         self.on_extension = on_extension
 
     # ------------------------------------------------------------------------------
@@ -29,7 +56,24 @@ class Inventory:
         # --------------------------------------------------------------------------
         """"""
 
-        return len(self.inventory)
+        return len(self.inventory) + len(self.unpacked)
+
+    # ------------------------------------------------------------------------------
+    def __pack(self, items: list) -> None:
+        # --------------------------------------------------------------------------
+        """Adds items to the ReferenceArray, packed in one go. 'account/reference'
+        items that cannot be packed are added to unpacked instead, anything else
+        is left out.
+        """
+
+        packed, rest = pack_items(items)
+        self.inventory.extend_packed(packed)
+        for item in rest:
+            if isinstance(item, str) and item.count('/') == 1:
+                logger.debug('Keeping unpackable inventory item %r', item)
+                self.unpacked.append(item)
+            else:
+                logger.warning('Dropping inventory item %r', item)
 
     # ------------------------------------------------------------------------------
     def append(self, new_inventory: InventoryItem) -> bool:
@@ -37,7 +81,10 @@ class Inventory:
         """"""
 
         if new_inventory is not None and len(new_inventory) > 0:
-            self.inventory.append(new_inventory)
+            if self.packed:
+                self.__pack([new_inventory])
+            else:
+                self.inventory.append(new_inventory)
             return True
         return False
 
@@ -47,7 +94,10 @@ class Inventory:
         """"""
 
         if new_inventory is not None and len(new_inventory) > 0:
-            self.inventory.extend(new_inventory)
+            if self.packed:
+                self.__pack(new_inventory)
+            else:
+                self.inventory.extend(new_inventory)
             self.on_extension(4)
             return True
         return False
@@ -57,6 +107,14 @@ class Inventory:
         # --------------------------------------------------------------------------
         """"""
 
+        if self.packed:
+            inventory_batch = self.inventory.take(amount)
+            if len(self.unpacked) > 0 and len(inventory_batch) < amount:
+                count = amount - len(inventory_batch)
+                inventory_batch.extend(self.unpacked[:count])
+                del self.unpacked[:count]
+            return inventory_batch
+
         inventory_batch = []
 
         if len(self.inventory) > 0:
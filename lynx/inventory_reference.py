@@ -0,0 +1,399 @@
+# inventory_reference.py
+from log import get_logger
+from itertools import repeat
+import binascii
+import struct
+import base64
+import re
+
+logger = get_logger(__name__)
+
+# Bytes of the value part of each field; a field is a header byte and its value.
+# An account is a 20 byte address followed by the case of each of its 40 hex
+# digits, one bit per digit, so that checksummed (EIP-55) addresses round-trip.
+ACCOUNT_WIDTH = 20
+CASE_WIDTH = 5
+REFERENCE_WIDTH = 32
+ACCOUNT_SIZE = 1 + ACCOUNT_WIDTH + CASE_WIDTH
+RECORD_SIZE = ACCOUNT_SIZE + 1 + REFERENCE_WIDTH
+# Header bit marking a value stored as ASCII rather than as a hex number
+RAW_FIELD = 0x80
+RECORDS = struct.Struct('%ds' % RECORD_SIZE)
+
+ACCOUNT_HEX = re.compile('0x[0-9a-fA-F]{1,%d}' % (2 * ACCOUNT_WIDTH))
+REFERENCE_HEX = re.compile('0x[0-9a-f]{1,%d}' % (2 * REFERENCE_WIDTH))
+NO_CASE = bytes(CASE_WIDTH)
+CASE_BITS = str.maketrans('0123456789abcdefABCDEF', '0' * 16 + '1' * 6)
+# The same for whole batches of ASCII digits (see pack_hex_items)
+LOWER_DIGITS = b'0123456789abcdef'
+DIGITS = LOWER_DIGITS + b'ABCDEF'
+CASE_BYTES = bytes.maketrans(DIGITS, b'0' * 16 + b'1' * 6)
+DIGIT_COUNTS = bytes((length - 2) % 256 for length in range(256))
+# Smaller batches are packed one item at a time, which is faster for them, and
+# larger ones in parts that fit in the CPU caches
+MIN_COLUMN_BATCH = 32
+MAX_COLUMN_BATCH = 4096
+HEADERS = [bytes((header,)) for header in range(256)]
+
+
+# ------------------------------------------------------------------------------
+def pack_field(value: str, width: int) -> bytes:
+    # --------------------------------------------------------------------------
+    """Packs a reference into 1 + width bytes. Lowercase '0x' hex is stored as a
+    number with its digit count, so leading zeros survive; any other ASCII value
+    of at most width characters is stored as is. Raises ValueError otherwise.
+    """
+
+    if REFERENCE_HEX.fullmatch(value):
+        digits = value[2:]
+        return HEADERS[len(digits)] + bytes.fromhex(digits.rjust(2 * width, '0'))
+
+    raw = value.encode('ascii')
+    if len(raw) > width:
+        raise ValueError('{!r} does not fit in {} bytes'.format(value, width))
+    return HEADERS[RAW_FIELD | len(raw)] + raw.ljust(width, b'\0')
+
+
+# ------------------------------------------------------------------------------
+def unpack_field(field: bytes) -> str:
+    # --------------------------------------------------------------------------
+    """Returns the value packed by pack_field"""
+
+    header = field[0]
+    if header & RAW_FIELD:
+        return field[1:1 + (header & ~RAW_FIELD)].decode('ascii')
+    digits = field[1:].hex()
+    if header == 0 or header > len(digits):
+        raise ValueError('Invalid inventory reference field')
+    return '0x' + digits[len(digits) - header:]
+
+
+# ------------------------------------------------------------------------------
+def pack_account(account: str) -> bytes:
+    # --------------------------------------------------------------------------
+    """Packs an account into ACCOUNT_SIZE bytes. '0x' hex of any case is stored
+    as a 20 byte number with its digit count and the case of every digit; any
+    other ASCII value of at most ACCOUNT_WIDTH + CASE_WIDTH characters is stored
+    as is. Raises ValueError otherwise.
+    """
+
+    if ACCOUNT_HEX.fullmatch(account):
+        digits = account[2:].rjust(2 * ACCOUNT_WIDTH, '0')
+        if digits.lower() == digits:
+            return HEADERS[len(account) - 2] + bytes.fromhex(digits) + NO_CASE
+        return HEADERS[len(account) - 2] + bytes.fromhex(digits) + \
+            int(digits.translate(CASE_BITS), 2).to_bytes(CASE_WIDTH, 'big')
+
+    raw = account.encode('ascii')
+    if len(raw) > ACCOUNT_WIDTH + CASE_WIDTH:
+        raise ValueError('{!r} does not fit in {} bytes'.format(account, ACCOUNT_WIDTH + CASE_WIDTH))
+    return HEADERS[RAW_FIELD | len(raw)] + raw.ljust(ACCOUNT_WIDTH + CASE_WIDTH, b'\0')
+
+
+# ------------------------------------------------------------------------------
+def unpack_account(field: bytes) -> str:
+    # --------------------------------------------------------------------------
+    """Returns the account packed by pack_account"""
+
+    header = field[0]
+    if header & RAW_FIELD:
+        return field[1:1 + (header & ~RAW_FIELD)].decode('ascii')
+    if header == 0 or header > 2 * ACCOUNT_WIDTH:
+        raise ValueError('Invalid inventory reference field')
+
+    digits = field[1:1 + ACCOUNT_WIDTH].hex()
+    case = int.from_bytes(field[1 + ACCOUNT_WIDTH:ACCOUNT_SIZE], 'big')
+    if case != 0:
+        digits = ''.join(digit.upper() if bit == '1' else digit
+                         for digit, bit in zip(digits, format(case, '0%db' % (2 * ACCOUNT_WIDTH))))
+    return '0x' + digits[len(digits) - header:]
+
+
+class InventoryReference(bytes):
+    """An 'account/reference' inventory item packed into RECORD_SIZE bytes, the
+    account field followed by the reference field (see pack_account and
+    pack_field). Being
+    fixed-width bytes, references hash and compare at C speed, can be kept as
+    set and dict keys in place of the strings, and are stored back to back in
+    a ReferenceArray or an encoded data request.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def pack(self, account: str, reference: str):
+        # --------------------------------------------------------------------------
+        """Returns the InventoryReference of a state. Raises ValueError if either
+        value cannot be packed.
+        """
+
+        return InventoryReference(pack_account(account) + pack_field(reference, REFERENCE_WIDTH))
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def from_item(self, item: str):
+        # --------------------------------------------------------------------------
+        """Returns the InventoryReference of an 'account/reference' item. Raises
+        ValueError if it is not one.
+        """
+
+        try:
+            account, reference = item.split('/')
+        except AttributeError:
+            raise ValueError('Not an inventory item: {!r}'.format(item))
+        return InventoryReference(pack_account(account) + pack_field(reference, REFERENCE_WIDTH))
+
+    @property
+    # ------------------------------------------------------------------------------
+    def account(self) -> str:
+        # --------------------------------------------------------------------------
+        return unpack_account(self[:ACCOUNT_SIZE])
+
+    # ------------------------------------------------------------------------------
+    def unpack(self) -> tuple:
+        # --------------------------------------------------------------------------
+        """Returns (account, reference)"""
+
+        return unpack_account(self[:ACCOUNT_SIZE]), unpack_field(self[ACCOUNT_SIZE:])
+
+    @property
+    # ------------------------------------------------------------------------------
+    def reference(self) -> str:
+        # --------------------------------------------------------------------------
+        return unpack_field(self[ACCOUNT_SIZE:])
+
+    # ------------------------------------------------------------------------------
+    def to_item(self) -> str:
+        # --------------------------------------------------------------------------
+        """Returns the 'account/reference' item"""
+
+        return '/'.join(self.unpack())
+
+    # ------------------------------------------------------------------------------
+    def __str__(self) -> str:
+        # --------------------------------------------------------------------------
+        return self.to_item()
+
+    # ------------------------------------------------------------------------------
+    def __repr__(self) -> str:
+        # --------------------------------------------------------------------------
+        return 'InventoryReference({!r})'.format(self.to_item())
+
+# end InventoryReference class
+
+
+class ReferenceArray:
+    """First-in first-out queue of InventoryReferences stored back to back in one
+    bytearray, RECORD_SIZE bytes each, instead of one object per item.
+    """
+
+    # Bytes taken off the front before the buffer is compacted
+    COMPACT_AFTER = 1 << 20
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, references=()) -> None:
+        # --------------------------------------------------------------------------
+        self.buffer = bytearray()
+        self.start = 0
+        self.extend(references)
+
+    # ------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        # --------------------------------------------------------------------------
+        return (len(self.buffer) - self.start) // RECORD_SIZE
+
+    # ------------------------------------------------------------------------------
+    def __iter__(self):
+        # --------------------------------------------------------------------------
+        for offset in range(self.start, len(self.buffer), RECORD_SIZE):
+            yield InventoryReference(self.buffer[offset:offset + RECORD_SIZE])
+
+    # ------------------------------------------------------------------------------
+    def extend(self, references) -> None:
+        # --------------------------------------------------------------------------
+        """Appends InventoryReferences (or other RECORD_SIZE byte strings)"""
+
+        self.extend_packed(b''.join(references))
+
+    # ------------------------------------------------------------------------------
+    def extend_packed(self, packed: bytes) -> None:
+        # --------------------------------------------------------------------------
+        """Appends references already packed back to back (see pack_items)"""
+
+        if len(packed) % RECORD_SIZE != 0:
+            raise ValueError('Inventory references must be {} bytes'.format(RECORD_SIZE))
+        self.buffer += packed
+
+    # ------------------------------------------------------------------------------
+    def take(self, amount: int) -> list:
+        # --------------------------------------------------------------------------
+        """Removes and returns up to amount references from the front"""
+
+        end = min(len(self.buffer), self.start + max(0, amount) * RECORD_SIZE)
+        references = [InventoryReference(record)
+                      for record, in RECORDS.iter_unpack(self.buffer[self.start:end])]
+        self.start = end
+
+        if self.start == len(self.buffer):
+            self.buffer.clear()
+            self.start = 0
+        elif self.start >= self.COMPACT_AFTER and self.start * 2 >= len(self.buffer):
+            del self.buffer[:self.start]
+            self.start = 0
+        return references
+
+    # ------------------------------------------------------------------------------
+    def clear(self) -> None:
+        # --------------------------------------------------------------------------
+        self.buffer.clear()
+        self.start = 0
+
+# end ReferenceArray class
+
+
+# ------------------------------------------------------------------------------
+def encode_inventory(references: list) -> str:
+    # --------------------------------------------------------------------------
+    """Returns the compact wire form of a list of InventoryReferences: their
+    packed bytes, back to back, in base64.
+    """
+
+    return base64.b64encode(b''.join(references)).decode('ascii')
+
+
+# ------------------------------------------------------------------------------
+def decode_inventory(text: str, max_count: int = None) -> list:
+    # --------------------------------------------------------------------------
+    """Returns the first max_count (all by default) InventoryReferences of the
+    wire form made by encode_inventory. Raises ValueError if it is malformed.
+    """
+
+    try:
+        packed = base64.b64decode(text, validate=True)
+    except (binascii.Error, TypeError):
+        raise ValueError('Inventory is not valid base64')
+    if len(packed) % RECORD_SIZE != 0:
+        raise ValueError('Inventory is not a whole number of references')
+
+    count = len(packed) // RECORD_SIZE
+    if max_count is not None:
+        count = min(count, max_count)
+    return [InventoryReference(packed[offset:offset + RECORD_SIZE])
+            for offset in range(0, count * RECORD_SIZE, RECORD_SIZE)]
+
+
+# ------------------------------------------------------------------------------
+def pack_item(account: str, reference: str):
+    # --------------------------------------------------------------------------
+    """Returns the InventoryReference of a state, or its 'account/reference'
+    string if either value cannot be packed, so that such states can still be
+    requested and matched (see Inventory).
+    """
+
+    try:
+        return InventoryReference.pack(account, reference)
+    except ValueError:
+        return '{}/{}'.format(account, reference)
+
+
+# ------------------------------------------------------------------------------
+def pack_hex_items(items: list) -> bytes:
+    # --------------------------------------------------------------------------
+    """Returns the InventoryReferences of 'account/reference' items whose values
+    are all '0x' hex, back to back. The batch is packed column by column, one
+    pass over all of its digits per step, instead of one item at a time. Raises
+    ValueError (or TypeError) if any item is not such an item.
+    """
+
+    count = len(items)
+    if count == 0:
+        return b''
+    accounts, separators, references = zip(*map(str.partition, items, repeat('/')))
+    # Every value has one 'x', which must be its '0x' prefix: one left after
+    # removeprefix fails the digit check below
+    if separators.count('/') != count or ''.join(accounts).count('x') != count \
+            or ''.join(references).count('x') != count:
+        raise ValueError('Not a batch of hex inventory items')
+    account_lengths = bytes(map(len, accounts))
+    reference_lengths = bytes(map(len, references))
+    if min(account_lengths) < 3 or max(account_lengths) > 2 + 2 * ACCOUNT_WIDTH \
+            or min(reference_lengths) < 3 or max(reference_lengths) > 2 + 2 * REFERENCE_WIDTH:
+        raise ValueError('Not a batch of hex inventory items')
+
+    account_digits = ''.join(map(str.rjust, map(str.removeprefix, accounts, repeat('0x')),
+                                 repeat(2 * ACCOUNT_WIDTH), repeat('0'))).encode('ascii')
+    reference_digits = ''.join(map(str.rjust, map(str.removeprefix, references, repeat('0x')),
+                                   repeat(2 * REFERENCE_WIDTH), repeat('0'))).encode('ascii')
+    if account_digits.translate(None, DIGITS) or reference_digits.translate(None, LOWER_DIGITS):
+        raise ValueError('Not a batch of hex inventory items')
+
+    account_values = binascii.unhexlify(account_digits)
+    if account_digits.translate(None, LOWER_DIGITS):
+        cases = int(account_digits.translate(CASE_BYTES), 2).to_bytes(CASE_WIDTH * count, 'big')
+    else:
+        cases = bytes(CASE_WIDTH * count)
+    reference_values = binascii.unhexlify(reference_digits)
+
+    packed = bytearray(RECORD_SIZE * count)
+    packed[0::RECORD_SIZE] = account_lengths.translate(DIGIT_COUNTS)
+    for index in range(ACCOUNT_WIDTH):
+        packed[1 + index::RECORD_SIZE] = account_values[index::ACCOUNT_WIDTH]
+    for index in range(CASE_WIDTH):
+        packed[1 + ACCOUNT_WIDTH + index::RECORD_SIZE] = cases[index::CASE_WIDTH]
+    packed[ACCOUNT_SIZE::RECORD_SIZE] = reference_lengths.translate(DIGIT_COUNTS)
+    for index in range(REFERENCE_WIDTH):
+        packed[ACCOUNT_SIZE + 1 + index::RECORD_SIZE] = reference_values[index::REFERENCE_WIDTH]
+    return bytes(packed)
+
+
+# ------------------------------------------------------------------------------
+def pack_items(items: list) -> tuple:
+    # --------------------------------------------------------------------------
+    """Packs 'account/reference' items (or InventoryReferences) back to back.
+    Returns (packed bytes, items that could not be packed). Batches of hex
+    items, the usual case, go through pack_hex_items; a batch that does not is
+    halved until the parts holding other items are small enough to pack one
+    item at a time.
+    """
+
+    if len(items) > MAX_COLUMN_BATCH:
+        parts = [pack_items(items[index:index + MAX_COLUMN_BATCH])
+                 for index in range(0, len(items), MAX_COLUMN_BATCH)]
+        return b''.join(packed for packed, _ in parts), [item for _, rest in parts for item in rest]
+
+    if len(items) >= MIN_COLUMN_BATCH:
+        try:
+            return pack_hex_items(items), []
+        except (TypeError, ValueError):
+            middle = len(items) // 2
+            first, first_rest = pack_items(items[:middle])
+            second, second_rest = pack_items(items[middle:])
+            return first + second, first_rest + second_rest
+
+    references = []
+    rest = []
+    for item in items:
+        if isinstance(item, InventoryReference):
+            references.append(item)
+            continue
+        try:
+            references.append(InventoryReference.from_item(item))
+        except ValueError:
+            rest.append(item)
+    return b''.join(references), rest
+
+
+# ------------------------------------------------------------------------------
+def split_item(item) -> tuple:
+    # --------------------------------------------------------------------------
+    """Returns (account, reference) of an 'account/reference' string or an
+    InventoryReference. Raises ValueError if it is neither.
+    """
+
+    if isinstance(item, InventoryReference):
+        return item.unpack()
+    if not isinstance(item, str):
+        raise ValueError('Not an inventory item: {!r}'.format(item))
+    account, reference = item.split('/')
+    return account, reference
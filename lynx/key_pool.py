@@ -0,0 +1,139 @@
+# key_pool.py
+from account import Account
+from hdwallet import HDWallet, BIP44HDWallet
+from hdwallet.cryptocurrencies import EthereumMainnet
+from hdwallet.utils import generate_mnemonic
+from typing import Optional
+import threading
+import queue
+
+
+class KeyPool:
+    """Derives many accounts from a single HD wallet seed and keeps a number of
+    them precomputed so they can be handed out on demand.
+
+    The wallet is built from the mnemonic once. Every account is then derived
+    from the extended key of the change level (m/44'/60'/0'/0) by a single child
+    derivation, instead of generating a new mnemonic and wallet per account.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, size: int = 100, mnemonic: str = None, passphrase: Optional[str] = None, background: bool = True) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a KeyPool that keeps up to size accounts precomputed. If no
+        mnemonic is given, a new one is generated. When background is True, a
+        daemon thread keeps the pool filled.
+        """
+
+        self.size = int(size)
+        self.mnemonic = mnemonic if mnemonic is not None else generate_mnemonic(
+            language="english", strength=128)
+
+        bip44_hdwallet: BIP44HDWallet = BIP44HDWallet(
+            cryptocurrency=EthereumMainnet)
+        bip44_hdwallet.from_mnemonic(
+            mnemonic=self.mnemonic, language="english", passphrase=passphrase)
+        bip44_hdwallet.clean_derivation()
+        bip44_hdwallet.from_path(path="m/44'/60'/0'/0")
+        self.__change_xprivate_key = bip44_hdwallet.xprivate_key()
+        bip44_hdwallet.clean_derivation()
+
+        self.next_index = 0
+        self.index_lock = threading.Lock()
+        self.pool = queue.Queue(maxsize=self.size) if self.size > 0 else queue.Queue()
+
+        self.shutdown = False
+        self.refill = threading.Event()
+        self.refill_thread = None
+        if background and self.size > 0:
+            self.refill_thread = threading.Thread(
+                target=self.__fill_pool, name='Key Pool Thread', daemon=True)
+            self.refill_thread.start()
+
+    # ------------------------------------------------------------------------------
+    def derive(self, index: int) -> Account:
+        # --------------------------------------------------------------------------
+        """Derives the account at m/44'/60'/0'/0/index without any console output."""
+
+        hdwallet: HDWallet = HDWallet(cryptocurrency=EthereumMainnet)
+        hdwallet.from_xprivate_key(xprivate_key=self.__change_xprivate_key)
+        hdwallet.from_index(index)
+
+        return Account(pub_key=hdwallet.public_key(), priv_key=hdwallet.private_key(),
+                       address=hdwallet.p2pkh_address(), debug=False)
+
+    # ------------------------------------------------------------------------------
+    def derive_batch(self, count: int) -> list:
+        # --------------------------------------------------------------------------
+        """Derives the next count accounts of the seed in one go. Accounts handed out
+        by derive_batch are never handed out again by the pool.
+        """
+
+        with self.index_lock:
+            start = self.next_index
+            self.next_index += count
+
+        return [self.derive(index) for index in range(start, start + count)]
+
+    # ------------------------------------------------------------------------------
+    def get(self) -> Account:
+        # --------------------------------------------------------------------------
+        """Returns a precomputed account, or derives one immediately if the pool is
+        currently empty.
+        """
+
+        try:
+            account = self.pool.get_nowait()
+        except queue.Empty:
+            account = self.derive_batch(1)[0]
+        self.refill.set()
+
+        return account
+
+    # ------------------------------------------------------------------------------
+    def get_batch(self, amount: int) -> list:
+        # --------------------------------------------------------------------------
+        """Returns amount accounts, taking as many as possible from the pool and
+        deriving the remainder in a single batch.
+        """
+
+        accounts = []
+        while len(accounts) < amount:
+            try:
+                accounts.append(self.pool.get_nowait())
+            except queue.Empty:
+                break
+
+        if len(accounts) < amount:
+            accounts.extend(self.derive_batch(amount - len(accounts)))
+        self.refill.set()
+
+        return accounts
+
+    # ------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        # --------------------------------------------------------------------------
+        """Returns the number of precomputed accounts currently in the pool."""
+
+        return self.pool.qsize()
+
+    # ------------------------------------------------------------------------------
+    def close(self) -> None:
+        # --------------------------------------------------------------------------
+        """Stops the background thread from deriving any more accounts."""
+
+        self.shutdown = True
+        self.refill.set()
+
+    # ------------------------------------------------------------------------------
+    def __fill_pool(self) -> None:
+        # --------------------------------------------------------------------------
+        """Keeps the pool filled up to its size, waking whenever accounts are taken."""
+
+        while not self.shutdown:
+            self.refill.clear()
+            while not self.shutdown and not self.pool.full():
+                self.pool.put(self.derive_batch(1)[0])
+            self.refill.wait()
+
+# end KeyPool class
@@ -0,0 +1,177 @@
+# local_states.py
+from __future__ import annotations
+from state_store import StateStore
+from state import State
+from log import get_logger
+import threading
+import os
+
+logger = get_logger(__name__)
+
+
+class LocalStates:
+    """Exact set of the 'account/reference' inventory items stored on disk under
+    the accounts directory. Used to drop announcements of states this node
+    already has before they are queued for download.
+
+    The set is built from the accounts directory on first use. After that it
+    follows the StateStore it is attached to, which reports every state written
+    through it and those other processes announce with notify, so lookups never
+    touch the disk. refresh() parses again only the accounts whose states
+    directory changed in some other way.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, accounts_directory: str = '../accounts', state_store: StateStore = None) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an empty LocalStates index over accounts_directory,
+        following state_store if given.
+        """
+
+        self.accounts_directory = accounts_directory
+        self.lock = threading.Lock()
+        self.items = set()
+        # account -> (states directory mtime, items of that account)
+        self.accounts = {}
+        self.loaded = False
+        if state_store is not None:
+            state_store.add_batch_listener(self.__on_states_stored)
+
+    # ------------------------------------------------------------------------------
+    def refresh(self) -> int:
+        # --------------------------------------------------------------------------
+        """Rescans accounts whose states directory changed since the last scan.
+        Returns the number of accounts parsed again.
+        """
+
+        try:
+            accounts = os.listdir(self.accounts_directory)
+        except OSError:
+            accounts = []
+
+        scanned = 0
+        seen = set()
+        with self.lock:
+            for account in accounts:
+                state_path = os.path.join(
+                    self.accounts_directory, account, 'states')
+                try:
+                    modified = os.stat(state_path).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(account)
+
+                cached = self.accounts.get(account)
+                if cached is not None and cached[0] == modified:
+                    continue
+
+                account_items = self.__scan_account(account, state_path)
+                if cached is not None:
+                    self.items.difference_update(cached[1])
+                self.items.update(account_items)
+                self.accounts[account] = (modified, account_items)
+                scanned += 1
+
+            for account in set(self.accounts) - seen:
+                self.items.difference_update(self.accounts.pop(account)[1])
+            self.loaded = True
+
+        logger.debug('Local states refreshed (%s accounts parsed, %s states)',
+                     scanned, len(self.items))
+        return scanned
+
+    # ------------------------------------------------------------------------------
+    def __load_if_needed(self) -> None:
+        # --------------------------------------------------------------------------
+        if not self.loaded:
+            self.refresh()
+
+    # ------------------------------------------------------------------------------
+    def __scan_account(self, account: str, state_path: str) -> set:
+        # --------------------------------------------------------------------------
+        """Returns the inventory items of every state file of an account"""
+
+        account_items = set()
+        for file in os.listdir(state_path):
+            try:
+                with open(os.path.join(state_path, file), 'r') as state_file:
+                    state = State.from_File(state_file)
+            except OSError:
+                continue
+            if state is not None:
+                account_items.add('{}/{}'.format(account,
+                                  state.current_reference))
+
+        return account_items
+
+    # ------------------------------------------------------------------------------
+    def add(self, account: str, reference: str) -> None:
+        # --------------------------------------------------------------------------
+        """Records a state that was just stored"""
+
+        self.__add_items(account, ['{}/{}'.format(account, reference)])
+
+    # ------------------------------------------------------------------------------
+    def __on_states_stored(self, items: list) -> None:
+        # --------------------------------------------------------------------------
+        accounts = {}
+        for account, state in items:
+            accounts.setdefault(account, []).append(
+                '{}/{}'.format(account, state.current_reference))
+        for account, account_items in accounts.items():
+            self.__add_items(account, account_items)
+
+    # ------------------------------------------------------------------------------
+    def __add_items(self, account: str, account_items: list) -> None:
+        # --------------------------------------------------------------------------
+        """Adds items of one account. The cached modification time of its states
+        directory is updated too, so the write does not make refresh() parse the
+        account again.
+        """
+
+        try:
+            modified = os.stat(os.path.join(
+                self.accounts_directory, account, 'states')).st_mtime_ns
+        except OSError:
+            modified = None
+        with self.lock:
+            self.items.update(account_items)
+            if not self.loaded:
+                return
+            cached = self.accounts.get(account)
+            known = cached[1] if cached is not None else set()
+            known.update(account_items)
+            if modified is not None:
+                self.accounts[account] = (modified, known)
+
+    # ------------------------------------------------------------------------------
+    def missing(self, inventory: list) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the items of an inventory announcement that are not stored
+        locally, without duplicates and in their original order.
+        """
+
+        self.__load_if_needed()
+
+        missing_items = []
+        seen = set()
+        with self.lock:
+            for item in inventory:
+                if item not in self.items and item not in seen:
+                    seen.add(item)
+                    missing_items.append(item)
+
+        return missing_items
+
+    # ------------------------------------------------------------------------------
+    def __contains__(self, item: str) -> bool:
+        # --------------------------------------------------------------------------
+        self.__load_if_needed()
+        return item in self.items
+
+    # ------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        # --------------------------------------------------------------------------
+        return len(self.items)
+
+# end LocalStates class
@@ -0,0 +1,126 @@
+# log.py
+from logging.handlers import QueueHandler, QueueListener
+import logging
+import atexit
+import queue
+import sys
+import os
+
+# Per-module levels can be given as LYNX_LOG_LEVELS="server=DEBUG,peer_connection=WARNING"
+ROOT_LOGGER_NAME = 'lynx'
+DEFAULT_LOG_LEVEL = os.environ.get('LYNX_LOG_LEVEL', 'INFO')
+DEFAULT_MODULE_LEVELS = os.environ.get('LYNX_LOG_LEVELS', '')
+LOG_FORMAT = '%(asctime)s [%(threadName)s] %(levelname)s %(name)s: %(message)s'
+
+_listener = None
+
+
+class RenderingQueueHandler(QueueHandler):
+    """A QueueHandler that renders each record's message on the calling thread
+    and leaves the formatting of the full log line (time, thread, level) and
+    the writing to the listener thread. Only records that pass the logger's
+    level get here, so disabled debug calls cost nothing.
+    """
+
+    # ------------------------------------------------------------------------------
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # --------------------------------------------------------------------------
+        """Renders the message and traceback on the calling thread, since the
+        arguments (often dicts and lists still in use) may change or go away
+        before the listener gets to them.
+        """
+
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# ------------------------------------------------------------------------------
+def configure_logging(level: str = None, module_levels: dict = None, stream=None) -> None:
+    # --------------------------------------------------------------------------
+    """(Re)configures the lynx loggers. All records go through a queue to a single
+    listener thread that does the formatting and writing, so I/O threads never
+    block on the console. module_levels maps module names (e.g. 'server') to
+    level names and overrides the global level for that module.
+    """
+
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+
+    root_logger = logging.getLogger(ROOT_LOGGER_NAME)
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(
+        stream if stream is not None else sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+    root_logger.addHandler(RenderingQueueHandler(log_queue))
+    root_logger.setLevel(
+        (level if level is not None else DEFAULT_LOG_LEVEL).upper())
+    root_logger.propagate = False
+
+    if module_levels is None:
+        module_levels = parse_module_levels(DEFAULT_MODULE_LEVELS)
+    for module, module_level in module_levels.items():
+        set_level(module, module_level)
+
+
+# ------------------------------------------------------------------------------
+def parse_module_levels(spec: str) -> dict:
+    # --------------------------------------------------------------------------
+    """Parses a "module=LEVEL,module=LEVEL" string into a dict"""
+
+    module_levels = {}
+    for entry in spec.split(','):
+        if '=' in entry:
+            module, module_level = entry.split('=', 1)
+            module_levels[module.strip()] = module_level.strip()
+
+    return module_levels
+
+
+# ------------------------------------------------------------------------------
+def set_level(module: str, level: str) -> None:
+    # --------------------------------------------------------------------------
+    """Sets the level of a single module's logger at runtime"""
+
+    get_logger(module).setLevel(level.upper())
+
+
+# ------------------------------------------------------------------------------
+def get_logger(module: str) -> logging.Logger:
+    # --------------------------------------------------------------------------
+    """Returns the logger for a lynx module, configuring logging on first use.
+    Call sites should pass arguments instead of pre-formatted strings, e.g.
+    logger.debug('Sent %s', data), so that nothing is formatted when the level
+    is disabled.
+    """
+
+    if _listener is None:
+        configure_logging()
+
+    return logging.getLogger('{}.{}'.format(ROOT_LOGGER_NAME, module))
+
+
+# ------------------------------------------------------------------------------
+def shutdown_logging() -> None:
+    # --------------------------------------------------------------------------
+    """Flushes all queued records and stops the listener thread"""
+
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
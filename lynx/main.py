@@ -1,5 +1,4 @@
 from node import Node
-from account import Account
 from message import Message
 import threading
 
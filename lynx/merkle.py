@@ -0,0 +1,148 @@
+# merkle.py
+from hashlib import sha3_256
+from typing import Callable
+import threading
+
+MAX_MERKLE_ITEMS_PER_REQUEST = 512
+
+
+class MerkleAccumulator:
+    """Binary Merkle tree over the tip reference of every account. Accounts are
+    spread over 2 ** depth leaf buckets by the hash of their address; a leaf
+    hashes the sorted account:tip entries of its bucket and every inner node
+    hashes its two children. Empty subtrees have no hash (None). Updating a tip
+    rehashes one bucket and the depth nodes above it.
+
+    Two nodes find the accounts whose tips differ by comparing hashes level by
+    level and only descending into subtrees that differ.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, depth: int = 12) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an empty MerkleAccumulator with 2 ** depth buckets"""
+
+        self.depth = int(depth)
+        self.lock = threading.Lock()
+        self.tips = {}
+        # bucket -> {account: tip}
+        self.buckets = {}
+        # (level, prefix) -> digest, level depth holds the buckets
+        self.nodes = {}
+
+    # ------------------------------------------------------------------------------
+    def bucket_of(self, account: str) -> int:
+        # --------------------------------------------------------------------------
+        digest = sha3_256(account.encode()).digest()
+        return int.from_bytes(digest[:4], 'big') >> (32 - self.depth)
+
+    # ------------------------------------------------------------------------------
+    def set_tip(self, account: str, tip_reference: str) -> None:
+        # --------------------------------------------------------------------------
+        """Records the tip of an account, or removes it if tip_reference is None"""
+
+        bucket = self.bucket_of(account)
+        with self.lock:
+            if self.tips.get(account) == tip_reference:
+                return
+            entries = self.buckets.setdefault(bucket, {})
+            if tip_reference is None:
+                self.tips.pop(account, None)
+                entries.pop(account, None)
+                if len(entries) == 0:
+                    del self.buckets[bucket]
+            else:
+                self.tips[account] = tip_reference
+                entries[account] = tip_reference
+            self.__update_path(bucket)
+
+    # ------------------------------------------------------------------------------
+    def __update_path(self, bucket: int) -> None:
+        # --------------------------------------------------------------------------
+        """Rehashes a bucket and its ancestors. Called with the lock held."""
+
+        entries = self.buckets.get(bucket)
+        if entries:
+            leaf = '\n'.join('{}:{}'.format(account, tip)
+                             for account, tip in sorted(entries.items()))
+            self.nodes[(self.depth, bucket)] = sha3_256(leaf.encode()).digest()
+        else:
+            self.nodes.pop((self.depth, bucket), None)
+
+        prefix = bucket
+        for level in range(self.depth - 1, -1, -1):
+            prefix >>= 1
+            left = self.nodes.get((level + 1, prefix * 2))
+            right = self.nodes.get((level + 1, prefix * 2 + 1))
+            if left is None and right is None:
+                self.nodes.pop((level, prefix), None)
+            else:
+                self.nodes[(level, prefix)] = sha3_256(
+                    (left or b'\0' * 32) + (right or b'\0' * 32)).digest()
+
+    # ------------------------------------------------------------------------------
+    def node_hash(self, level: int, prefix: int) -> str:
+        # --------------------------------------------------------------------------
+        """Returns the hex hash of a subtree, or None if it is empty"""
+
+        digest = self.nodes.get((level, prefix))
+        return digest.hex() if digest is not None else None
+
+    # ------------------------------------------------------------------------------
+    def root(self) -> str:
+        # --------------------------------------------------------------------------
+        return self.node_hash(0, 0)
+
+    # ------------------------------------------------------------------------------
+    def bucket_entries(self, bucket: int) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the [account, tip] pairs of a bucket"""
+
+        with self.lock:
+            return [[account, tip] for account, tip in sorted(self.buckets.get(bucket, {}).items())]
+
+    # ------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        # --------------------------------------------------------------------------
+        return len(self.tips)
+
+    # ------------------------------------------------------------------------------
+    def find_differences(self, fetch: Callable) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the accounts whose tip on a remote node is missing or different
+        here. fetch(nodes, buckets) asks the remote node for the hashes of a list
+        of [level, prefix] nodes and the entries of a list of buckets, and
+        returns (hashes, {bucket: [[account, tip], ...]}), or None on failure.
+        Costs one round trip per tree level.
+        """
+
+        differing = []
+        pending = [[0, 0]]
+        while len(pending) > 0:
+            nodes = [node for node in pending if node[0] < self.depth]
+            buckets = [node[1] for node in pending if node[0] == self.depth]
+            hashes, remote_buckets = {}, {}
+            for index in range(0, max(len(nodes), len(buckets)), MAX_MERKLE_ITEMS_PER_REQUEST):
+                reply = fetch(nodes[index:index + MAX_MERKLE_ITEMS_PER_REQUEST],
+                              buckets[index:index + MAX_MERKLE_ITEMS_PER_REQUEST])
+                if reply is None:
+                    return None
+                hashes.update(zip((tuple(node) for node in nodes[index:index + MAX_MERKLE_ITEMS_PER_REQUEST]),
+                                  reply[0]))
+                remote_buckets.update(reply[1])
+
+            for bucket, entries in remote_buckets.items():
+                local_entries = dict(self.bucket_entries(bucket))
+                differing.extend(account for account, tip in entries
+                                 if local_entries.get(account) != tip)
+
+            pending = []
+            for (level, prefix), remote_hash in hashes.items():
+                if remote_hash is None or remote_hash == self.node_hash(level, prefix):
+                    continue
+                pending.append([level + 1, prefix * 2])
+                pending.append([level + 1, prefix * 2 + 1])
+
+        return differing
+
+# end MerkleAccumulator class
@@ -2,10 +2,21 @@
 
 from datetime import datetime
 import json
-from multiprocessing.sharedctypes import Value
-import threading
 from hashlib import sha3_256
-import traceback
+from log import get_logger
+
+logger = get_logger(__name__)
+
+
+# ------------------------------------------------------------------------------
+def to_serializable(o) -> dict:
+    # --------------------------------------------------------------------------
+    """json.dumps default for objects nested in message data: slotted classes
+    provide to_dict, anything else is serialized from its __dict__.
+    """
+
+    to_dict = getattr(o, 'to_dict', None)
+    return to_dict() if to_dict is not None else o.__dict__
 
 
 class Message:
@@ -13,6 +24,8 @@ class Message:
     data, and timestamp.
     """
 
+    __slots__ = ('type', 'flag', 'data', 'timestamp')
+
     # ------------------------------------------------------------------------------
     def __init__(self, type: str, flag: int, data) -> None:
         # --------------------------------------------------------------------------
@@ -24,13 +37,6 @@ class Message:
         self.timestamp = str(datetime.now())
 
     # ------------------------------------------------------------------------------
-    def __debug(self, message) -> None:
-        # --------------------------------------------------------------------------
-        """Prints a message to the screen with the name of the current thread"""
-        print(message)
-
-    # ------------------------------------------------------------------------------
-
     def validate(self) -> bool:
         # --------------------------------------------------------------------------
         """Checks to see whether a message has a valid type, flag, data, and timestamp"""
@@ -46,16 +52,16 @@ class Message:
                 raise ValueError
         except ValueError:
             if not is_valid_type:
-                self.__debug('Invalid message type, with type of: %s' %
+                logger.debug('Invalid message type, with type of: %s',
                              type(self.type))
             if not is_valid_flag:
-                self.__debug('Invalid message flag, with type of: %s' %
+                logger.debug('Invalid message flag, with type of: %s',
                              type(self.flag))
             if not is_valid_data:
-                self.__debug('Invalid message data, with type of: %s' %
+                logger.debug('Invalid message data, with type of: %s',
                              type(self.data))
             if not is_valid_timestamp:
-                self.__debug('Invalid message timestamp, with type of: %s' %
+                logger.debug('Invalid message timestamp, with type of: %s',
                              type(self.timestamp))
             return False
 
@@ -68,9 +74,25 @@ class Message:
         any function/method in which an encoded message is to be sent.
         """
 
-        return json.dumps(self, default=lambda o: o.__dict__,
+        return json.dumps(self.to_dict(), default=to_serializable,
                           sort_keys=True)
 
+    # ------------------------------------------------------------------------------
+    def to_dict(self) -> dict:
+        # --------------------------------------------------------------------------
+        return {'type': self.type, 'flag': self.flag, 'data': self.data, 'timestamp': self.timestamp}
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def from_dict(self, data: dict):
+        # --------------------------------------------------------------------------
+        """Returns a Message object given a dict like the one to_dict returns. The
+        timestamp is the time of this call, as with from_JSON. Raises KeyError if
+        a field is missing.
+        """
+
+        return Message(type=data['type'], flag=data['flag'], data=data['data'])
+
     @classmethod
     # ------------------------------------------------------------------------------
     def from_JSON(self, JSON: str):
@@ -84,19 +106,16 @@ class Message:
             if not isinstance(data, dict):
                 raise ValueError
 
-            message = Message(
-                type=data['type'], flag=data['flag'], data=data['data'])
+            message = Message.from_dict(data)
             return message
         except ValueError:
-            self.__debug(self=self, message='Message data is not a "dict".')
+            logger.debug('Message data is not a "dict".')
             return None
         except KeyError:
-            self.__debug(
-                self=self, message='Message is not formatted correctly.')
+            logger.debug('Message is not formatted correctly.')
             return None
         except:
-            self.__debug(
-                self=self, message='Unable to convert data in Message object.')
+            logger.debug('Unable to convert data in Message object.')
             return None
 
 # end Message class
@@ -117,11 +136,6 @@ class SignedMessage:
         self.message = message
         self.signature = signature
 
-    # ------------------------------------------------------------------------------
-    def __debug(self, message) -> None:
-        # --------------------------------------------------------------------------
-        print(message)
-
     # ------------------------------------------------------------------------------
     def is_signed(self) -> bool:
         # --------------------------------------------------------------------------
@@ -135,9 +149,14 @@ class SignedMessage:
         with any function/method in which an encoded message is to be sent.
         """
 
-        return json.dumps(self, default=lambda o: o.__dict__,
+        return json.dumps(self.to_dict(), default=to_serializable,
                           sort_keys=True)
 
+    # ------------------------------------------------------------------------------
+    def to_dict(self) -> dict:
+        # --------------------------------------------------------------------------
+        return {'message': self.message.to_dict(), 'signature': self.signature}
+
     @classmethod
     # ------------------------------------------------------------------------------
     def from_JSON(self, JSON: str):
@@ -157,14 +176,14 @@ class SignedMessage:
             return signed_message
         except ValueError:
             if not isinstance(data, dict):
-                self.__debug(self, message='Message data is not a "dict".')
+                logger.debug('Message data is not a "dict".')
             return None
         except KeyError:
-            self.__debug(self, 'Message is not formatted correctly.')
+            logger.debug('Message is not formatted correctly.')
             return None
         except:
-            self.__debug(
-                self, 'Unable to convert JSON data into SignedMessage object.')
+            logger.debug(
+                'Unable to convert JSON data into SignedMessage object.')
             return None
 
 # end SignedMessage class
@@ -1,6 +1,8 @@
 # message.py
 
 from message import Message
+from constants import MAX_BLOOM_FILTER_BYTES, MAX_BLOOM_FILTER_HASHES, MAX_REFERENCES_PER_RESPONSE
+from merkle import MAX_MERKLE_ITEMS_PER_REQUEST
 
 
 class MessageValidation:
@@ -13,7 +15,8 @@ class MessageValidation:
         to our standards so node can handle the request without errors.
         """
         message_keys = {'version': False, 'services': False, 'timestamp': False, 'nonce': False,
-                        'address_from': False, 'address_receive': False, 'sub_version': False, 'start_accounts_count': False, 'relay': False}
+                        'address_from': False, 'address_receive': False, 'sub_version': False, 'start_accounts_count': False,
+                        'max_states_in_transit': False, 'relay': False}
         is_request_valid = True
 
         if message.type == 'request' and message.flag == 1 and isinstance(message.data, dict):
@@ -43,44 +46,91 @@ class MessageValidation:
     def validate_address_request(self, message: Message) -> bool:
         # --------------------------------------------------------------------------
         """Checks to see if incoming peer address request message is formatted according
-        to our standards so node can handle the request without errors.
+        to our standards so node can handle the request without errors. The
+        optional keys known_filter (a bloom filter of addresses the requester
+        already knows), since (only addresses seen after this timestamp) and
+        max_addresses narrow down the response.
         """
 
         message_keys = {'address_count': False, 'address_list': False}
+        optional_keys = {'known_filter', 'since', 'max_addresses'}
         is_request_valid = True
 
         if message.type == 'request' and message.flag == 2 and isinstance(message.data, dict):
             for k in message.data:
                 if k in message_keys:
                     del message_keys[k]
-                else:
+                elif k not in optional_keys:
                     is_request_valid = False
                     break
             if is_request_valid and len(message_keys) > 0:
                 is_request_valid = False
+            if is_request_valid:
+                is_request_valid = self.__validate_address_options(message.data)
+        else:
+            is_request_valid = False
 
         return is_request_valid
 
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __validate_address_options(self, data: dict) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks the optional address request keys"""
+
+        if not isinstance(data['address_list'], list):
+            return False
+
+        since = data.get('since')
+        if since is not None and (isinstance(since, bool) or not isinstance(since, (int, float))):
+            return False
+
+        max_addresses = data.get('max_addresses')
+        if max_addresses is not None and (isinstance(max_addresses, bool) or not isinstance(max_addresses, int)
+                                          or max_addresses < 1):
+            return False
+
+        known_filter = data.get('known_filter')
+        if known_filter is not None:
+            if not isinstance(known_filter, dict) or set(known_filter) != {'size', 'hashes', 'bits'}:
+                return False
+            size, hashes, bits = known_filter['size'], known_filter['hashes'], known_filter['bits']
+            if not isinstance(size, int) or not isinstance(hashes, int) or not isinstance(bits, str):
+                return False
+            if not 0 < size <= MAX_BLOOM_FILTER_BYTES * 8 or not 0 < hashes <= MAX_BLOOM_FILTER_HASHES:
+                return False
+
+        return True
+
     @classmethod
     # ------------------------------------------------------------------------------
     def validate_address_response(self, message: Message) -> bool:
         # --------------------------------------------------------------------------
         """Checks to see if incoming peer address reponse message is formatted according
-        to our standards so node can handle the request without errors.
+        to our standards so node can handle the request without errors. The
+        optional services and last_seen lists run parallel to address_list.
         """
 
         message_keys = {'address_count': False, 'address_list': False}
+        optional_keys = {'services', 'last_seen'}
         is_request_valid = True
 
         if message.type == 'response' and message.flag == 2 and isinstance(message.data, dict):
             for k in message.data:
                 if k in message_keys:
                     del message_keys[k]
+                elif k in optional_keys:
+                    if not isinstance(message.data[k], list) or \
+                            len(message.data[k]) != len(message.data.get('address_list') or []):
+                        is_request_valid = False
+                        break
                 else:
                     is_request_valid = False
                     break
             if is_request_valid and len(message_keys) > 0:
                 is_request_valid = False
+        else:
+            is_request_valid = False
 
         return is_request_valid
 
@@ -119,7 +169,7 @@ class MessageValidation:
         message_keys = {'inventory_count': False, 'inventory': False, }
         is_request_valid = True
 
-        if message.type == 'response' and message.flag == 4 and isinstance(message.data, dict):
+        if message.type == 'response' and message.flag == 3 and isinstance(message.data, dict):
             for k in message.data:
                 if k in message_keys:
                     del message_keys[k]
@@ -128,6 +178,11 @@ class MessageValidation:
                     break
             if is_request_valid and len(message_keys) > 0:
                 is_request_valid = False
+            if is_request_valid:
+                is_request_valid = isinstance(message.data['inventory'], list) and \
+                    all(isinstance(item, str) for item in message.data['inventory'])
+        else:
+            is_request_valid = False
 
         return is_request_valid
 
@@ -151,8 +206,187 @@ class MessageValidation:
                     break
             if is_request_valid and len(message_keys) > 0:
                 is_request_valid = False
+            # A list of 'account/reference' items, or the encoded inventory
+            if is_request_valid:
+                is_request_valid = isinstance(message.data['inventory'], (list, str))
+        else:
+            is_request_valid = False
 
         return is_request_valid
 
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_data_response(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming data response message is formatted according
+        to our standards so node can store the states it carries.
+        """
+
+        if message.type != 'response' or message.flag != 4 or not isinstance(message.data, dict) \
+                or set(message.data) != {'inventory_count', 'inventory'} \
+                or not isinstance(message.data['inventory'], list):
+            return False
+
+        state_keys = {'account', 'nonce', 'previous_reference',
+                      'current_reference', 'balance'}
+        for state in message.data['inventory']:
+            if not isinstance(state, dict) or set(state) != state_keys \
+                    or not all(isinstance(state[key], str) for key in ('account', 'nonce', 'current_reference')) \
+                    or not isinstance(state['previous_reference'], (str, type(None))) \
+                    or not isinstance(state['balance'], (int, float)) or isinstance(state['balance'], bool):
+                return False
+
+        return True
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_stats_request(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming stats request message is formatted according
+        to our standards so node can handle the request without errors. Besides
+        'stats', the 'profile' command starts, stops or reports on the profiler.
+        """
+
+        if message.type != 'request' or message.flag != 6 or not isinstance(message.data, dict):
+            return False
+
+        command = message.data.get('command')
+        if command == 'stats':
+            return True
+        if command == 'profile':
+            window = message.data.get('window')
+            return message.data.get('action') in ('start', 'stop', 'status') \
+                and (window is None or (isinstance(window, (int, float)) and window > 0))
+        return False
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_stats_response(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming stats response message is formatted according
+        to our standards so node can handle the response without errors.
+        """
+
+        return message.type == 'response' and message.flag == 6 and isinstance(message.data, dict) \
+            and ('counters' in message.data or isinstance(message.data.get('profile'), dict))
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_references_request(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming references request message is formatted
+        according to our standards so node can handle the request without errors.
+        """
+
+        if message.type != 'request' or message.flag != 7 or not isinstance(message.data, dict) \
+                or set(message.data) != {'account', 'from_reference', 'max_count'}:
+            return False
+
+        max_count = message.data['max_count']
+        return isinstance(message.data['account'], str) \
+            and (message.data['from_reference'] is None or isinstance(message.data['from_reference'], str)) \
+            and isinstance(max_count, int) and not isinstance(max_count, bool) \
+            and 0 < max_count <= MAX_REFERENCES_PER_RESPONSE
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_references_response(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming references response message is formatted
+        according to our standards so node can handle the response without errors.
+        """
+
+        if message.type != 'response' or message.flag != 7 or not isinstance(message.data, dict) \
+                or set(message.data) != {'account', 'reference_count', 'references'}:
+            return False
+
+        references = message.data['references']
+        return isinstance(references, list) and message.data['reference_count'] == len(references) \
+            and all(isinstance(pair, list) and len(pair) == 2 and all(isinstance(reference, str) for reference in pair)
+                    for pair in references)
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_merkle_request(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming merkle request message is formatted according
+        to our standards so node can handle the request without errors.
+        """
+
+        if message.type != 'request' or message.flag != 8 or not isinstance(message.data, dict) \
+                or set(message.data) != {'depth', 'nodes', 'buckets'}:
+            return False
+
+        depth, nodes, buckets = message.data['depth'], message.data['nodes'], message.data['buckets']
+        if not isinstance(depth, int) or not isinstance(nodes, list) or not isinstance(buckets, list) \
+                or len(nodes) > MAX_MERKLE_ITEMS_PER_REQUEST or len(buckets) > MAX_MERKLE_ITEMS_PER_REQUEST:
+            return False
+
+        return all(isinstance(node, list) and len(node) == 2 and all(isinstance(value, int) for value in node)
+                   for node in nodes) and all(isinstance(bucket, int) for bucket in buckets)
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_merkle_response(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming merkle response message is formatted according
+        to our standards so node can handle the response without errors.
+        """
+
+        if message.type != 'response' or message.flag != 8 or not isinstance(message.data, dict) \
+                or set(message.data) != {'depth', 'hashes', 'buckets'}:
+            return False
+
+        return isinstance(message.data['hashes'], list) and isinstance(message.data['buckets'], list) \
+            and all(isinstance(entry, list) and len(entry) == 2 and isinstance(entry[1], list)
+                    for entry in message.data['buckets'])
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_relay_request(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming relay request message is formatted according
+        to our standards so node can handle the request without errors.
+        """
+
+        if message.type != 'request' or message.flag != 9 or not isinstance(message.data, dict) \
+                or set(message.data) != {'kind', 'data', 'hops', 'sender'}:
+            return False
+
+        return isinstance(message.data['kind'], str) and isinstance(message.data['sender'], str) \
+            and isinstance(message.data['hops'], int) and message.data['hops'] >= 0
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_relay_response(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming relay response message is formatted according
+        to our standards so node can handle the response without errors.
+        """
+
+        return message.type == 'response' and message.flag == 9 and isinstance(message.data, dict) \
+            and isinstance(message.data.get('accepted'), bool)
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_stream_request(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming stream request message is formatted according
+        to our standards so node can handle the request without errors.
+        """
+
+        return message.type == 'request' and message.flag == 10 and message.data == {}
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def validate_stream_response(self, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks to see if incoming stream response message is formatted according
+        to our standards so node can handle the response without errors.
+        """
+
+        return message.type == 'response' and message.flag == 10 and isinstance(message.data, dict) \
+            and isinstance(message.data.get('accepted'), bool)
+
 
 # end MessageValidation class
@@ -0,0 +1,264 @@
+# metrics.py
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from typing import Callable
+import threading
+import time
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                           0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, buckets: tuple = DEFAULT_LATENCY_BUCKETS) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an empty Histogram with the given upper bounds"""
+
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    # ------------------------------------------------------------------------------
+    def observe(self, value: float) -> None:
+        # --------------------------------------------------------------------------
+        """Adds a value to the first bucket whose upper bound it does not exceed"""
+
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    # ------------------------------------------------------------------------------
+    def cumulative_counts(self) -> list:
+        # --------------------------------------------------------------------------
+        """Returns (upper_bound, count of values <= upper_bound) pairs, ending
+        with the '+Inf' bucket.
+        """
+
+        cumulative = []
+        total = 0
+        for upper_bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            cumulative.append((upper_bound, total))
+
+        return cumulative
+
+# end Histogram class
+
+
+class Metrics:
+    """In-process registry of counters, histograms and gauges. Counters and
+    histograms are keyed by name and a set of labels; gauges are callables that
+    are only evaluated when a snapshot is taken.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, prefix: str = 'lynx') -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an empty Metrics registry"""
+
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.start_time = time.time()
+
+    # ------------------------------------------------------------------------------
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        # --------------------------------------------------------------------------
+        """Increments the counter name with the given labels by amount"""
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    # ------------------------------------------------------------------------------
+    def observe(self, name: str, value: float, **labels) -> None:
+        # --------------------------------------------------------------------------
+        """Records value in the histogram name with the given labels"""
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # ------------------------------------------------------------------------------
+    @contextmanager
+    def time(self, name: str, **labels):
+        # --------------------------------------------------------------------------
+        """Observes the number of seconds the body of a with-statement takes"""
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    # ------------------------------------------------------------------------------
+    def register_gauge(self, name: str, function: Callable, label: str = None) -> None:
+        # --------------------------------------------------------------------------
+        """Registers a gauge that is read when a snapshot is taken. The function
+        returns a number, or a dict of {label value: number} if label is given.
+        """
+
+        with self.lock:
+            self.gauges[name] = (function, label)
+
+    # ------------------------------------------------------------------------------
+    def get(self, name: str, **labels) -> float:
+        # --------------------------------------------------------------------------
+        """Returns the current value of a counter, or 0 if it was never incremented"""
+
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    # ------------------------------------------------------------------------------
+    def __read_gauges(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Evaluates all gauges into {name: [(labels, value), ...]}"""
+
+        gauge_values = {}
+        for name, (function, label) in list(self.gauges.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            if label is None:
+                gauge_values[name] = [((), value)]
+            else:
+                gauge_values[name] = [(((label, label_value),), v)
+                                      for label_value, v in value.items()]
+
+        return gauge_values
+
+    # ------------------------------------------------------------------------------
+    def snapshot(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Returns all metrics as a JSON serializable dict"""
+
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = [(key, histogram.cumulative_counts(), histogram.sum, histogram.count)
+                          for key, histogram in self.histograms.items()]
+
+        snapshot = {'uptime': time.time() - self.start_time,
+                    'counters': {}, 'histograms': {}, 'gauges': {}}
+        for (name, labels), value in counters:
+            snapshot['counters'].setdefault(name, []).append(
+                {'labels': dict(labels), 'value': value})
+        for (name, labels), buckets, total, count in histograms:
+            snapshot['histograms'].setdefault(name, []).append(
+                {'labels': dict(labels), 'sum': total, 'count': count,
+                 'buckets': {str(upper_bound): bucket_count for upper_bound, bucket_count in buckets}})
+        for name, values in self.__read_gauges().items():
+            snapshot['gauges'][name] = [{'labels': dict(labels), 'value': value}
+                                        for labels, value in values]
+
+        return snapshot
+
+    # ------------------------------------------------------------------------------
+    def to_text(self) -> str:
+        # --------------------------------------------------------------------------
+        """Returns all metrics in the plain-text Prometheus exposition format"""
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(((key, histogram.cumulative_counts(), histogram.sum, histogram.count)
+                                 for key, histogram in self.histograms.items()), key=lambda h: h[0])
+
+        lines = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append('# TYPE {}_{} counter'.format(self.prefix, name))
+                last_name = name
+            lines.append('{}_{}{} {}'.format(
+                self.prefix, name, self.__format_labels(labels), value))
+        for (name, labels), buckets, total, count in histograms:
+            if name != last_name:
+                lines.append('# TYPE {}_{} histogram'.format(self.prefix, name))
+                last_name = name
+            for upper_bound, bucket_count in buckets:
+                lines.append('{}_{}_bucket{} {}'.format(self.prefix, name, self.__format_labels(
+                    labels + (('le', upper_bound),)), bucket_count))
+            lines.append('{}_{}_sum{} {}'.format(
+                self.prefix, name, self.__format_labels(labels), total))
+            lines.append('{}_{}_count{} {}'.format(
+                self.prefix, name, self.__format_labels(labels), count))
+        for name, values in sorted(self.__read_gauges().items()):
+            lines.append('# TYPE {}_{} gauge'.format(self.prefix, name))
+            for labels, value in values:
+                lines.append('{}_{}{} {}'.format(
+                    self.prefix, name, self.__format_labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+    # ------------------------------------------------------------------------------
+    def __format_labels(self, labels: tuple) -> str:
+        # --------------------------------------------------------------------------
+        """Formats label pairs as {name="value",...}"""
+
+        if len(labels) == 0:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"'))
+                              for name, value in labels) + '}'
+
+# end Metrics class
+
+
+class MetricsEndpoint:
+    """Serves a Metrics registry as plain text over HTTP (GET /metrics)"""
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, metrics: Metrics, port: int = 9469, host: str = '127.0.0.1') -> None:
+        # --------------------------------------------------------------------------
+        """Binds the endpoint; call start() to begin serving in the background"""
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.to_text().encode()
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self.http_server = ThreadingHTTPServer(
+            (host, int(port)), MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        self.thread = None
+
+    # ------------------------------------------------------------------------------
+    def start(self) -> None:
+        # --------------------------------------------------------------------------
+        """Starts serving on a daemon thread"""
+
+        self.thread = threading.Thread(
+            target=self.http_server.serve_forever, name='Metrics Endpoint Thread', daemon=True)
+        self.thread.start()
+
+    # ------------------------------------------------------------------------------
+    def stop(self) -> None:
+        # --------------------------------------------------------------------------
+        """Stops serving and releases the port"""
+
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+# end MetricsEndpoint class
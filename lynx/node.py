@@ -1,53 +1,60 @@
 # node.py
 
-from account import Account
 from server import Server
 from peer import Peer
 from peer_connection import PeerConnection
 from message import Message, SignedMessage
 from utilities import Utilities
+from startup_profile import StartupProfile
+from profiler import PROFILER
+from log import get_logger
 import uuid
 from constants import *
 from hashlib import sha3_256
 import threading
 import time
-import traceback
 
-
-def display_debug(msg):
-    """Prints a message to the screen with the name of the current thread"""
-    print(msg)
+logger = get_logger(__name__)
 
 
 class Node:
     """Implements the core functionality of a node on the Lynx network."""
 
     # ------------------------------------------------------------------------------
-    def __init__(self, server_port=6969, server_host=None, max_peers=12) -> None:
+    def __init__(self, server_port=6969, server_host=None, max_peers=12, transport=None) -> None:
         # --------------------------------------------------------------------------
         """Initializes a node with the ability to receive requests, store information, and
         handle responses.
         """
-        self.debug = 1
+        self.startup_profile = StartupProfile()
 
         self.max_peers = int(max_peers)
         self.nonce = uuid.uuid4().hex + uuid.uuid1().hex
 
-        self.__debug('\nConfiguring Node...')
-        self.__debug('Configuring Known Peers File...')
-        if not Peer.is_peers_file_valid():
-            self.__debug('Initializing Known Peers File...')
-            Peer.init_peers_file()
+        logger.info('Configuring Node...')
+        with self.startup_profile.phase('Known Peers File'):
+            logger.info('Configuring Known Peers File...')
+            if not Peer.is_peers_file_valid():
+                logger.info('Initializing Known Peers File...')
+                Peer.init_peers_file()
 
-        self.__debug('Configuring Accounts Directory...')
-        Utilities.init_accounts()
+        with self.startup_profile.phase('Accounts Directory'):
+            logger.info('Configuring Accounts Directory...')
+            Utilities.init_accounts()
 
-        self.__debug('\nConfiguring Server...')
-        self.server = Server(host=server_host,
-                             port=server_port, max_peers=max_peers, nonce=self.nonce)
+        with self.startup_profile.phase('Server'):
+            logger.info('Configuring Server...')
+            self.server = Server(host=server_host,
+                                 port=server_port, max_peers=max_peers, nonce=self.nonce, startup_profile=self.startup_profile,
+                                 transport=transport)
 
         self.router = None
 
+        # kill -USR2 <pid> starts the profiler, a second signal dumps its stats
+        PROFILER.install_signal_handler()
+
+        logger.info('%s', self.startup_profile.report())
+
     # ------------------------------------------------------------------------------
     def set_id(self, id) -> None:
         # --------------------------------------------------------------------------
@@ -83,7 +90,7 @@ class Node:
     #     if self.router:
     #         next_peer_id, host, port = self.router(peer_id)
     #     if not self.router or not next_peer_id:
-    #         self.__debug('Unable to route %s to %s' % (message_type, peer_id))
+    #         logger.info('Unable to route %s to %s' % (message_type, peer_id))
     #         return None
 
     #     return self.server.connect_and_send(host, port, message_type, message_data, peer_id=next_peer_id)
@@ -101,10 +108,4 @@ class Node:
 
     #         time.sleep(30)
 
-    # ------------------------------------------------------------------------------
-    def __debug(self, message) -> None:
-        # --------------------------------------------------------------------------
-        if self.debug:
-            display_debug(message)
-
 # end Node class
@@ -1,12 +1,21 @@
 from peer_connection import PeerConnection
 from utilities import Utilities
+from log import get_logger
 from os.path import exists
-import json
 import threading
+import json
+
+logger = get_logger(__name__)
+
+# Serializes read-modify-write cycles of known_peers.json between handler threads
+KNOWN_PEERS_LOCK = threading.RLock()
 
 
 class Peer:
 
+    __slots__ = ('host', 'port', 'address', 'network', 'services', 'version', 'sub_version', 'timestamp',
+                 'nonce', 'start_accounts_count', 'relay', 'max_states_in_transit', 'states_requested', 'id')
+
     # ------------------------------------------------------------------------------
     def __init__(self, address: str = None, host: str = None, port: str = None, services: list = None, version: str = None, sub_version: str = None, timestamp: str = None, nonce: str = None, start_accounts_count: int = None, max_states_in_transit: int = 10, relay: bool = None, peer_info=None) -> None:
         # --------------------------------------------------------------------------
@@ -14,8 +23,6 @@ class Peer:
         port, network, and message logs.
         """
 
-        self.debug = 1
-        self.id = self.get_number_of_known_peers() + 1
         if peer_info is None:
             self.host = host
             self.port = port
@@ -45,12 +52,14 @@ class Peer:
 
         self.states_requested = []
 
-        if not self.is_peer_known():
-            self.add_peer()
-        else:
-            pass
-            # TODO UPDATE EXISTING PEER INFORMATION HERE
-            # print('UPDATE EXISTING PEER INFORMATION HERE')
+        with KNOWN_PEERS_LOCK:
+            self.id = self.get_number_of_known_peers() + 1
+            if not self.is_peer_known():
+                self.add_peer()
+            else:
+                pass
+                # TODO UPDATE EXISTING PEER INFORMATION HERE
+                # print('UPDATE EXISTING PEER INFORMATION HERE')
 
     @classmethod
     # ------------------------------------------------------------------------------
@@ -58,6 +67,13 @@ class Peer:
         # --------------------------------------------------------------------------
         """"""
 
+        with KNOWN_PEERS_LOCK:
+            self.__write_peers_file(peers)
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __write_peers_file(self, peers: dict) -> None:
+        # --------------------------------------------------------------------------
         try:
             known_peers_file = None
             if exists('../known_peers.json'):
@@ -75,7 +91,7 @@ class Peer:
             known_peers_file = open('../known_peers.json', 'w')
             known_peers_file.write(json.dumps(peers))
         except:
-            self.__debug('Unable to initialize "known_peers.json".')
+            logger.warning('Unable to initialize "known_peers.json".')
         finally:
             if exists('../known_peers.json') and known_peers_file is not None:
                 known_peers_file.close()
@@ -95,19 +111,19 @@ class Peer:
                 known_peers_file = open('../known_peers.json', 'r+')
                 data = json.load(known_peers_file)
                 if data is None or not isinstance(data, dict):
-                    self.__debug('"known_peers.json" is empty.')
+                    logger.info('"known_peers.json" is empty.')
             else:
                 raise FileNotFoundError
         except ValueError:
-            self.__debug(
+            logger.warning(
                 '"known_peers.json" is formatted incorrectly or empty, try re-initializing...')
             return False
         except FileNotFoundError:
-            self.__debug(
+            logger.info(
                 '"known_peers.json" not found. try creating a new file...')
             return False
         except:
-            self.__debug('ERROR: Unable to read/write to "known_peers.json".')
+            logger.error('Unable to read/write to "known_peers.json".')
             return False
         finally:
             if exists('../known_peers.json') and known_peers_file is not None:
@@ -129,14 +145,15 @@ class Peer:
         # --------------------------------------------------------------------------
         """"""
 
-        if self.is_peers_file_valid():
-            with open('../known_peers.json', 'r+') as known_peers_file:
-                data = json.load(known_peers_file)
-                known_peers_file.close()
-                return data
+        with KNOWN_PEERS_LOCK:
+            if self.is_peers_file_valid():
+                with open('../known_peers.json', 'r+') as known_peers_file:
+                    data = json.load(known_peers_file)
+                    known_peers_file.close()
+                    return data
 
-        self.init_peers_file()
-        return {}
+            self.init_peers_file()
+            return {}
 
     @classmethod
     # ------------------------------------------------------------------------------
@@ -151,18 +168,19 @@ class Peer:
         # --------------------------------------------------------------------------
         """"""
 
-        known_peer_data = self.get_known_peers()
-        if self.is_peers_file_valid():
-            with open('../known_peers.json', 'r+') as known_peers_file:
-                known_peer_data.update(
-                    {self.address: json.loads(self.to_JSON())})
-                known_peers_file.seek(0)
-                known_peers_file.write(json.dumps(known_peer_data))
-                known_peers_file.truncate()
-            known_peers_file.close()
-        else:
-            self.init_peers_file(
-                peers={self.address: json.loads(self.to_JSON())})
+        with KNOWN_PEERS_LOCK:
+            known_peer_data = self.get_known_peers()
+            if self.is_peers_file_valid():
+                with open('../known_peers.json', 'r+') as known_peers_file:
+                    known_peer_data.update(
+                        {self.address: self.to_dict()})
+                    known_peers_file.seek(0)
+                    known_peers_file.write(json.dumps(known_peer_data))
+                    known_peers_file.truncate()
+                known_peers_file.close()
+            else:
+                self.init_peers_file(
+                    peers={self.address: self.to_dict()})
 
         return True
 
@@ -171,14 +189,40 @@ class Peer:
         # --------------------------------------------------------------------------
         """Returns a serialized version of a Peer object"""
 
-        return json.dumps(self, default=lambda o: o.__dict__,
-                          sort_keys=True, indent=4)
+        return json.dumps(self.to_dict(), sort_keys=True, indent=4)
+
+    # ------------------------------------------------------------------------------
+    def to_dict(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Returns the fields of a Peer object, as stored in known_peers.json"""
+
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def from_dict(self, data: dict):
+        # --------------------------------------------------------------------------
+        """Returns a Peer object given a dict like the one to_dict returns. Unlike
+        the constructor this does not read or write known_peers.json. Raises
+        KeyError if host or port is missing.
+        """
+
+        peer = Peer.__new__(Peer)
+        for name in Peer.__slots__:
+            setattr(peer, name, data.get(name))
+        peer.host, peer.port = data['host'], data['port']
+        if peer.address is None:
+            peer.address = '{}:{}'.format(peer.host, peer.port)
+        if peer.max_states_in_transit is None:
+            peer.max_states_in_transit = 10
+        peer.states_requested = list(data.get('states_requested') or [])
+        return peer
 
     @classmethod
     # ------------------------------------------------------------------------------
     def from_JSON(self, JSON: str):
         # --------------------------------------------------------------------------
-        """"Returns a Message object given a JSON input. If JSON is not formatted
+        """"Returns a Peer object given a JSON input. If JSON is not formatted
         correctly, this method will return None.
         """
 
@@ -187,27 +231,17 @@ class Peer:
             if not isinstance(data, dict):
                 raise ValueError
 
-            peer = Peer(
-                address=data['address'], services=data['services'], version=data['version'], sub_version=data['sub_version'], timestamp=float(data['timestamp']), nonce=data['nonce'], start_accounts_count=int(data['start_account_count']), relay=data['relay'])
+            peer = Peer.from_dict(data)
             return peer
         except ValueError:
-            print('Peer data is not a "dict".')
+            logger.warning('Peer data is not a "dict".')
             return None
         except KeyError:
-            print('Peer is not formatted correctly.')
+            logger.warning('Peer is not formatted correctly.')
             return None
         except:
-            print('Unable to convert data in Peer object.')
+            logger.warning('Unable to convert data in Peer object.')
             return None
 
-    @ classmethod
-    # ------------------------------------------------------------------------------
-    def __debug(self, msg) -> None:
-        # --------------------------------------------------------------------------
-        """Prints a message to the screen with the name of the current thread"""
-
-        # if self.debug:
-        print("[%s] %s" % (str(threading.currentThread().getName()), msg))
-
 
 # end Peer class
@@ -1,50 +1,98 @@
-from account import Account
 from message import Message
-import socket
-import traceback
-import threading
+from metrics import Metrics
+from transport import Transport, TCP_TRANSPORT
+from deadline import Deadline, DeadlineExceeded
+from profiler import PROFILER
+from log import get_logger
+import logging
+import time
+import re
 
+logger = get_logger(__name__)
 
-def display_debug(msg):
-    """Prints a message to the screen with the name of the current thread"""
-    print(msg)
+RECEIVE_BUFFER_SIZE = 65536
+# Most bytes a peer may send without completing a message. The largest
+# messages of the protocol (MAX_REFERENCES_PER_RESPONSE references or
+# MAX_STATES_PER_RESPONSE states) are a fraction of this.
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+# Bytes that matter when looking for the end of a JSON object, outside and
+# inside a string
+STRUCTURE_TOKENS = re.compile(rb'[{}"]')
+STRING_TOKENS = re.compile(rb'["\\]')
+
+
+class MessageTooLarge(ValueError):
+    """Raised when a peer sends more than max_message_size bytes of one message"""
 
 
 class PeerConnection:
 
     # ------------------------------------------------------------------------------
-    def __init__(self, peer_id, host, port, sock=None, debug=False) -> None:
+    def __init__(self, peer_id, host, port, sock=None, metrics: Metrics = None, transport: Transport = None,
+                 deadline: Deadline = None, max_message_size: int = MAX_MESSAGE_SIZE) -> None:
         # --------------------------------------------------------------------------
-        """Any exceptions thrown upwards"""
+        """Any exceptions thrown upwards. If no socket is given, a connection to
+        host:port is opened through transport (TCP unless specified), taking no
+        longer than deadline allows. See set_deadline(). A message longer than
+        max_message_size bytes is not buffered; see feed_data().
+        """
 
         self.id = peer_id
-        self.debug = debug
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+        # Label used for per-peer byte counters (the peer's address if known)
+        self.peer_label = peer_id if peer_id is not None else str(host)
+
+        # Bytes received that are not yet part of a complete message
+        self.buffer = bytearray()
+        self.max_message_size = int(max_message_size)
+        # How far the first message in the buffer has been scanned, at what
+        # object depth and whether that point is inside a string
+        self.scan_offset = 0
+        self.scan_depth = 0
+        self.scan_in_string = False
+        # Set once the remote opened a stream (flag 10): the connection stays
+        # open for further requests instead of being closed after one
+        self.streaming = False
+        # Set when the last receive_data() gave up because time ran out
+        self.timed_out = False
+        self.deadline = None
 
         if sock is None:
-            self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.s.connect((host, int(port)))
+            transport = transport if transport is not None else TCP_TRANSPORT
+            self.s = transport.connect(host, int(port), timeout=deadline.timeout()
+                                       if deadline is not None else None)
         else:
             self.s = sock
+        self.set_deadline(deadline)
 
     # ------------------------------------------------------------------------------
-    def __debug(self, message) -> None:
+    def set_deadline(self, deadline: Deadline) -> None:
         # --------------------------------------------------------------------------
-        if self.debug:
-            display_debug(message)
+        """Bounds every later send and receive by deadline, or lifts the bound if
+        None. Cancelling the deadline aborts the connection.
+        """
+
+        if self.deadline is not None:
+            self.deadline.detach(self.s)
+        self.deadline = deadline
+        if deadline is not None:
+            deadline.attach(self.s)
 
+    @classmethod
     # ------------------------------------------------------------------------------
-    def __make_message(self, message_type, message_flag, message_data) -> Message:
+    def encode(self, message_type: str, message_flag: int, message_data: dict = None) -> bytes:
         # --------------------------------------------------------------------------
-        """Packs the message into a Message object and then signs it using the 
-        provided Account object.
-
-        For more information about packing visit: https://docs.python.org/3/library/struct.html
+        """Returns the bytes send_data writes for a message. The result can be
+        written to any number of connections with send_encoded.
         """
 
         message = Message(type=message_type,
                           flag=message_flag, data=message_data)
-        return message
+        return message.to_JSON().encode()
 
+    @PROFILER.profile('send_data')
     # ------------------------------------------------------------------------------
     def send_data(self, message_type: str, message_flag: int, message_data: dict = None) -> bool:
         # --------------------------------------------------------------------------
@@ -53,46 +101,203 @@ class PeerConnection:
         """
 
         try:
-            host, port = self.s.getpeername()
-
-            message = self.__make_message(
+            message_binary = self.encode(
                 message_type, message_flag, message_data)
-            message_JSON = message.to_JSON()
-            message_binary = message_JSON.encode()
-            self.s.send(message_binary)
-            self.__debug('Sent (%s:%s) a message' % (host, port))
-            self.__debug('Message Information:\n\tType: {}\n\tFlag: {}\n\tData: {}\n'.format(
-                message_type, message_flag, message_data))
         except KeyboardInterrupt:
             raise
         except:
-            if self.debug:
-                self.__debug('Unable to send data: {}'.format(message_data))
-                traceback.print_exc()
+            logger.warning('Unable to encode %s (flag %s) message',
+                           message_type, message_flag, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return False
+
+        if not self.send_encoded(message_binary, message_type, message_flag):
             return False
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Message Information:\n\tType: %s\n\tFlag: %s\n\tData: %s\n',
+                         message_type, message_flag, message_data)
         return True
 
     # ------------------------------------------------------------------------------
-    def receive_data(self) -> Message:
+    def send_encoded(self, message_binary: bytes, message_type: str, message_flag: int) -> bool:
+        # --------------------------------------------------------------------------
+        """Writes a message already encoded with encode(). Returns True on success
+        or False if there was an error.
+        """
+
+        try:
+            if self.deadline is not None:
+                self.s.settimeout(self.deadline.timeout())
+            self.s.sendall(message_binary)
+            if self.metrics is not None:
+                self.metrics.inc('messages_sent_total',
+                                 type=message_type, flag=message_flag)
+                self.metrics.inc('bytes_sent_total', len(
+                    message_binary), peer=self.peer_label)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Sent (%s:%s) a message', *self.s.getpeername()[:2])
+        except KeyboardInterrupt:
+            raise
+        except:
+            logger.warning('Unable to send %s (flag %s) message',
+                           message_type, message_flag, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return False
+        return True
+
+    @PROFILER.profile('receive_data')
+    # ------------------------------------------------------------------------------
+    def receive_data(self, timeout: float = None) -> Message:
         # --------------------------------------------------------------------------
         """Receive a message from a peer connection. Returns an None if there was 
-        any error.
+        any error. Reads until one complete JSON message has arrived, so messages
+        are not limited to a single recv() and any bytes of a following message
+        are kept for the next call. The whole message must arrive within timeout
+        seconds, if given, and before the connection's deadline; a peer sending
+        it a byte at a time does not get more time.
         """
 
+        self.timed_out = False
+        expires_at = None if timeout is None else time.monotonic() + timeout
         try:
-            message_JSON = self.s.recv(1024).decode()
-            if message_JSON and len(message_JSON) > 0:
-                message = Message.from_JSON(message_JSON)
-                return message
+            message = self.feed_data(b'')
+            while message is None:
+                if expires_at is not None or self.deadline is not None:
+                    self.s.settimeout(self.__time_left(expires_at))
+                message_binary = self.s.recv(RECEIVE_BUFFER_SIZE)
+                if not message_binary:
+                    if self.deadline is not None:
+                        # A cancelled deadline shuts the socket down
+                        self.deadline.check()
+                    return self.flush_data()
+                message = self.feed_data(message_binary)
 
-            return None
+            return message
         except KeyboardInterrupt:
             raise
+        except TimeoutError:
+            self.timed_out = True
+            logger.debug('Timed out receiving data')
+            return None
+        except MessageTooLarge:
+            logger.warning('Dropping %s:%s, message exceeds %s bytes',
+                           self.host, self.port, self.max_message_size)
+            return None
         except:
-            if self.debug:
-                # traceback.print_exc()
-                pass
+            logger.debug('Unable to receive data', exc_info=True)
+            return None
+
+    # ------------------------------------------------------------------------------
+    def __time_left(self, expires_at: float) -> float:
+        # --------------------------------------------------------------------------
+        """Returns the socket timeout for the next recv of receive_data"""
+
+        wait = self.deadline.timeout() if self.deadline is not None else None
+        if expires_at is not None:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded('Read timed out')
+            wait = remaining if wait is None else min(wait, remaining)
+        return wait
+
+    # ------------------------------------------------------------------------------
+    def feed_data(self, message_binary: bytes) -> Message:
+        # --------------------------------------------------------------------------
+        """Adds bytes read from the socket by the caller to the receive buffer.
+        Returns the first complete message, or None if it has not fully arrived.
+        Raises MessageTooLarge, after emptying the buffer, once more than
+        max_message_size bytes are buffered without completing a message; the
+        connection should then be dropped.
+        """
+
+        if message_binary:
+            if self.metrics is not None:
+                self.metrics.inc('bytes_received_total', len(
+                    message_binary), peer=self.peer_label)
+            self.buffer += message_binary
+
+        message_JSON = self.__next_message_JSON()
+        if message_JSON is None:
+            if len(self.buffer) > self.max_message_size:
+                self.__split_buffer(len(self.buffer))
+                if self.metrics is not None:
+                    self.metrics.inc('messages_oversized_total')
+                raise MessageTooLarge('Message exceeds {} bytes'.format(
+                    self.max_message_size))
             return None
+        return self.__to_message(message_JSON)
+
+    # ------------------------------------------------------------------------------
+    def flush_data(self) -> Message:
+        # --------------------------------------------------------------------------
+        """Called once the remote has closed. Hands over whatever is left in the
+        receive buffer for validation, or returns None if it is empty.
+        """
+
+        if len(self.buffer.strip()) == 0:
+            return None
+
+        message_JSON = self.__next_message_JSON()
+        if message_JSON is None:
+            message_JSON = self.buffer.decode(errors='replace')
+            self.__split_buffer(len(self.buffer))
+        return self.__to_message(message_JSON)
+
+    # ------------------------------------------------------------------------------
+    def __to_message(self, message_JSON: str) -> Message:
+        # --------------------------------------------------------------------------
+        message = Message.from_JSON(message_JSON)
+        if self.metrics is not None and message is not None:
+            self.metrics.inc('messages_received_total',
+                             type=message.type, flag=message.flag)
+        return message
+
+    # ------------------------------------------------------------------------------
+    def __next_message_JSON(self) -> str:
+        # --------------------------------------------------------------------------
+        """Splits the first complete JSON object off the receive buffer. Returns
+        None if the buffer does not hold a complete object yet. The buffer is
+        scanned once, from where the last call stopped, so a message arriving
+        in many pieces costs no more than one arriving whole, and a complete
+        message is returned even if the next one has partly arrived.
+        """
+
+        buffer = self.buffer
+        position = self.scan_offset
+        while True:
+            if self.scan_in_string:
+                match = STRING_TOKENS.search(buffer, position)
+            else:
+                match = STRUCTURE_TOKENS.search(buffer, position)
+            if match is None:
+                # position is past the end after a trailing backslash
+                self.scan_offset = max(position, len(buffer))
+                return None
+
+            token = buffer[match.start()]
+            position = match.end()
+            if token == 0x5c:    # backslash, skip the escaped character
+                position += 1
+            elif token == 0x22:  # "
+                self.scan_in_string = not self.scan_in_string
+            elif token == 0x7b:  # {
+                self.scan_depth += 1
+            elif self.scan_depth > 0:  # }
+                self.scan_depth -= 1
+                if self.scan_depth == 0:
+                    break
+
+        message_JSON = buffer[:position].decode(errors='replace').strip()
+        self.__split_buffer(position)
+        return message_JSON
+
+    # ------------------------------------------------------------------------------
+    def __split_buffer(self, end: int) -> None:
+        # --------------------------------------------------------------------------
+        """Drops the first end bytes of the receive buffer and restarts the scan"""
+
+        del self.buffer[:end]
+        self.scan_offset = 0
+        self.scan_depth = 0
+        self.scan_in_string = False
 
     # ------------------------------------------------------------------------------
     def close(self) -> None:
@@ -101,6 +306,8 @@ class PeerConnection:
         after this call.
         """
 
+        if self.deadline is not None:
+            self.deadline.detach(self.s)
         self.s.close()
         self.s = None
         self.sd = None
@@ -0,0 +1,253 @@
+# peer_sender.py
+from __future__ import annotations
+from peer_connection import PeerConnection, RECEIVE_BUFFER_SIZE, MessageTooLarge
+from message_validation import MessageValidation
+from log import get_logger
+from typing import TYPE_CHECKING
+import threading
+import logging
+import socket
+import queue
+import time
+if TYPE_CHECKING:
+    from broadcast import BroadcastResult
+    from server import Server
+
+logger = get_logger(__name__)
+
+# Seconds before a peer that refused a stream is asked again
+STREAM_RETRY_DELAY = 60.0
+
+
+class PeerSender:
+    """Writes encoded messages to one peer in the order they were queued. Its
+    thread keeps a stream (flag 10) open to the peer so consecutive messages
+    share one connection, reconnects once when the stream broke and closes it
+    after idle_timeout seconds without messages. A peer that does not accept
+    streams is sent each message on a connection of its own. Replies read off
+    the stream are dispatched like those of Server.connect_and_send.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, server: Server, peer_id: str, host: str, port: int, max_queue: int = 256,
+                 idle_timeout: float = 5.0, timeout: float = 10.0, poll_interval: float = 0.2) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an idle PeerSender holding at most max_queue messages.
+        Opening a stream, or sending a message on a connection of its own and
+        reading the replies, takes at most timeout seconds, as does each write
+        to an open stream. An open stream is checked for replies every
+        poll_interval seconds.
+        """
+
+        self.server = server
+        self.peer_id = peer_id
+        self.host = host
+        self.port = int(port)
+        self.idle_timeout = float(idle_timeout)
+        self.timeout = float(timeout)
+        self.poll_interval = float(poll_interval)
+        self.queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self.lock = threading.Lock()
+        self.thread = None
+        self.connection = None
+        self.retry_stream_at = 0.0
+
+    # ------------------------------------------------------------------------------
+    def enqueue(self, message_binary: bytes, message_type: str, message_flag: int, result: BroadcastResult) -> bool:
+        # --------------------------------------------------------------------------
+        """Queues an encoded message and starts the sender thread if needed.
+        Returns False, marking the peer as failed in result, if the queue is full.
+        """
+
+        try:
+            self.queue.put_nowait(
+                (message_binary, message_type, message_flag, result))
+        except queue.Full:
+            self.server.metrics.inc('broadcast_messages_total', result='queue_full')
+            result.mark_failed(self.peer_id, 'queue_full')
+            return False
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, name='Peer Sender Thread (%s)' % self.peer_id,
+                                               daemon=True)
+                self.thread.start()
+        return True
+
+    # ------------------------------------------------------------------------------
+    def __run(self) -> None:
+        # --------------------------------------------------------------------------
+        idle_since = time.monotonic()
+        while not self.server.shutdown:
+            try:
+                item = self.queue.get(
+                    timeout=self.poll_interval if self.connection is not None else self.idle_timeout)
+            except queue.Empty:
+                if self.connection is not None and not self.__read_replies():
+                    self.__disconnect()
+                if time.monotonic() - idle_since >= self.idle_timeout:
+                    with self.lock:
+                        if self.queue.empty():
+                            self.thread = None
+                            self.__disconnect()
+                            return
+                continue
+
+            self.__send(*item)
+            idle_since = time.monotonic()
+
+        with self.lock:
+            self.thread = None
+            self.__disconnect()
+            while not self.queue.empty():
+                self.queue.get_nowait()[3].mark_failed(self.peer_id, 'shutdown')
+
+    # ------------------------------------------------------------------------------
+    def __send(self, message_binary: bytes, message_type: str, message_flag: int, result: BroadcastResult) -> None:
+        # --------------------------------------------------------------------------
+        """Writes one message, reconnecting once if the stream has broken"""
+
+        for _ in range(2):
+            try:
+                if self.connection is not None and not self.__read_replies():
+                    self.__disconnect()
+                if self.connection is None:
+                    self.__connect()
+
+                if self.connection is not None:
+                    if not self.connection.send_encoded(message_binary, message_type, message_flag):
+                        raise ConnectionError('Stream to {} broke'.format(self.peer_id))
+                else:
+                    self.__send_once(message_binary, message_type, message_flag)
+            except OSError:
+                logger.debug('Unable to send to %s', self.peer_id,
+                             exc_info=logger.isEnabledFor(logging.DEBUG))
+                self.__disconnect()
+                continue
+
+            self.server.metrics.inc('broadcast_messages_total', result='sent')
+            result.mark_sent(self.peer_id)
+            return
+
+        self.server.metrics.inc('broadcast_messages_total', result='failed')
+        result.mark_failed(self.peer_id, 'send_failed')
+
+    # ------------------------------------------------------------------------------
+    def __open(self) -> PeerConnection:
+        # --------------------------------------------------------------------------
+        """Connects to the peer. The connection's deadline ends after timeout
+        seconds or when the server's requests are cancelled.
+        """
+
+        return PeerConnection(peer_id=self.peer_id, host=self.host, port=self.port,
+                              metrics=self.server.metrics, transport=self.server.transport,
+                              deadline=self.server.root_deadline.child(self.timeout))
+
+    # ------------------------------------------------------------------------------
+    def __connect(self) -> None:
+        # --------------------------------------------------------------------------
+        """Opens a stream to the peer. Leaves connection set to None if the peer
+        refused it (older nodes do not know flag 10).
+        """
+
+        if time.monotonic() < self.retry_stream_at:
+            return
+
+        connection = self.__open()
+        try:
+            reply = connection.receive_data() if connection.send_data('request', 10, {}) else None
+        except Exception:
+            connection.close()
+            raise
+
+        if reply is None or not MessageValidation.validate_stream_response(reply) or not reply.data['accepted']:
+            connection.close()
+            self.retry_stream_at = time.monotonic() + STREAM_RETRY_DELAY
+            logger.info('Peer %s does not accept streams', self.peer_id)
+            return
+
+        # The stream outlives the handshake's deadline, its writes are bounded
+        # by the socket timeout instead
+        connection.set_deadline(None)
+        connection.s.settimeout(self.timeout)
+        self.connection = connection
+        self.server.metrics.inc('streams_opened_total')
+
+    # ------------------------------------------------------------------------------
+    def __send_once(self, message_binary: bytes, message_type: str, message_flag: int) -> None:
+        # --------------------------------------------------------------------------
+        """Sends a message on a connection of its own and dispatches the replies"""
+
+        connection = self.__open()
+        try:
+            if not connection.send_encoded(message_binary, message_type, message_flag):
+                raise ConnectionError('Unable to send to {}'.format(self.peer_id))
+            replies = []
+            if message_type == 'request':
+                reply = connection.receive_data()
+                while reply is not None:
+                    replies.append(reply)
+                    reply = connection.receive_data()
+            self.__dispatch(replies, connection)
+        finally:
+            connection.close()
+
+    # ------------------------------------------------------------------------------
+    def __read_replies(self) -> bool:
+        # --------------------------------------------------------------------------
+        """Dispatches the replies that have arrived on the stream without waiting
+        for more. Returns False if the peer has closed the stream.
+        """
+
+        connection = self.connection
+        replies = []
+        open_stream = True
+        connection.s.settimeout(0.0)
+        try:
+            while True:
+                try:
+                    message_binary = connection.s.recv(RECEIVE_BUFFER_SIZE)
+                except (BlockingIOError, InterruptedError, socket.timeout):
+                    break
+                except OSError:
+                    message_binary = b''
+                if not message_binary:
+                    open_stream = False
+                    break
+                try:
+                    message = connection.feed_data(message_binary)
+                    while message is not None:
+                        replies.append(message)
+                        message = connection.feed_data(b'')
+                except MessageTooLarge:
+                    logger.warning('Dropping stream to %s, message exceeds %s bytes',
+                                   self.peer_id, connection.max_message_size)
+                    open_stream = False
+                    break
+        finally:
+            if open_stream:
+                connection.s.settimeout(self.timeout)
+
+        self.__dispatch(replies, connection)
+        return open_stream
+
+    # ------------------------------------------------------------------------------
+    def __dispatch(self, replies: list, connection: PeerConnection) -> None:
+        # --------------------------------------------------------------------------
+        try:
+            self.server.dispatch_replies(replies, connection)
+        except Exception:
+            logger.warning('Unable to handle replies from %s',
+                           self.peer_id, exc_info=True)
+
+    # ------------------------------------------------------------------------------
+    def __disconnect(self) -> None:
+        # --------------------------------------------------------------------------
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+# end PeerSender class
@@ -0,0 +1,262 @@
+# profiler.py
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from log import get_logger
+import cProfile
+import pstats
+import threading
+import signal
+import time
+import io
+import os
+
+logger = get_logger(__name__)
+
+DISABLED_SECTION = nullcontext()
+
+
+class Profiler:
+    """Profiles named sections of a running node with cProfile. Sections are
+    free to enter while the profiler is stopped; once started, every thread
+    keeps one cProfile.Profile per section and the stats are merged per section
+    when the profiling window ends.
+
+    Only the outermost section of a thread runs cProfile (a thread can only have
+    one active profiler), nested sections are counted and timed and their
+    functions show up in the outer section's stats. Python 3.12 and later allow
+    only one active profiler per process: a section entered while another
+    thread's is being profiled is timed but not profiled.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, output_directory: str = '../profiles') -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a stopped Profiler that dumps its stats into output_directory"""
+
+        self.output_directory = output_directory
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles = []
+        self.sections = {}
+        self.timed_only = 0
+        self.start_time = None
+        self.timer = None
+        self.last_dump = None
+
+    # ------------------------------------------------------------------------------
+    def start(self, window: float = None) -> bool:
+        # --------------------------------------------------------------------------
+        """Starts profiling. If window is given the stats are dumped and profiling
+        stops after that many seconds. Returns False if already running.
+        """
+
+        with self.lock:
+            if self.enabled:
+                return False
+            self.profiles = []
+            self.sections = {}
+            self.timed_only = 0
+            self.local = threading.local()
+            self.start_time = time.time()
+            self.enabled = True
+            if window is not None and window > 0:
+                self.timer = threading.Timer(window, self.stop)
+                self.timer.daemon = True
+                self.timer.start()
+
+        logger.info('Profiler started (window: %s)', window)
+        return True
+
+    # ------------------------------------------------------------------------------
+    def stop(self) -> str:
+        # --------------------------------------------------------------------------
+        """Stops profiling and dumps the collected stats. Returns the path of the
+        report, or None if the profiler was not running.
+        """
+
+        with self.lock:
+            if not self.enabled:
+                return None
+            self.enabled = False
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            profiles = list(self.profiles)
+            sections = dict(self.sections)
+            timed_only = self.timed_only
+
+        path = self.dump(profiles, sections, time.time() - self.start_time, timed_only=timed_only)
+        logger.info('Profiler stopped, stats written to %s', path)
+        return path
+
+    # ------------------------------------------------------------------------------
+    def toggle(self, window: float = None) -> str:
+        # --------------------------------------------------------------------------
+        """Starts the profiler if it is stopped, otherwise stops it and returns
+        the path of the report.
+        """
+
+        if self.enabled:
+            return self.stop()
+        self.start(window)
+        return None
+
+    # ------------------------------------------------------------------------------
+    def status(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Returns whether the profiler is running and where the last report went"""
+
+        return {'running': self.enabled, 'last_dump': self.last_dump,
+                'elapsed': time.time() - self.start_time if self.enabled else 0}
+
+    # ------------------------------------------------------------------------------
+    def section(self, name: str):
+        # --------------------------------------------------------------------------
+        """Returns a context manager profiling its body as section name. Costs an
+        attribute check while the profiler is stopped.
+        """
+
+        if not self.enabled:
+            return DISABLED_SECTION
+        return self.__profile_section(name)
+
+    # ------------------------------------------------------------------------------
+    def profile(self, name: str):
+        # --------------------------------------------------------------------------
+        """Decorator profiling every call of a function as section name"""
+
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.__profile_section(name):
+                    return function(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    # ------------------------------------------------------------------------------
+    @contextmanager
+    def __profile_section(self, name: str):
+        # --------------------------------------------------------------------------
+        """Runs the body under this thread's profile for section name"""
+
+        local = self.local
+        profile = None
+        start_time = time.perf_counter()
+        if not getattr(local, 'active', False):
+            profiles = getattr(local, 'profiles', None)
+            if profiles is None:
+                profiles = local.profiles = {}
+            profile = profiles.get(name)
+            if profile is None:
+                profile = profiles[name] = cProfile.Profile()
+                with self.lock:
+                    self.profiles.append((name, profile))
+            try:
+                profile.enable()
+                local.active = True
+            except ValueError:
+                # From Python 3.12 on only one profiler can be active in the whole
+                # process, so while another thread's section runs this one is only
+                # timed
+                profile = None
+                with self.lock:
+                    self.timed_only += 1
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                local.active = False
+            elapsed = time.perf_counter() - start_time
+            with self.lock:
+                calls, total, longest = self.sections.get(name, (0, 0.0, 0.0))
+                self.sections[name] = (
+                    calls + 1, total + elapsed, max(longest, elapsed))
+
+    # ------------------------------------------------------------------------------
+    def dump(self, profiles: list, sections: dict, window: float, top: int = 25, timed_only: int = 0) -> str:
+        # --------------------------------------------------------------------------
+        """Writes a text report and one .prof file per section into a new
+        directory below output_directory. Returns the report path. timed_only is
+        the number of sections that could not be profiled.
+        """
+
+        directory = os.path.join(self.output_directory, 'profile-{}'.format(
+            time.strftime('%Y%m%d-%H%M%S')))
+        os.makedirs(directory, exist_ok=True)
+
+        report = io.StringIO()
+        report.write('Profiling window: {:.3f} s\n'.format(window))
+        if timed_only > 0:
+            report.write('Sections only timed (another profiler was active): {}\n'.format(timed_only))
+        report.write('\n')
+        report.write('{:<32} {:>10} {:>14} {:>14} {:>14}\n'.format(
+            'Section', 'Calls', 'Total (s)', 'Mean (ms)', 'Max (ms)'))
+        for name, (calls, total, longest) in sorted(sections.items(), key=lambda s: -s[1][1]):
+            report.write('{:<32} {:>10} {:>14.4f} {:>14.3f} {:>14.3f}\n'.format(
+                name, calls, total, total / calls * 1000, longest * 1000))
+
+        merged = {}
+        for name, profile in profiles:
+            merged.setdefault(name, []).append(profile)
+        for name, section_profiles in sorted(merged.items()):
+            stats = None
+            for profile in section_profiles:
+                try:
+                    profile.create_stats()
+                except Exception:
+                    continue
+                if not profile.stats:
+                    continue
+                if stats is None:
+                    stats = pstats.Stats(profile, stream=report)
+                else:
+                    stats.add(profile)
+            if stats is None:
+                continue
+            stats.dump_stats(os.path.join(
+                directory, '{}.prof'.format(name.replace('/', '_'))))
+            report.write('\n==== {} ====\n'.format(name))
+            stats.sort_stats('cumulative').print_stats(top)
+
+        path = os.path.join(directory, 'report.txt')
+        with open(path, 'w') as report_file:
+            report_file.write(report.getvalue())
+        self.last_dump = path
+
+        return path
+
+    # ------------------------------------------------------------------------------
+    def install_signal_handler(self, signal_number: int = None, window: float = None) -> bool:
+        # --------------------------------------------------------------------------
+        """Toggles the profiler whenever the process receives signal_number
+        (SIGUSR2 by default). Must be called from the main thread; returns False
+        if the platform has no such signal.
+        """
+
+        if signal_number is None:
+            signal_number = getattr(signal, 'SIGUSR2', None)
+        if signal_number is None:
+            return False
+
+        def handle_signal(signum, frame):
+            # Dumping can take a while, keep it off the interrupted thread
+            threading.Thread(target=self.toggle, args=(window,),
+                             name='Profiler Toggle Thread', daemon=True).start()
+
+        try:
+            signal.signal(signal_number, handle_signal)
+        except ValueError:
+            logger.debug('Profiler signal handler must be installed from the main thread')
+            return False
+        return True
+
+# end Profiler class
+
+
+PROFILER = Profiler()
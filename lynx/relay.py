@@ -0,0 +1,103 @@
+# relay.py
+from __future__ import annotations
+from seen_cache import SeenCache
+from log import get_logger
+from hashlib import sha3_256
+from typing import Callable, TYPE_CHECKING
+import json
+if TYPE_CHECKING:
+    from server import Server
+
+logger = get_logger(__name__)
+
+MAX_RELAY_HOPS = 16
+
+
+class Relay:
+    """Floods messages to every peer that asked for relaying (relay=True in its
+    version message). A relayed message is {'kind', 'data', 'hops', 'sender'};
+    it is identified by the hash of its kind and data, and the SeenCache makes
+    sure each message is delivered locally and forwarded at most once. Peers
+    that sent a message, or were already sent it, are never sent it again.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, server: Server, enabled: bool = True, seen_cache: SeenCache = None) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes the relay of server, forwarding through its Broadcaster"""
+
+        self.server = server
+        self.enabled = enabled
+        self.seen_cache = seen_cache if seen_cache is not None else SeenCache()
+        self.handlers = {}
+
+    # ------------------------------------------------------------------------------
+    def add_handler(self, kind: str, handler: Callable) -> None:
+        # --------------------------------------------------------------------------
+        """Registers handler(data) for relayed messages of a kind"""
+
+        self.handlers[kind] = handler
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def message_key(self, kind: str, data) -> str:
+        # --------------------------------------------------------------------------
+        return sha3_256(json.dumps([kind, data], sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    # ------------------------------------------------------------------------------
+    def broadcast(self, kind: str, data) -> int:
+        # --------------------------------------------------------------------------
+        """Sends a new message to every relaying peer. Returns the number of peers
+        it was sent to.
+        """
+
+        key = self.message_key(kind, data)
+        if not self.seen_cache.add(key):
+            return 0
+        return self.__forward(key, {'kind': kind, 'data': data, 'hops': 0})
+
+    # ------------------------------------------------------------------------------
+    def handle(self, message_data: dict) -> bool:
+        # --------------------------------------------------------------------------
+        """Handles a relayed message from a peer. Returns False if it was seen
+        before, in which case it is neither delivered nor forwarded.
+        """
+
+        kind, data, sender = message_data['kind'], message_data['data'], message_data['sender']
+        key = self.message_key(kind, data)
+        if not self.seen_cache.add(key, sender):
+            self.server.metrics.inc('relay_messages_total', result='duplicate')
+            return False
+        self.server.metrics.inc('relay_messages_total', result='new')
+
+        handler = self.handlers.get(kind)
+        if handler is not None:
+            try:
+                handler(data)
+            except Exception:
+                logger.warning('Unable to handle relayed %s message',
+                               kind, exc_info=True)
+
+        hops = message_data['hops'] + 1
+        if self.enabled and hops < MAX_RELAY_HOPS:
+            self.__forward(key, {'kind': kind, 'data': data, 'hops': hops})
+        return True
+
+    # ------------------------------------------------------------------------------
+    def __forward(self, key: str, message_data: dict) -> int:
+        # --------------------------------------------------------------------------
+        """Sends a message to the relaying peers that do not have it yet"""
+
+        peers = {peer_id: peer for peer_id, peer in list(self.server.peers.items())
+                 if peer.relay and peer_id != '{}:{}'.format(self.server.host, self.server.port)}
+        targets = self.seen_cache.claim_unknown(key, list(peers))
+        if len(targets) == 0:
+            return 0
+
+        message_data = dict(message_data, sender='{}:{}'.format(
+            self.server.host, self.server.port))
+        self.server.broadcaster.broadcast('request', 9, message_data, targets)
+        self.server.metrics.inc('relay_forwards_total', len(targets))
+        return len(targets)
+
+# end Relay class
@@ -1,16 +1,21 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 import json
-from os import listdir
-from os.path import exists
-from state import State
+import random
+from ipaddress import ip_address
 from peer import Peer
 from message import Message, SignedMessage
 from message_validation import MessageValidation
+from bloom_filter import BloomFilter
+from inventory_reference import decode_inventory, split_item
+from constants import MAX_ADDRESSES_PER_RESPONSE, MAX_STATES_PER_RESPONSE
+from profiler import PROFILER
+from log import get_logger
 if TYPE_CHECKING:
     from peer_connection import PeerConnection
     from server import Server
 
+logger = get_logger(__name__)
 
 class Request:
 
@@ -19,12 +24,12 @@ class Request:
         # --------------------------------------------------------------------------
         """"""
 
-        self.debug = 1
-
         self.server = server
         self.message = message
         self.peer_connection = peer_connection
-        self.__request_selector()
+        with self.server.metrics.time('request_handler_seconds', flag=self.message.flag), \
+                PROFILER.section('request_handler[{}]'.format(self.message.flag)):
+            self.__request_selector()
 
     # ------------------------------------------------------------------------------
     def __request_selector(self) -> None:
@@ -41,6 +46,16 @@ class Request:
             self.__handle_data_request()
         elif self.message.flag == 5:
             self.__handle_heartbeat_request()
+        elif self.message.flag == 6:
+            self.__handle_stats_request()
+        elif self.message.flag == 7:
+            self.__handle_references_request()
+        elif self.message.flag == 8:
+            self.__handle_merkle_request()
+        elif self.message.flag == 9:
+            self.__handle_relay_request()
+        elif self.message.flag == 10:
+            self.__handle_stream_request()
 
     # ------------------------------------------------------------------------------
     def __handle_version_request(self) -> None:
@@ -54,91 +69,194 @@ class Request:
             self.peer_connection.send_data(
                 message_type='response', message_flag=self.message.flag)
         else:
-            print(
+            logger.warning(
                 'Version request message is formatted incorrectly, unable to handle message...')
 
     # ------------------------------------------------------------------------------
     def __handle_address_request(self) -> None:
         # --------------------------------------------------------------------------
-        """"""
+        """Replies with a bounded random sample of the known addresses the
+        requester does not know yet, as parallel address/services/last seen lists.
+        """
 
         if MessageValidation.validate_address_request(message=self.message):
-            # for peer in self.server.peers:
-            #     host, port = peer.split(':')
-            # self.server.connect_and_send(
-            #     host, port, self.message.type, self.message.flag, self.message.data, self.server.server.peers[peer].nonce)
+            try:
+                known_filter = self.message.data.get('known_filter')
+                known_filter = BloomFilter.from_dict(
+                    known_filter) if known_filter is not None else None
+            except ValueError:
+                logger.warning('Unable to handle address request filter')
+                return
+
+            since = self.message.data.get('since')
+            excluded = set(address for address in self.message.data['address_list']
+                           if isinstance(address, str))
+
+            candidates = []
+            for address, record in Peer.get_known_peers().items():
+                if address in excluded or (known_filter is not None and address in known_filter):
+                    continue
+                try:
+                    last_seen = int(float(record.get('timestamp')))
+                except (TypeError, ValueError):
+                    last_seen = 0
+                if since is not None and last_seen <= since:
+                    continue
+                candidates.append(
+                    (address, record.get('services') or [], last_seen))
 
-            known_peers = [*Peer.get_known_peers()]
-            payload = {'address_count': len(
-                known_peers), 'address_list': known_peers}
+            limit = min(self.message.data.get('max_addresses') or MAX_ADDRESSES_PER_RESPONSE,
+                        MAX_ADDRESSES_PER_RESPONSE)
+            if len(candidates) > limit:
+                candidates = random.sample(candidates, limit)
+
+            payload = {'address_count': len(candidates),
+                       'address_list': [address for address, _, _ in candidates],
+                       'services': [services for _, services, _ in candidates],
+                       'last_seen': [last_seen for _, _, last_seen in candidates]}
 
             self.peer_connection.send_data(
                 'response', self.message.flag, payload)
+        else:
+            logger.warning('Unable to handle address request')
 
     # ------------------------------------------------------------------------------
     def __handle_states_request(self) -> None:
         # --------------------------------------------------------------------------
-        """"""
+        """Replies with the inventory items of an account's chain starting at the
+        requested best state, oldest first.
+        """
 
+        state_hashes = []
         if MessageValidation.validate_states_request(message=self.message):
-            account_path = '../accounts/{}/'.format(
-                self.message.data['account'])
-            state_path = account_path + 'states/'
-            if exists(account_path) and exists(state_path):
-                state_hashes = []
-                count = 1
-                best_state_found = False
-                for file in listdir(state_path):
-                    with open(state_path + file, 'r+') as state_file:
-                        state = State.from_File(state_file)
-                        if state.current_reference == self.message.data['best_state']:
-                            best_state_found = True
-                            state_hashes.append(
-                                f'{self.message.data["account"]}/{state.current_reference}')
-                        elif best_state_found:
-                            state_hashes.append(
-                                f'{self.message.data["account"]}/{state.current_reference}')
-                        if count > 500:
-                            break
-                        state_file.close()
-                        count += 1
-
-                payload = {
-                    'count': len(state_hashes),
-                    'inventory': state_hashes, }
-            else:
-                payload = {'count': 0,
-                           'inventory': [], }
-        else:
-            payload = {'count': 0,
-                       'inventory': [], }
+            account = self.message.data['account']
+            best_state_found = False
+            for state in self.server.state_store.get_chain(account):
+                if state.current_reference == self.message.data['best_state']:
+                    best_state_found = True
+                if best_state_found:
+                    state_hashes.append(
+                        f'{account}/{state.current_reference}')
+                    if len(state_hashes) >= MAX_STATES_PER_RESPONSE:
+                        break
 
+        payload = {'inventory_count': len(state_hashes),
+                   'inventory': state_hashes, }
         self.peer_connection.send_data(
             'response', self.message.flag, payload)
 
     # ------------------------------------------------------------------------------
     def __handle_data_request(self) -> None:
         # --------------------------------------------------------------------------
-        """"""
+        """Replies with the requested states that are stored locally"""
 
         inventory_to_send = []
         if MessageValidation.validate_data_request(message=self.message):
-            for item in self.message.data['inventory']:
-                account_reference, state_reference = item.split('/')
-                account_path = '../accounts/{}/'.format(account_reference)
-                state_path = account_path + 'states/'
-                if exists(account_path) and exists(state_path):
-                    for file in listdir(state_path):
-                        with open(state_path + file, 'r+') as state_file:
-                            state = State.from_File(state_file)
-                            state_payload = {'nonce': state.nonce, 'previous_reference': state.previous_reference,
-                                             'current_reference': state.current_reference, 'balance': state.balance}
-                            inventory_to_send.append(state_payload)
+            inventory = self.message.data['inventory']
+            if isinstance(inventory, str):
+                try:
+                    inventory = decode_inventory(
+                        inventory, MAX_STATES_PER_RESPONSE)
+                except ValueError:
+                    inventory = []
+            for item in inventory[:MAX_STATES_PER_RESPONSE]:
+                try:
+                    account_reference, state_reference = split_item(item)
+                except ValueError:
+                    continue
+                state = self.server.state_store.get(
+                    account_reference, state_reference)
+                if state is not None:
+                    state_payload = {'account': account_reference, 'nonce': state.nonce, 'previous_reference': state.previous_reference,
+                                     'current_reference': state.current_reference, 'balance': state.balance}
+                    inventory_to_send.append(state_payload)
         payload = {'inventory_count': len(
             inventory_to_send), 'inventory': inventory_to_send}
         self.peer_connection.send_data(
             'response', self.message.flag, payload)
 
+    # ------------------------------------------------------------------------------
+    def __handle_references_request(self) -> None:
+        # --------------------------------------------------------------------------
+        """Replies with up to max_count [current_reference, previous_reference]
+        pairs of an account's chain, oldest first, following from_reference (or
+        from the start of the chain if it is None).
+        """
+
+        if not MessageValidation.validate_references_request(message=self.message):
+            logger.warning('Unable to handle references request')
+            return
+
+        account = self.message.data['account']
+        chain = self.server.state_store.get_chain(account)
+        from_reference = self.message.data['from_reference']
+        start = 0
+        if from_reference is not None:
+            start = len(chain)
+            for index, state in enumerate(chain):
+                if state.current_reference == from_reference:
+                    start = index + 1
+                    break
+
+        references = [[state.current_reference, state.previous_reference]
+                      for state in chain[start:start + self.message.data['max_count']]]
+        payload = {'account': account, 'reference_count': len(references),
+                   'references': references}
+        self.peer_connection.send_data(
+            'response', self.message.flag, payload)
+
+    # ------------------------------------------------------------------------------
+    def __handle_merkle_request(self) -> None:
+        # --------------------------------------------------------------------------
+        """Replies with the hashes of the requested subtrees of the account tip
+        tree and the entries of the requested buckets.
+        """
+
+        if not MessageValidation.validate_merkle_request(message=self.message):
+            logger.warning('Unable to handle merkle request')
+            return
+
+        tree = self.server.get_account_tree()
+        if self.message.data['depth'] != tree.depth:
+            hashes, buckets = [], []
+        else:
+            hashes = [tree.node_hash(level, prefix)
+                      for level, prefix in self.message.data['nodes']]
+            buckets = [[bucket, tree.bucket_entries(bucket)]
+                       for bucket in self.message.data['buckets']]
+
+        self.peer_connection.send_data('response', self.message.flag, {
+            'depth': tree.depth, 'hashes': hashes, 'buckets': buckets})
+
+    # ------------------------------------------------------------------------------
+    def __handle_relay_request(self) -> None:
+        # --------------------------------------------------------------------------
+        """Delivers and forwards a relayed message unless it was seen before"""
+
+        if not MessageValidation.validate_relay_request(message=self.message):
+            logger.warning('Unable to handle relay request')
+            return
+
+        accepted = self.server.relay.handle(self.message.data)
+        self.peer_connection.send_data(
+            'response', self.message.flag, {'accepted': accepted})
+
+    # ------------------------------------------------------------------------------
+    def __handle_stream_request(self) -> None:
+        # --------------------------------------------------------------------------
+        """Keeps the connection open so the requester can send further requests on
+        it, each handled like a request on a connection of its own.
+        """
+
+        if not MessageValidation.validate_stream_request(message=self.message):
+            logger.warning('Unable to handle stream request')
+            return
+
+        self.peer_connection.streaming = True
+        self.server.metrics.inc('streams_accepted_total')
+        self.peer_connection.send_data(
+            'response', self.message.flag, {'accepted': True})
+
     # ------------------------------------------------------------------------------
 
     def __handle_heartbeat_request(self) -> None:
@@ -147,7 +265,45 @@ class Request:
 
         self.peer_connection.send_data(
             message_type='response', message_flag=self.message.flag, message_data='PONG')
-        print('Heartbeat Sent!')
+        logger.debug('Heartbeat Sent!')
+
+    # ------------------------------------------------------------------------------
+    def __handle_stats_request(self) -> None:
+        # --------------------------------------------------------------------------
+        """Replies with a snapshot of the server's metrics, or runs a profiler
+        command. Only answered for connections coming from this machine.
+        """
+
+        host = self.peer_connection.s.getpeername()[0]
+        if not ip_address(host).is_loopback:
+            logger.warning('Refusing stats request from non-local host %s', host)
+            return
+
+        if not MessageValidation.validate_stats_request(message=self.message):
+            logger.warning('Unable to handle stats request')
+        elif self.message.data['command'] == 'profile':
+            self.peer_connection.send_data(
+                'response', self.message.flag, {'profile': self.__handle_profile_command()})
+        else:
+            self.peer_connection.send_data(
+                'response', self.message.flag, self.server.metrics.snapshot())
+
+    # ------------------------------------------------------------------------------
+    def __handle_profile_command(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Starts or stops the runtime profiler and returns its status"""
+
+        action = self.message.data['action']
+        path = None
+        if action == 'start':
+            PROFILER.start(self.message.data.get('window'))
+        elif action == 'stop':
+            path = PROFILER.stop()
+
+        status = PROFILER.status()
+        if path is not None:
+            status['path'] = path
+        return status
 
 
 # end Request class
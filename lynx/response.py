@@ -3,14 +3,19 @@ from peer import Peer
 from message import Message
 from message_validation import MessageValidation
 from inventory import InventoryItem
-import threading
+from inventory_reference import pack_item
+from state import State
 from utilities import Utilities
+from profiler import PROFILER
+from log import get_logger
 import json
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from node import Node, PeerConnection
     from server import Server
 
+logger = get_logger(__name__)
+
 
 class Response:
 
@@ -21,12 +26,12 @@ class Response:
         message and call the corresponding function based on the message's flag
         """
 
-        self.debug = 1
-
         self.server = server
         self.message = message
         self.peer_connection = peer_connection
-        self.__response_selector()
+        with self.server.metrics.time('response_handler_seconds', flag=self.message.flag), \
+                PROFILER.section('response_handler[{}]'.format(self.message.flag)):
+            self.__response_selector()
 
     # ------------------------------------------------------------------------------
     def __response_selector(self) -> None:
@@ -45,6 +50,16 @@ class Response:
             self.__handle_data_response()
         elif self.message.flag == 5:
             self.__handle_heartbeat_response()
+        elif self.message.flag == 6:
+            self.__handle_stats_response()
+        elif self.message.flag == 7:
+            self.__handle_references_response()
+        elif self.message.flag == 8:
+            self.__handle_merkle_response()
+        elif self.message.flag == 9:
+            self.__handle_relay_response()
+        elif self.message.flag == 10:
+            self.__handle_stream_response()
 
     # ------------------------------------------------------------------------------
     def __handle_version_response(self) -> None:
@@ -60,21 +75,45 @@ class Response:
 
                 # TODO self.server.send_address_request(host, port)
         else:
-            print('Unable to handle address request')
+            logger.warning('Unable to handle address request')
 
     # ------------------------------------------------------------------------------
     def __handle_address_response(self) -> None:
         # --------------------------------------------------------------------------
-        """"""
+        """Sends a version request to the addresses this node has no peer for yet,
+        the most recently seen first, as long as it has room for more peers. The
+        services and last seen time the responder reported are kept with each
+        address.
+        """
 
         if MessageValidation.validate_address_response(message=self.message):
             if not self.server.max_peers_reached():
-                host, port = self.peer_connection.s.getpeername()
-                for peer in self.message.data['address_list']:
-                    if peer not in self.server.peers and peer != '{}:{}'.format(self.server.host, self.server.host):
-                        self.server.send_version_request(host, port)
+                address_list = self.message.data['address_list']
+                services = self.message.data.get('services') or [None] * len(address_list)
+                last_seen = self.message.data.get('last_seen') or [0] * len(address_list)
+                own_address = '{}:{}'.format(self.server.host, self.server.port)
+
+                candidates = []
+                for address, peer_services, peer_last_seen in zip(address_list, services, last_seen):
+                    if not isinstance(address, str) or address == own_address or address in self.server.peers:
+                        continue
+                    host, _, port = address.rpartition(':')
+                    if Utilities.is_valid_ip_address(host) is None or not port.isdigit():
+                        continue
+                    if not isinstance(peer_last_seen, (int, float)):
+                        peer_last_seen = 0
+                    if not isinstance(peer_services, list):
+                        peer_services = None
+                    candidates.append((peer_last_seen, host, port, peer_services))
+
+                candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+                if self.server.max_peers > 0:
+                    candidates = candidates[:self.server.max_peers - self.server.number_of_peers()]
+                for peer_last_seen, host, port, peer_services in candidates:
+                    self.server.send_version_request(Peer(
+                        host=host, port=port, services=peer_services, timestamp=str(peer_last_seen)))
         else:
-            print('Unable to handle address response')
+            logger.warning('Unable to handle address response')
 
     # ------------------------------------------------------------------------------
     def __handle_states_response(self) -> None:
@@ -82,20 +121,101 @@ class Response:
         """"""
 
         if MessageValidation.validate_states_response(message=self.message):
-            self.server.inventory.extend(self.message.data['inventory'])
+            # Only queue states that are not stored locally already
+            inventory = self.message.data['inventory']
+            missing_inventory = self.server.local_states.missing(inventory)
+            skipped = len(inventory) - len(missing_inventory)
+            if skipped > 0:
+                self.server.metrics.inc('inventory_skipped_total', skipped)
+            self.server.queue_inventory(missing_inventory)
         else:
-            print('Unable to handle state response')
+            logger.warning('Unable to handle state response')
 
     # ------------------------------------------------------------------------------
     def __handle_data_response(self) -> None:
         # --------------------------------------------------------------------------
-        """"""
-        pass
+        """Queues the states that were requested from this peer for writing"""
+
+        if not MessageValidation.validate_data_response(message=self.message):
+            logger.warning('Unable to handle data response')
+            return
+
+        peer = self.server.peers.get('{}:{}'.format(
+            self.peer_connection.host, self.peer_connection.port))
+        requested = set(peer.states_requested) if peer is not None else set()
+        states = []
+        for state_data in self.message.data['inventory']:
+            item = pack_item(state_data['account'], state_data['current_reference'])
+            if item not in requested:
+                self.server.metrics.inc('states_unsolicited_total')
+                continue
+            requested.discard(item)
+            states.append((state_data['account'], State(nonce=state_data['nonce'], previous_reference=state_data['previous_reference'],
+                                                         current_reference=state_data['current_reference'], balance=state_data['balance'])))
+
+        if peer is not None:
+            received = {pack_item(account, state.current_reference)
+                        for account, state in states}
+            peer.states_requested[:] = [
+                item for item in peer.states_requested if item not in received]
+        if len(states) > 0:
+            self.server.state_writer.submit(states)
+        if peer is not None:
+            # Keep the peer busy while there is inventory left to download
+            self.server.send_data_request(peer)
 
     # ------------------------------------------------------------------------------
     def __handle_heartbeat_response(self) -> None:
         # --------------------------------------------------------------------------
         """"""
 
+    # ------------------------------------------------------------------------------
+    def __handle_stats_response(self) -> None:
+        # --------------------------------------------------------------------------
+        """Logs the metrics snapshot sent back by a node"""
+
+        if MessageValidation.validate_stats_response(message=self.message):
+            if 'profile' in self.message.data:
+                logger.info('Profiler: %s', self.message.data['profile'])
+            else:
+                logger.info('Stats: %s', self.message.data)
+        else:
+            logger.warning('Unable to handle stats response')
+
+    # ------------------------------------------------------------------------------
+    def __handle_references_response(self) -> None:
+        # --------------------------------------------------------------------------
+        """References are consumed by the SyncEngine that requested them"""
+
+        if MessageValidation.validate_references_response(message=self.message):
+            logger.debug('Received %s references for %s',
+                         self.message.data['reference_count'], self.message.data['account'])
+        else:
+            logger.warning('Unable to handle references response')
+
+    # ------------------------------------------------------------------------------
+    def __handle_merkle_response(self) -> None:
+        # --------------------------------------------------------------------------
+        """Subtree hashes are consumed by the diff that requested them"""
+
+        if not MessageValidation.validate_merkle_response(message=self.message):
+            logger.warning('Unable to handle merkle response')
+
+    # ------------------------------------------------------------------------------
+    def __handle_relay_response(self) -> None:
+        # --------------------------------------------------------------------------
+        """A relayed message was received; nothing is left to do"""
+
+        if not MessageValidation.validate_relay_response(message=self.message):
+            logger.warning('Unable to handle relay response')
+
+    # ------------------------------------------------------------------------------
+    def __handle_stream_response(self) -> None:
+        # --------------------------------------------------------------------------
+        """Streams are opened by PeerSender, which reads this response itself"""
+
+        if not MessageValidation.validate_stream_response(message=self.message):
+            logger.warning('Unable to handle stream response')
+
 
 # end Request class
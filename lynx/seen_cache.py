@@ -0,0 +1,87 @@
+# seen_cache.py
+from collections import OrderedDict
+from typing import Callable
+import threading
+import time
+
+
+class SeenCache:
+    """Remembers the keys of recently seen messages for ttl seconds, together
+    with the peers known to have each message already. Holds at most
+    max_entries keys; the oldest are forgotten first.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, ttl: float = 600.0, max_entries: int = 100000, clock: Callable = time.monotonic) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an empty SeenCache"""
+
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self.clock = clock
+        self.lock = threading.Lock()
+        # key -> (expiry time, set of peer ids that have the message)
+        self.entries = OrderedDict()
+
+    # ------------------------------------------------------------------------------
+    def __expire(self, now: float) -> None:
+        # --------------------------------------------------------------------------
+        """Drops expired and excess entries. Called with the lock held."""
+
+        while len(self.entries) > 0:
+            key, (expiry, _) = next(iter(self.entries.items()))
+            if expiry > now and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+
+    # ------------------------------------------------------------------------------
+    def add(self, key: str, peer_id: str = None) -> bool:
+        # --------------------------------------------------------------------------
+        """Records key as seen, and as known by peer_id if given. Returns True if
+        key was not seen before (or had expired).
+        """
+
+        now = self.clock()
+        with self.lock:
+            self.__expire(now)
+            entry = self.entries.get(key)
+            if entry is not None:
+                if peer_id is not None:
+                    entry[1].add(peer_id)
+                return False
+            self.entries[key] = (now + self.ttl,
+                                 {peer_id} if peer_id is not None else set())
+            self.__expire(now)
+            return True
+
+    # ------------------------------------------------------------------------------
+    def claim_unknown(self, key: str, peer_ids: list) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the peers of peer_ids that do not have the message yet and
+        marks them as having it, so concurrent callers never pick the same peer.
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return []
+            unknown = [peer_id for peer_id in peer_ids if peer_id not in entry[1]]
+            entry[1].update(unknown)
+            return unknown
+
+    # ------------------------------------------------------------------------------
+    def __contains__(self, key: str) -> bool:
+        # --------------------------------------------------------------------------
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] > now
+
+    # ------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        # --------------------------------------------------------------------------
+        with self.lock:
+            self.__expire(self.clock())
+            return len(self.entries)
+
+# end SeenCache class
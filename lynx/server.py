@@ -1,150 +1,284 @@
+from __future__ import annotations
 import uuid
 import socket
 import time
 import threading
-import traceback
-from account import Account
+import logging
+import os
 from peer import Peer
 from inventory import Inventory
+from inventory_reference import InventoryReference, encode_inventory
 from peer_connection import PeerConnection
 from request import Request
 from response import Response
 from message import Message
-from constants import PROTOCOL_VERSION, NODE_SERVICES, SUB_VERSION
+from constants import PROTOCOL_VERSION, NODE_SERVICES, SUB_VERSION, PACKED_INVENTORY_SERVICE
 from utilities import Utilities
-
-
-def display_debug(msg):
-    """Prints a message to the screen with the name of the current thread"""
-    print(msg)
+from startup_profile import StartupProfile
+from metrics import Metrics, MetricsEndpoint
+from transport import Transport, TCP_TRANSPORT
+from admission import AdmissionControl
+from bloom_filter import BloomFilter
+from local_states import LocalStates
+from state_store import StateStore
+from sync_engine import SyncEngine
+from merkle import MerkleAccumulator
+from tip_index import TipIndex
+from state_writer import StateWriter
+from chain_verifier import ChainVerifier
+from worker_channel import WorkerChannel
+from relay import Relay
+from broadcast import Broadcaster, BroadcastResult
+from message_validation import MessageValidation
+from event_loop import EventLoop
+from deadline import Deadline, DeadlineExceeded, OperationCancelled
+from log import get_logger
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from account_snapshot import AccountSnapshot
+
+logger = get_logger(__name__)
 
 
 class Server:
     # ------------------------------------------------------------------------------
-    def __init__(self, nonce: str, port=6969, host=None, max_peers=12) -> None:
+    def __init__(self, nonce: str, port=6969, host=None, max_peers=12, startup_profile: StartupProfile = None, transport: Transport = None,
+                 admission: AdmissionControl = None, io_workers: int = 8, accounts_directory: str = '../accounts',
+                 channel: WorkerChannel = None, relay: bool = False, request_timeout: float = 30.0) -> None:
         # --------------------------------------------------------------------------
         """Initializes a servent with the ability to index information
         for up to max_nodes number of peers (max_nodes may be set to 0 to allow for an
         unlimited number of peers), listening on a given server port, with a given
         peer name/id and host address. If not supplied, the host address (host)
-        will be determined by attempting to connect to an Internet host like Google.
+        will be determined from the local network interfaces. All connections
+        are made through transport, which defaults to real TCP sockets. Inbound
+        connections and requests are limited by admission. On selectable
+        transports inbound messages are read by one event loop thread and
+        handled by io_workers worker threads. States are kept under
+        accounts_directory, with the tip index next to it. A server running as
+        one worker of a Supervisor shares its peers, inventory and stored
+        states with the other workers through channel. With relay, messages
+        relayed by peers are forwarded to the peers that asked for relaying.
+        Each outgoing request, from connecting to the last reply, is given up
+        after request_timeout seconds.
         """
 
-        self.debug = 1
-
         self.nonce = nonce
+        self.request_timeout = float(request_timeout)
+        # Parent of every outgoing request's deadline, see cancel_requests()
+        self.root_deadline = Deadline()
+        self.transport = transport if transport is not None else TCP_TRANSPORT
+        self.admission = admission if admission is not None else AdmissionControl()
+        self.io_workers = int(io_workers)
+        self.startup_profile = startup_profile if startup_profile is not None else StartupProfile()
 
         self.max_peers = int(max_peers)
         self.port = int(port)
-        if host:
-            self.host = host
-        else:
-            self.__init_server_host()
+        with self.startup_profile.phase('Host Discovery'):
+            if host:
+                self.host = host
+            else:
+                self.__init_server_host()
 
         self.peer_lock = threading.Lock()
 
-        test_peer = Peer(version=PROTOCOL_VERSION,
-                         services=NODE_SERVICES,
-                         timestamp=str(time.time()),
-                         nonce=uuid.uuid4().hex + uuid.uuid1().hex,
-                         host='127.0.0.1',
-                         port='6969',
-                         sub_version=SUB_VERSION,
-                         start_accounts_count=10,
-                         relay=False,
-                         )
-        # List of Peer objects
-        self.peers = {'{}:{}'.format('127.0.0.1', '6969'): test_peer}
-
-        self.inventory = Inventory(on_extension=self.send_all_peers_request)
+        with self.startup_profile.phase('Peer Table'):
+            test_peer = Peer(version=PROTOCOL_VERSION,
+                             services=NODE_SERVICES,
+                             timestamp=str(time.time()),
+                             nonce=uuid.uuid4().hex + uuid.uuid1().hex,
+                             host='127.0.0.1',
+                             port='6969',
+                             sub_version=SUB_VERSION,
+                             start_accounts_count=10,
+                             relay=False,
+                             )
+            # List of Peer objects
+            self.peers = {'{}:{}'.format('127.0.0.1', '6969'): test_peer}
+
+        self.inventory = Inventory(
+            inventory=[], on_extension=self.send_all_peers_request, packed=True)
+        self.state_store = StateStore(accounts_directory)
+        self.local_states = LocalStates(accounts_directory, self.state_store)
+        self.tip_index = TipIndex(os.path.join(os.path.dirname(os.path.normpath(
+            accounts_directory)), 'tip_index.json'), self.state_store)
+        self.account_snapshot = None
+        self.channel = channel
+        self.broadcaster = Broadcaster(self)
+        self.relay = Relay(self, enabled=relay)
+        self.relay.add_handler('inventory', self.__handle_relayed_inventory)
+        if channel is not None:
+            # The supervisor keeps the index on disk, workers follow in memory
+            self.tip_index.persist = False
+            self.state_store.add_batch_listener(lambda items: channel.publish(
+                'states', [[account, state.current_reference] for account, state in items]))
+        self.sync_engine = SyncEngine(self)
+        self.account_tree = MerkleAccumulator()
+        self.account_tree_loaded = False
+        self.account_tree_lock = threading.Lock()
+        # Registered after the tip index, which the tree is kept in line with
+        self.state_store.add_batch_listener(self.__update_account_tree)
 
         self.shutdown = False  # condition used to stop server listen
 
-        self.__debug('Configuring Port...')
-        self.__debug('Server Configured!')
-        self.__debug('Server Information:\n\tHost: {} (IPV4)\n\tPort: {}\n\tNode ID (Nonce): {}\n'.format(
-            self.host, self.port, self.nonce))
+        self.metrics = Metrics()
+        self.metrics_endpoint = None
+        self.connection_lock = threading.Lock()
+        self.active_connections = {'inbound': 0, 'outbound': 0}
+        self.metrics.register_gauge(
+            'active_connections', lambda: dict(self.active_connections), label='direction')
+        self.metrics.register_gauge('threads', threading.active_count)
+        self.metrics.register_gauge(
+            'inventory_depth', lambda: len(self.inventory))
+        self.metrics.register_gauge('peers', lambda: len(self.peers))
+        self.metrics.register_gauge(
+            'local_states', lambda: len(self.local_states))
+        self.chain_verifier = ChainVerifier(metrics=self.metrics)
+        self.state_writer = StateWriter(self.state_store, on_drain=lambda: self.send_all_peers_request(4),
+                                        metrics=self.metrics, verifier=self.chain_verifier)
+        self.metrics.register_gauge(
+            'state_writer_pending', lambda: len(self.state_writer))
+        if channel is not None:
+            self.metrics.register_gauge('worker', lambda: channel.index)
+        self.metrics.register_gauge(
+            'accounts', self.tip_index.account_count)
+        self.metrics.register_gauge(
+            'stored_states', self.tip_index.state_count)
+        self.metrics.register_gauge('states_in_flight', lambda: {
+            peer_id: len(peer.states_requested) for peer_id, peer in list(self.peers.items())}, label='peer')
+
+        self.metrics.register_gauge(
+            'admitted_connections', lambda: self.admission.connections)
+
+        logger.info('Server Configured!')
+        logger.info('Server Information:\n\tHost: %s (IPV4)\n\tPort: %s\n\tNode ID (Nonce): %s\n',
+                    self.host, self.port, self.nonce)
 
     # ------------------------------------------------------------------------------
     def __init_server_host(self) -> None:
         # --------------------------------------------------------------------------
-        """Attempts to connect to an Internet host like Google to determine
-        the local machine's IP address.
+        """Determines the local machine's IP address from its network interfaces
+        without contacting any outside host.
         """
-        print("Configuring IP Address...")
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        server_socket.connect(('8.8.8.8', 80))
-        self.host = server_socket.getsockname()[0]
-        server_socket.close()
+        logger.info("Configuring IP Address...")
+        self.host = Utilities.get_local_host()
+
+    # ------------------------------------------------------------------------------
+    def make_version_message(self, address_receive: str, address_from: str = None, nonce: str = None) -> dict:
+        # --------------------------------------------------------------------------
+        """Returns the payload of a version request to the given host:port, sent
+        from this server unless address_from and nonce say otherwise.
+        """
+
+        return {'version': PROTOCOL_VERSION,
+                'services': NODE_SERVICES,
+                'timestamp': str(time.time()),
+                'nonce': nonce if nonce is not None else self.nonce,
+                'address_from': address_from if address_from is not None else '{}:{}'.format(self.host, self.port),
+                'address_receive': address_receive,
+                'sub_version': SUB_VERSION,
+                'start_accounts_count': self.tip_index.account_count(),
+                'max_states_in_transit': 10,
+                'relay': self.relay.enabled,
+                }
 
     # ------------------------------------------------------------------------------
     def send_version_request(self, peer: Peer):
         # --------------------------------------------------------------------------
         """"""
 
-        version_message = {'version': PROTOCOL_VERSION,
-                           'services': NODE_SERVICES,
-                           'timestamp': str(time.time()),
-                           'nonce': self.nonce,
-                           'address_from': '{}:{}'.format(self.host, self.port),
-                           'address_receive': peer.address,
-                           'sub_version': SUB_VERSION,
-                           'start_accounts_count': Utilities.get_transaction_count(),
-                           'max_states_in_transit': 10,
-                           'relay': False,
-                           }
+        version_message = self.make_version_message(peer.address)
 
         try:
             version_request_thread = threading.Thread(target=self.connect_and_send, args=[
                 peer.host, peer.port, 'request', 1, version_message, peer.address], name='Version Request Thread')
             version_request_thread.start()
         except:
-            self.__debug('Failed to Send Version Request. Retrying...')
+            logger.warning('Failed to Send Version Request. Retrying...')
+
+    # ------------------------------------------------------------------------------
+    def make_address_request(self, known_addresses=(), since: float = None, max_addresses: int = None) -> dict:
+        # --------------------------------------------------------------------------
+        """Builds an address request payload. The addresses already known are sent
+        as a bloom filter so the reply only holds new ones.
+        """
+
+        known_addresses = set(known_addresses) | set(self.peers)
+        known_filter = BloomFilter.for_capacity(len(known_addresses))
+        for address in known_addresses:
+            known_filter.add(address)
+
+        own_address = '{}:{}'.format(self.host, self.port)
+        payload = {'address_count': 1, 'address_list': [own_address],
+                   'known_filter': known_filter.to_dict()}
+        if since is not None:
+            payload['since'] = since
+        if max_addresses is not None:
+            payload['max_addresses'] = max_addresses
+
+        return payload
 
     # ------------------------------------------------------------------------------
     def send_address_request(self, peer: Peer):
         # --------------------------------------------------------------------------
-        """"""
+        """Asks peer for addresses this node does not know yet"""
 
-        payload = {'address_count': 1,
-                   'address_list': [peer.address]}
+        payload = self.make_address_request(Peer.get_known_peers())
 
         try:
             address_request_thread = threading.Thread(target=self.connect_and_send, args=[
                 peer.host, peer.port, 'request', 2, payload, peer.address], name='Address Request Thread')
             address_request_thread.start()
         except:
-            self.__debug('Failed to Send Address Request. Retrying...')
+            logger.warning('Failed to Send Address Request. Retrying...')
+
+    # ------------------------------------------------------------------------------
+    def make_states_request(self) -> dict:
+        # --------------------------------------------------------------------------
+        return {'version': PROTOCOL_VERSION,
+                'account': '0x69420',
+                'best_state': '0x4206996420'}
 
     # ------------------------------------------------------------------------------
     def send_states_request(self, peer: Peer):
         # --------------------------------------------------------------------------
         """"""
 
-        payload = {'version': PROTOCOL_VERSION,
-                   'account': '0x69420',
-                   'best_state': '0x4206996420'}
+        payload = self.make_states_request()
 
         try:
             account_request_thread = threading.Thread(target=self.connect_and_send, args=[
                 peer.host, peer.port, 'request', 3, payload, peer.address], name='States Request Thread')
             account_request_thread.start()
         except:
-            self.__debug('Failed to Send States Request. Retrying...')
+            logger.warning('Failed to Send States Request. Retrying...')
 
     # ------------------------------------------------------------------------------
     def send_data_request(self, peer: Peer):
         # --------------------------------------------------------------------------
         """"""
 
+        if self.state_writer.backlogged():
+            # Resumed by the writer once it has caught up
+            self.metrics.inc('data_requests_deferred_total')
+            logger.debug('State writer is backlogged, deferring data request')
+            return
+
         try:
             if len(peer.states_requested) < peer.max_states_in_transit:
                 batch_amount = peer.max_states_in_transit - \
                     len(peer.states_requested)
                 inventory_batch = self.inventory.get_batch(amount=batch_amount)
                 if len(inventory_batch) > 0:
+                    # Peers that know the encoded inventory get it in one string,
+                    # unless the batch holds items that could not be packed
+                    if PACKED_INVENTORY_SERVICE in (peer.services or ()) and all(
+                            isinstance(item, InventoryReference) for item in inventory_batch):
+                        wire_inventory = encode_inventory(inventory_batch)
+                    else:
+                        wire_inventory = [str(item) for item in inventory_batch]
                     payload = {'inventory_count': len(
-                        inventory_batch), 'inventory': inventory_batch}
+                        inventory_batch), 'inventory': wire_inventory}
 
                     peer.states_requested.extend(inventory_batch)
 
@@ -156,14 +290,185 @@ class Server:
             else:
                 raise IndexError
         except IndexError:
-            self.__debug(
-                f'Peer Is Too Busy Reponding to {peer.max_states_in_transit} Requests!')
+            logger.debug(
+                'Peer Is Too Busy Reponding to %s Requests!', peer.max_states_in_transit)
         except ValueError:
-            self.__debug('There is Nothing to Request Data For!')
+            logger.debug('There is Nothing to Request Data For!')
         except:
-            self.__debug('Failed to send data request. Retrying...')
+            logger.warning('Failed to send data request. Retrying...')
             del peer.states_requested[-len(inventory_batch):]
 
+    # ------------------------------------------------------------------------------
+    def sync_accounts(self, accounts: list, peers: list = None, deadline: Deadline = None) -> list:
+        # --------------------------------------------------------------------------
+        """Syncs each account headers-first from peers, a list of (host, port)
+        that defaults to every known peer, before deadline (see
+        SyncEngine.sync_account). Returns one summary per account synced.
+        """
+
+        if peers is None:
+            peers = [(peer.host, int(peer.port))
+                     for peer in list(self.peers.values())]
+        if len(peers) == 0:
+            logger.warning('No peers to sync from')
+            return []
+
+        summaries = []
+        for account in accounts:
+            if deadline is not None and deadline.done():
+                logger.warning('Stopped syncing after %s of %s accounts: %s', len(summaries), len(accounts),
+                               'cancelled' if deadline.cancelled else 'deadline exceeded')
+                break
+            summary = self.sync_engine.sync_account(account, peers, deadline)
+            logger.info('Synced %s: %s', account, summary)
+            summaries.append(summary)
+
+        return summaries
+
+    # ------------------------------------------------------------------------------
+    def get_account_tree(self) -> MerkleAccumulator:
+        # --------------------------------------------------------------------------
+        """Returns the Merkle tree over the tips of all stored accounts, building
+        it from the tip index on first use (start_server_listen does so before
+        accepting connections).
+        """
+
+        with self.account_tree_lock:
+            if not self.account_tree_loaded:
+                for account, entry in self.tip_index.items():
+                    self.account_tree.set_tip(account, entry['reference'])
+                self.account_tree_loaded = True
+
+        return self.account_tree
+
+    # ------------------------------------------------------------------------------
+    def get_account_snapshot(self) -> AccountSnapshot:
+        # --------------------------------------------------------------------------
+        """Returns the columnar snapshot of all account tips, creating it next to
+        the tip index on first use. Raises ImportError without numpy.
+        """
+
+        # Imported here so that the node does not load numpy unless asked to
+        from account_snapshot import AccountSnapshot
+
+        with self.account_tree_lock:
+            if self.account_snapshot is None:
+                self.account_snapshot = AccountSnapshot(self.tip_index, os.path.join(
+                    os.path.dirname(self.tip_index.path), 'snapshot'))
+
+        return self.account_snapshot
+
+    # ------------------------------------------------------------------------------
+    def __update_account_tree(self, items: list) -> None:
+        # --------------------------------------------------------------------------
+        """Keeps the account tree current as batches of states are written. The
+        tip index has already recorded the batch, so a tree being built from
+        the index at the same time either includes it or is updated here once
+        it is built.
+        """
+
+        with self.account_tree_lock:
+            if not self.account_tree_loaded:
+                return
+            for account in dict.fromkeys(account for account, _ in items):
+                entry = self.tip_index.get(account)
+                self.account_tree.set_tip(
+                    account, entry['reference'] if entry is not None else None)
+
+    # ------------------------------------------------------------------------------
+    def find_differing_accounts(self, host, port, deadline: Deadline = None) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the accounts whose tip on host:port is missing or different
+        here, or None if the peer did not answer before deadline. Only the
+        subtrees of the account tree that differ are exchanged.
+        """
+
+        tree = self.get_account_tree()
+
+        def fetch(nodes: list, buckets: list) -> tuple:
+            replies = self.connect_and_send(host, port, 'request', 8, {
+                'depth': tree.depth, 'nodes': nodes, 'buckets': buckets}, dispatch=False, deadline=deadline)
+            for reply in replies:
+                if MessageValidation.validate_merkle_response(message=reply):
+                    if reply.data['depth'] != tree.depth or len(reply.data['hashes']) != len(nodes):
+                        return None
+                    self.metrics.inc('merkle_requests_total')
+                    return reply.data['hashes'], {bucket: entries for bucket, entries in reply.data['buckets']}
+            return None
+
+        return tree.find_differences(fetch)
+
+    # ------------------------------------------------------------------------------
+    def sync_changed_accounts(self, host, port, peers: list = None, deadline: Deadline = None) -> list:
+        # --------------------------------------------------------------------------
+        """Finds the accounts that differ from host:port and syncs only those,
+        from peers (host:port itself by default), all before deadline. Use
+        root_deadline.child(seconds) to bound the whole operation.
+        """
+
+        accounts = self.find_differing_accounts(host, port, deadline)
+        if accounts is None:
+            logger.warning('Unable to compare accounts with %s:%s', host, port)
+            return []
+        logger.info('%s accounts differ from %s:%s', len(accounts), host, port)
+
+        return self.sync_accounts(accounts, peers if peers is not None else [(host, int(port))], deadline)
+
+    # ------------------------------------------------------------------------------
+    def send_stats_request(self, host='127.0.0.1', port=None) -> dict:
+        # --------------------------------------------------------------------------
+        """Asks a node running on this machine for its metrics snapshot. Returns
+        None if the node did not answer.
+        """
+
+        port = self.port if port is None else port
+        replies = self.connect_and_send(
+            host, port, 'request', 6, {'command': 'stats'}, dispatch=False)
+        for reply in replies:
+            if reply.type == 'response' and reply.flag == 6:
+                return reply.data
+
+        return None
+
+    # ------------------------------------------------------------------------------
+    def send_profile_request(self, action: str, window: float = None, host='127.0.0.1', port=None) -> dict:
+        # --------------------------------------------------------------------------
+        """Starts ('start'), stops ('stop') or queries ('status') the profiler of
+        a node running on this machine. Returns the profiler status, or None if
+        the node did not answer.
+        """
+
+        port = self.port if port is None else port
+        data = {'command': 'profile', 'action': action}
+        if window is not None:
+            data['window'] = window
+        replies = self.connect_and_send(
+            host, port, 'request', 6, data, dispatch=False)
+        for reply in replies:
+            if reply.type == 'response' and reply.flag == 6 and isinstance(reply.data, dict):
+                return reply.data.get('profile')
+
+        return None
+
+    # ------------------------------------------------------------------------------
+    def start_metrics_endpoint(self, port: int = 9469, host: str = '127.0.0.1') -> MetricsEndpoint:
+        # --------------------------------------------------------------------------
+        """Serves this server's metrics as plain text on http://host:port/metrics"""
+
+        self.metrics_endpoint = MetricsEndpoint(self.metrics, port=port, host=host)
+        self.metrics_endpoint.start()
+        logger.info('Metrics Endpoint Listening On %s:%s', host, port)
+
+        return self.metrics_endpoint
+
+    # ------------------------------------------------------------------------------
+    def __track_connection(self, direction: str, amount: int) -> None:
+        # --------------------------------------------------------------------------
+        """Adjusts the number of open connections in the given direction"""
+
+        with self.connection_lock:
+            self.active_connections[direction] += amount
+
     # ------------------------------------------------------------------------------
     def send_heartbeat_request(self):
         # --------------------------------------------------------------------------
@@ -174,25 +479,29 @@ class Server:
                 heartbeat_thread = threading.Thread(target=self.connect_and_send, args=[
                     self.peers[peer][0], self.peers[peer][1], 'request', 4, 'Heartbeat Request', peer], name='Heartbeat Thread (%s)' % peer)
                 heartbeat_thread.start()
-                print('Heartbeat request started!')
+                logger.debug('Heartbeat request started!')
             except:
-                self.__debug('Failed to request heartbeat from %s.' % peer)
+                logger.warning('Failed to request heartbeat from %s.', peer)
 
     # ------------------------------------------------------------------------------
-    def send_all_peers_request(self, flag: int = 0) -> None:
+    def send_all_peers_request(self, flag: int = 0) -> BroadcastResult:
         # --------------------------------------------------------------------------
-        """"""
+        """Sends a request to every peer. Address and states requests are the same
+        for every peer and are broadcast, returning the BroadcastResult; version
+        and data requests are made for each peer and return None.
+        """
 
-        if 0 < flag < 100:
-            for peer_id, peer in self.peers.items():
+        if flag == 2:
+            return self.broadcaster.broadcast('request', 2, self.make_address_request(Peer.get_known_peers()))
+        elif flag == 3:
+            return self.broadcaster.broadcast('request', 3, self.make_states_request())
+        elif 0 < flag < 100:
+            for peer_id, peer in list(self.peers.items()):
                 if flag == 1:
                     self.send_version_request(peer)
-                elif flag == 2:
-                    self.send_address_request(peer)
-                elif flag == 3:
-                    self.send_states_request(peer)
                 elif flag == 4:
                     self.send_data_request(peer)
+        return None
 
     # ------------------------------------------------------------------------------
     def add_peer(self, peer: Peer) -> bool:
@@ -204,11 +513,50 @@ class Server:
             self.peer_lock.acquire()
             self.peers[peer_id] = peer
             self.peer_lock.release()
-            self.__debug('Peer added: (%s)' % peer_id)
+            logger.info('Peer added: (%s)', peer_id)
+            if self.channel is not None:
+                self.channel.publish('peer', {'host': peer.host, 'port': peer.port, 'services': peer.services,
+                                              'version': peer.version, 'sub_version': peer.sub_version,
+                                              'timestamp': peer.timestamp, 'nonce': peer.nonce,
+                                              'start_accounts_count': peer.start_accounts_count,
+                                              'relay': peer.relay, 'max_states_in_transit': peer.max_states_in_transit})
             return True
 
         return False
 
+    # ------------------------------------------------------------------------------
+    def queue_inventory(self, inventory: list) -> bool:
+        # --------------------------------------------------------------------------
+        """Queues announced states for download. Workers only keep their own
+        shard and pass the announcement on to the other workers.
+        """
+
+        if self.channel is not None:
+            self.channel.publish('inventory', inventory)
+            inventory = [item for item in inventory if self.channel.owns(item)]
+
+        return self.inventory.extend(inventory)
+
+    # ------------------------------------------------------------------------------
+    def announce_states(self, inventory: list) -> int:
+        # --------------------------------------------------------------------------
+        """Relays an announcement of new 'account/reference' states. Returns the
+        number of peers it was sent to.
+        """
+
+        return self.relay.broadcast('inventory', inventory)
+
+    # ------------------------------------------------------------------------------
+    def __handle_relayed_inventory(self, inventory) -> None:
+        # --------------------------------------------------------------------------
+        if not isinstance(inventory, list) or not all(isinstance(item, str) for item in inventory):
+            logger.warning('Ignoring malformed relayed inventory')
+            return
+
+        missing_inventory = self.local_states.missing(inventory)
+        if len(missing_inventory) > 0:
+            self.queue_inventory(missing_inventory)
+
     # ------------------------------------------------------------------------------
     def get_peer(self, peer_id) -> tuple:
         # --------------------------------------------------------------------------
@@ -271,146 +619,255 @@ class Server:
         return self.max_peers > 0 and len(self.peers) == self.max_peers
 
     # ------------------------------------------------------------------------------
-    def make_server_socket(self, port, backlog=5) -> socket.socket:
+    def make_server_socket(self, port, backlog=socket.SOMAXCONN) -> socket.socket:
         # --------------------------------------------------------------------------
-        """Constructs and prepares a server socket listening on given port.
-
-        For more information on port forwarding visit: https://stackoverflow.com/questions/45097727/python-sockets-port-forwarding
-        """
+        """Constructs and prepares a server socket listening on given port."""
 
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind(('', port))
-        server_socket.listen(backlog)
-        return server_socket
+        return self.transport.listen('', port, backlog)
 
     # ------------------------------------------------------------------------------
-    def __handle_peer(self, client_socket: socket.socket) -> None:
+    def open_inbound(self, client_socket: socket.socket, client_address: tuple) -> PeerConnection:
         # --------------------------------------------------------------------------
-        """Dispatches messages from the socket connection."""
+        """Admits an accepted connection. Returns its PeerConnection, or None if
+        admission control rejected it, in which case the socket is closed.
+        Every PeerConnection returned must be passed to close_inbound().
+        """
 
-        self.__debug('********************\n')
-        self.__debug('Incoming Peer Connection Detected!')
+        rejection = self.admission.admit(client_address[0])
+        if rejection is not None:
+            self.metrics.inc('connections_rejected_total', reason=rejection)
+            client_socket.close()
+            return None
 
-        try:
-            host, port = client_socket.getpeername()
-            self.__debug(
-                'Peer Connection Information:\n\tHost: {} (IPV4)\n\tPort: {}\n'.format(host, port))
-            peer_connection = PeerConnection(
-                peer_id=None, host=host, port=port, sock=client_socket, debug=True)
+        logger.debug('Incoming Peer Connection Detected!')
+        self.__track_connection('inbound', 1)
+        host, port = client_address[:2]
+        logger.debug(
+            'Peer Connection Information:\n\tHost: %s (IPV4)\n\tPort: %s\n', host, port)
 
-            message = peer_connection.receive_data()
+        return PeerConnection(peer_id=None, host=host, port=port, sock=client_socket, metrics=self.metrics)
 
+    # ------------------------------------------------------------------------------
+    def handle_inbound(self, peer_connection: PeerConnection, message: Message) -> bool:
+        # --------------------------------------------------------------------------
+        """Dispatches a message received on an inbound connection and closes the
+        connection afterwards, unless the remote opened a stream on it. Returns
+        True if the connection was kept open for the next message.
+        """
+
+        host, port = peer_connection.host, peer_connection.port
+        keep_open = False
+        # A peer that stops reading cannot hold the handler past read_timeout
+        peer_connection.set_deadline(Deadline(self.admission.read_timeout))
+        try:
             if message is None or not message.validate():
                 raise ValueError
 
-            if message.type.lower() == 'request':
-                self.__debug(
-                    'Received request from ({}:{})'.format(host, port))
-                self.__debug('Request Information:\n\tType: {}\n\tFlag: {}\n\tData: {}\n'.format(
-                    message.type, message.flag, message.data))
+            if not self.admission.allow_message(host, message.flag):
+                self.metrics.inc('requests_rate_limited_total',
+                                 flag=message.flag)
+                logger.info('Rate limited flag %s request from %s',
+                            message.flag, host)
+            elif message.type.lower() == 'request':
+                logger.debug('Received request from (%s:%s)', host, port)
+                logger.debug('Request Information:\n\tType: %s\n\tFlag: %s\n\tData: %s\n',
+                             message.type, message.flag, message.data)
 
                 Request(server=self, message=message,
                         peer_connection=peer_connection)
             # elif message.message.type.upper() == 'RESPONSE':
             #     Response(node=self, message=message)
 
+            keep_open = peer_connection.streaming and peer_connection.s is not None
+
         except ValueError:
-            traceback.print_exc()
-            self.__debug(
+            logger.debug(
                 'Message received was not formatted correctly or was of None value.')
         except KeyboardInterrupt:
             raise
         except:
-            if self.debug:
-                traceback.print_exc()
-                self.__debug('Failed to handle message')
+            logger.warning('Failed to handle message', exc_info=True)
+
+        if keep_open:
+            peer_connection.set_deadline(None)
+            return True
+        self.close_inbound(peer_connection)
+        return False
 
-        self.__debug('Disconnecting from ' + str(client_socket.getpeername()))
-        self.__debug('\n********************')
-        peer_connection.close()
+    # ------------------------------------------------------------------------------
+    def close_inbound(self, peer_connection: PeerConnection) -> None:
+        # --------------------------------------------------------------------------
+        """Closes an inbound connection and releases its admission slot"""
+
+        logger.debug('Disconnecting from %s:%s',
+                     peer_connection.host, peer_connection.port)
+        try:
+            peer_connection.close()
+        except Exception:
+            pass
+        self.admission.release(peer_connection.host)
+        self.__track_connection('inbound', -1)
+
+    # ------------------------------------------------------------------------------
+    def __handle_peer(self, peer_connection: PeerConnection) -> None:
+        # --------------------------------------------------------------------------
+        """Reads messages from an inbound connection on its own thread and
+        dispatches them, one unless the connection is a stream. Used for
+        transports that cannot be multiplexed. The first message must arrive
+        within the read timeout, each later one within the idle timeout.
+        """
+
+        timeout = self.admission.read_timeout
+        while True:
+            message = peer_connection.receive_data(timeout)
+            if peer_connection.timed_out:
+                self.metrics.inc('connections_timed_out_total')
+            if not self.handle_inbound(peer_connection, message):
+                return
+            if self.shutdown:
+                self.close_inbound(peer_connection)
+                return
+            timeout = self.admission.idle_timeout
 
     # ------------------------------------------------------------------------------
-    def connect_and_send(self, host, port, message_type: str, message_flag: int, message_data, peer_id=None) -> list:
+    def connect_and_send(self, host, port, message_type: str, message_flag: int, message_data, peer_id=None, dispatch: bool = True,
+                         timeout: float = None, deadline: Deadline = None) -> list:
         # --------------------------------------------------------------------------
         """Connects and sends a message to the specified host:port. The host's
-        reply, if expected, will be returned as a list.
+        reply, if expected, will be returned as a list. Replies are handled as
+        requests/responses unless dispatch is False. Connecting, sending and
+        receiving must all finish within timeout seconds (request_timeout by
+        default) and before deadline, which defaults to root_deadline; replies
+        complete by then are still returned. Cancelling deadline aborts the
+        request and nothing is dispatched.
         """
 
         message_replies = []
+        request_deadline = Deadline(self.request_timeout if timeout is None else timeout,
+                                    parent=deadline if deadline is not None else self.root_deadline)
+        peer_connection = None
+        self.__track_connection('outbound', 1)
         try:
             peer_connection = PeerConnection(
-                peer_id=peer_id, host=host, port=port, debug=self.debug)
+                peer_id=peer_id, host=host, port=port, metrics=self.metrics, transport=self.transport,
+                deadline=request_deadline)
             peer_connection.send_data(message_type, message_flag, message_data)
 
             if message_type == 'request':
-                self.__debug(
-                    'Attempting to receive a response from (%s)...' % peer_id)
+                logger.debug(
+                    'Attempting to receive a response from (%s)...', peer_id)
                 reply: Message = peer_connection.receive_data()
                 while reply is not None:
                     message_replies.append(reply)
-                    self.__debug('Received a reply!')
+                    logger.debug('Received a reply!')
                     reply = peer_connection.receive_data()
 
-                for i in range(len(message_replies)):
-                    self.__debug('Reply #{} Contents:\n\tType: {}\n\tFlag: {}\n\tData: {}\n'.format(
-                        i + 1, message_replies[i].type, message_replies[i].flag, message_replies[i].data))
-
-                    if message_replies[i].type == 'request':
-                        Request(self, message_replies[i], peer_connection)
-                    elif message_replies[i].type == 'response':
-                        Response(self, message_replies[i], peer_connection)
-                    else:
-                        self.__debug(
-                            'Unable to handle message type of "{}"'.format(message_replies[i].type))
-            peer_connection.close()
+                if dispatch and not request_deadline.cancelled:
+                    self.dispatch_replies(message_replies, peer_connection)
         except KeyboardInterrupt:
             raise
+        except (DeadlineExceeded, OperationCancelled, TimeoutError):
+            pass
         except:
-            if self.debug:
-                traceback.print_exc()
-                self.__debug(
-                    'Unable to send message to peer (%s, %s).' % (host, port))
+            logger.warning('Unable to send message to peer (%s, %s).',
+                           host, port, exc_info=logger.isEnabledFor(logging.DEBUG))
+        finally:
+            if peer_connection is not None:
+                peer_connection.close()
+            self.__track_connection('outbound', -1)
+
+        if request_deadline.cancelled:
+            self.metrics.inc('requests_cancelled_total', flag=message_flag)
+            logger.info('Cancelled flag %s %s to (%s, %s)',
+                        message_flag, message_type, host, port)
+        elif request_deadline.expired():
+            self.metrics.inc('requests_timed_out_total', flag=message_flag)
+            logger.info('Flag %s %s to (%s, %s) timed out',
+                        message_flag, message_type, host, port)
 
         return message_replies
 
+    # ------------------------------------------------------------------------------
+    def cancel_requests(self) -> None:
+        # --------------------------------------------------------------------------
+        """Cancels every outgoing request in flight, and every deadline derived
+        from root_deadline, releasing the threads waiting on them. Requests made
+        afterwards are not affected.
+        """
+
+        with self.connection_lock:
+            root_deadline, self.root_deadline = self.root_deadline, Deadline()
+        root_deadline.cancel()
+
+    # ------------------------------------------------------------------------------
+    def dispatch_replies(self, message_replies: list, peer_connection: PeerConnection) -> None:
+        # --------------------------------------------------------------------------
+        """Handles each reply received on a connection as a request or response"""
+
+        for i in range(len(message_replies)):
+            logger.debug('Reply #%s Contents:\n\tType: %s\n\tFlag: %s\n\tData: %s\n',
+                         i + 1, message_replies[i].type, message_replies[i].flag, message_replies[i].data)
+
+            if message_replies[i].type == 'request':
+                Request(self, message_replies[i], peer_connection)
+            elif message_replies[i].type == 'response':
+                Response(self, message_replies[i], peer_connection)
+            else:
+                logger.warning(
+                    'Unable to handle message type of "%s"', message_replies[i].type)
+
     # ------------------------------------------------------------------------------
     def start_server_listen(self) -> None:
         # --------------------------------------------------------------------------
-        """"""
+        """Accepts and handles inbound connections until shutdown is set, then
+        cancels the outgoing requests still in flight. Uses the selectors event
+        loop when the transport allows it, otherwise one thread per connection.
+        """
 
         server_socket = self.make_server_socket(self.port)
-        server_socket.settimeout(2)
+        # Ready before peers can ask for it (flag 8) rather than on their request
+        self.get_account_tree()
 
-        self.__debug(
+        logger.info(
             'Server Has Started Listening For Incoming Connections...')
 
+        if self.transport.selectable:
+            EventLoop(self, server_socket, workers=self.io_workers).run()
+            logger.info('Stopping server listen')
+            self.cancel_requests()
+            return
+
+        server_socket.settimeout(2)
         while not self.shutdown:
             try:
-                self.__debug('')
                 client_socket, client_address = server_socket.accept()
-                client_socket.settimeout(None)
 
-                client_thread = threading.Thread(
-                    target=self.__handle_peer, args=[client_socket], name=('Client Thread'))
-                client_thread.start()
+                # Decide before spending a thread on the connection
+                peer_connection = self.open_inbound(
+                    client_socket, client_address)
+                if peer_connection is None:
+                    continue
+
+                # A silent client is dropped instead of holding a thread forever
+                client_socket.settimeout(self.admission.read_timeout)
+
+                try:
+                    client_thread = threading.Thread(
+                        target=self.__handle_peer, args=[peer_connection], name=('Client Thread'))
+                    client_thread.start()
+                except RuntimeError:
+                    logger.warning('Unable to start a client thread')
+                    self.close_inbound(peer_connection)
             except KeyboardInterrupt:
-                print('KeyboardInterrupt: stopping server listening')
+                logger.info('KeyboardInterrupt: stopping server listening')
                 self.shutdown = True
                 continue
             except:
-                if self.debug:
-                    # traceback.print_exc()
-                    continue
+                continue
 
-        self.__debug('Stopping server listen')
+        logger.info('Stopping server listen')
         server_socket.close()
-
-    # ------------------------------------------------------------------------------
-    def __debug(self, message) -> None:
-        # --------------------------------------------------------------------------
-        if self.debug:
-            display_debug(message)
+        self.cancel_requests()
 
 
 # end Server class
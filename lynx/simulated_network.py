@@ -0,0 +1,506 @@
+# simulated_network.py
+from transport import Transport
+from collections import deque
+import threading
+import random
+import socket
+import time
+
+
+class SimulatedClock:
+    """Virtual time shared by every connection on a SimulatedNetwork.
+
+    By default virtual time runs speed times faster than real time, so a
+    network with 100 ms links and speed=10 delivers after 10 ms of wall time.
+    With manual=True time only moves when advance() is called, which makes
+    runs fully deterministic.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, speed: float = 1.0, manual: bool = False) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a clock starting at virtual time 0"""
+
+        self.speed = float(speed)
+        self.manual = manual
+        self.current = 0.0
+        self.start_time = time.perf_counter()
+        self.network = None
+
+    # ------------------------------------------------------------------------------
+    def now(self) -> float:
+        # --------------------------------------------------------------------------
+        """Returns the current virtual time in seconds"""
+
+        if self.manual:
+            return self.current
+        return (time.perf_counter() - self.start_time) * self.speed
+
+    # ------------------------------------------------------------------------------
+    def real_seconds(self, virtual_seconds: float) -> float:
+        # --------------------------------------------------------------------------
+        """Converts a virtual duration into wall time. Returns None in manual mode,
+        where waiting is driven by advance() instead.
+        """
+
+        if self.manual:
+            return None
+        return max(0.0, virtual_seconds / self.speed)
+
+    # ------------------------------------------------------------------------------
+    def advance(self, seconds: float) -> None:
+        # --------------------------------------------------------------------------
+        """Moves a manual clock forward and wakes everything waiting on it"""
+
+        if not self.manual:
+            raise ValueError('Only a manual clock can be advanced')
+        if self.network is not None:
+            with self.network.lock:
+                self.current += seconds
+                self.network.wake_all()
+        else:
+            self.current += seconds
+
+    # ------------------------------------------------------------------------------
+    def sleep(self, seconds: float) -> None:
+        # --------------------------------------------------------------------------
+        """Blocks for the given amount of virtual time"""
+
+        if not self.manual:
+            time.sleep(self.real_seconds(seconds))
+            return
+
+        wake_time = self.current + seconds
+        condition = threading.Condition(self.network.lock)
+        with self.network.lock:
+            self.network.waiters.add(condition)
+            try:
+                while self.current < wake_time:
+                    condition.wait()
+            finally:
+                self.network.waiters.discard(condition)
+
+# end SimulatedClock class
+
+
+class Link:
+    """Latency, bandwidth and loss characteristics of a host to host path"""
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, bandwidth: float = None, loss: float = 0.0, retransmit_timeout: float = 0.2) -> None:
+        # --------------------------------------------------------------------------
+        """latency and jitter are in seconds, bandwidth in bytes per second (None
+        for unlimited) and loss is the probability that a segment has to be
+        retransmitted, which delays it by retransmit_timeout.
+        """
+
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.retransmit_timeout = retransmit_timeout
+
+# end Link class
+
+
+class SimulatedSocket:
+    """One end of an in-memory stream connection. Data written by the other end
+    becomes readable once the virtual clock reaches its delivery time.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, network, local_address: tuple, remote_address: tuple) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an unconnected end; SimulatedNetwork pairs two of them"""
+
+        self.network = network
+        self.local_address = local_address
+        self.remote_address = remote_address
+        self.remote = None
+        self.condition = threading.Condition(network.lock)
+        # (delivery time, bytes); b'' marks the end of the stream
+        self.incoming = deque()
+        self.transmit_free_at = 0.0
+        self.write_closed = False
+        self.read_closed = False
+        self.closed = False
+        self.timeout = None
+
+    # ------------------------------------------------------------------------------
+    def settimeout(self, timeout: float) -> None:
+        # --------------------------------------------------------------------------
+        self.timeout = timeout
+
+    # ------------------------------------------------------------------------------
+    def gettimeout(self) -> float:
+        # --------------------------------------------------------------------------
+        return self.timeout
+
+    # ------------------------------------------------------------------------------
+    def setblocking(self, flag: bool) -> None:
+        # --------------------------------------------------------------------------
+        self.timeout = None if flag else 0.0
+
+    # ------------------------------------------------------------------------------
+    def getpeername(self) -> tuple:
+        # --------------------------------------------------------------------------
+        return self.remote_address
+
+    # ------------------------------------------------------------------------------
+    def getsockname(self) -> tuple:
+        # --------------------------------------------------------------------------
+        return self.local_address
+
+    # ------------------------------------------------------------------------------
+    def send(self, data: bytes) -> int:
+        # --------------------------------------------------------------------------
+        """Queues data for delivery to the other end. The whole buffer is always
+        accepted, so send and sendall behave the same.
+        """
+
+        if self.closed or self.write_closed:
+            raise BrokenPipeError('Simulated socket is closed for writing')
+
+        with self.network.lock:
+            if self.remote is None or self.remote.closed:
+                raise ConnectionResetError('Simulated peer closed the connection')
+            self.__deliver(bytes(data))
+
+        return len(data)
+
+    # ------------------------------------------------------------------------------
+    def sendall(self, data: bytes) -> None:
+        # --------------------------------------------------------------------------
+        self.send(data)
+
+    # ------------------------------------------------------------------------------
+    def __deliver(self, data: bytes) -> None:
+        # --------------------------------------------------------------------------
+        """Schedules data (or the end of the stream if empty) on the remote end.
+        Must be called with the network lock held.
+        """
+
+        link = self.network.get_link(
+            self.local_address[0], self.remote_address[0])
+        now = self.network.clock.now()
+
+        start_time = max(now, self.transmit_free_at)
+        if link.bandwidth:
+            self.transmit_free_at = start_time + len(data) / link.bandwidth
+        else:
+            self.transmit_free_at = start_time
+
+        delay = link.latency
+        if link.jitter:
+            delay += self.network.random.uniform(0, link.jitter)
+        while link.loss and self.network.random.random() < link.loss:
+            delay += link.retransmit_timeout
+
+        # A stream never reorders, so nothing is delivered before earlier data
+        delivery_time = self.transmit_free_at + delay
+        if len(self.remote.incoming) > 0:
+            delivery_time = max(delivery_time, self.remote.incoming[-1][0])
+
+        self.remote.incoming.append((delivery_time, data))
+        self.network.bytes_sent += len(data)
+        self.remote.condition.notify_all()
+
+    # ------------------------------------------------------------------------------
+    def recv(self, buffer_size: int) -> bytes:
+        # --------------------------------------------------------------------------
+        """Returns up to buffer_size bytes that have been delivered, b'' once the
+        other end has closed, or raises socket.timeout.
+        """
+
+        clock = self.network.clock
+
+        with self.network.lock:
+            # The timeout is in virtual seconds, like the link latencies
+            deadline = None if self.timeout is None else clock.now() + self.timeout
+            while True:
+                if self.closed:
+                    raise OSError('Simulated socket is closed')
+                if self.read_closed:
+                    return b''
+
+                if len(self.incoming) > 0 and self.incoming[0][0] <= clock.now():
+                    return self.__read_delivered(buffer_size)
+
+                wait = None
+                if len(self.incoming) > 0:
+                    wait = clock.real_seconds(self.incoming[0][0] - clock.now())
+                if deadline is not None:
+                    remaining = deadline - clock.now()
+                    if remaining <= 0:
+                        raise socket.timeout('timed out')
+                    remaining = clock.real_seconds(remaining)
+                    if remaining is not None:
+                        wait = remaining if wait is None else min(wait, remaining)
+
+                self.network.waiters.add(self.condition)
+                try:
+                    self.condition.wait(wait)
+                finally:
+                    self.network.waiters.discard(self.condition)
+
+    # ------------------------------------------------------------------------------
+    def __read_delivered(self, buffer_size: int) -> bytes:
+        # --------------------------------------------------------------------------
+        """Pops delivered data off the incoming queue. Must be called with the
+        network lock held.
+        """
+
+        now = self.network.clock.now()
+        data = b''
+        while len(self.incoming) > 0 and self.incoming[0][0] <= now and len(data) < buffer_size:
+            delivery_time, chunk = self.incoming[0]
+            if len(chunk) == 0:
+                # End of stream, leave the marker so every later recv sees it too
+                break
+            taken = chunk[:buffer_size - len(data)]
+            data += taken
+            if len(taken) == len(chunk):
+                self.incoming.popleft()
+            else:
+                self.incoming[0] = (delivery_time, chunk[len(taken):])
+
+        return data
+
+    # ------------------------------------------------------------------------------
+    def shutdown(self, how: int) -> None:
+        # --------------------------------------------------------------------------
+        """Closes the writing side so the other end reads the end of the stream,
+        and the reading side so recv returns b'' here, including in a thread
+        already blocked on it.
+        """
+
+        with self.network.lock:
+            if how in (socket.SHUT_WR, socket.SHUT_RDWR):
+                self.__close_write()
+            if how in (socket.SHUT_RD, socket.SHUT_RDWR):
+                self.read_closed = True
+                self.condition.notify_all()
+
+    # ------------------------------------------------------------------------------
+    def __close_write(self) -> None:
+        # --------------------------------------------------------------------------
+        if not self.write_closed:
+            self.write_closed = True
+            if self.remote is not None and not self.remote.closed:
+                self.__deliver(b'')
+
+    # ------------------------------------------------------------------------------
+    def close(self) -> None:
+        # --------------------------------------------------------------------------
+        """Closes both directions of this end"""
+
+        with self.network.lock:
+            if not self.closed:
+                self.__close_write()
+                self.closed = True
+                self.condition.notify_all()
+
+    # ------------------------------------------------------------------------------
+    def fileno(self) -> int:
+        # --------------------------------------------------------------------------
+        return -1
+
+# end SimulatedSocket class
+
+
+class SimulatedListener:
+    """Accepts simulated connections made to one host:port"""
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, network, address: tuple, backlog: int) -> None:
+        # --------------------------------------------------------------------------
+        self.network = network
+        self.address = address
+        self.backlog = backlog
+        self.condition = threading.Condition(network.lock)
+        self.pending = deque()
+        self.timeout = None
+        self.closed = False
+
+    # ------------------------------------------------------------------------------
+    def settimeout(self, timeout: float) -> None:
+        # --------------------------------------------------------------------------
+        self.timeout = timeout
+
+    # ------------------------------------------------------------------------------
+    def getsockname(self) -> tuple:
+        # --------------------------------------------------------------------------
+        return self.address
+
+    # ------------------------------------------------------------------------------
+    def accept(self) -> tuple:
+        # --------------------------------------------------------------------------
+        """Returns (connection, remote address) of the next incoming connection.
+        The timeout is in virtual seconds.
+        """
+
+        clock = self.network.clock
+        with self.network.lock:
+            deadline = None if self.timeout is None else clock.now() + self.timeout
+            while len(self.pending) == 0:
+                if self.closed:
+                    raise OSError('Simulated listener is closed')
+                wait = None
+                if deadline is not None:
+                    remaining = deadline - clock.now()
+                    if remaining <= 0:
+                        raise socket.timeout('timed out')
+                    wait = clock.real_seconds(remaining)
+
+                self.network.waiters.add(self.condition)
+                try:
+                    self.condition.wait(wait)
+                finally:
+                    self.network.waiters.discard(self.condition)
+
+            connection = self.pending.popleft()
+            return connection, connection.remote_address
+
+    # ------------------------------------------------------------------------------
+    def close(self) -> None:
+        # --------------------------------------------------------------------------
+        with self.network.lock:
+            self.closed = True
+            self.network.listeners.pop(self.address, None)
+            self.condition.notify_all()
+
+# end SimulatedListener class
+
+
+class SimulatedNetwork:
+    """An in-memory network for running many nodes in one process. Every host
+    gets a SimulatedTransport from transport(host); links between hosts share
+    the default characteristics unless set_link() overrides them.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, bandwidth: float = None, loss: float = 0.0, clock: SimulatedClock = None, seed: int = None) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an empty network with the given default link"""
+
+        self.lock = threading.Lock()
+        self.clock = clock if clock is not None else SimulatedClock()
+        self.clock.network = self
+        self.random = random.Random(seed)
+        self.default_link = Link(latency=latency, jitter=jitter,
+                                 bandwidth=bandwidth, loss=loss)
+        self.links = {}
+        self.listeners = {}
+        self.listening = threading.Condition(self.lock)
+        self.waiters = set()
+        self.next_port = {}
+        self.connections = 0
+        self.bytes_sent = 0
+
+    # ------------------------------------------------------------------------------
+    def transport(self, host: str) -> 'SimulatedTransport':
+        # --------------------------------------------------------------------------
+        """Returns the transport used by the node at host"""
+
+        return SimulatedTransport(self, host)
+
+    # ------------------------------------------------------------------------------
+    def set_link(self, host_a: str, host_b: str, **link) -> None:
+        # --------------------------------------------------------------------------
+        """Overrides the link characteristics between two hosts (both directions)"""
+
+        self.links[(host_a, host_b)] = self.links[(host_b, host_a)] = Link(**link)
+
+    # ------------------------------------------------------------------------------
+    def get_link(self, host_a: str, host_b: str) -> Link:
+        # --------------------------------------------------------------------------
+        return self.links.get((host_a, host_b), self.default_link)
+
+    # ------------------------------------------------------------------------------
+    def wake_all(self) -> None:
+        # --------------------------------------------------------------------------
+        """Wakes every thread waiting on virtual time. Must be called with the
+        lock held.
+        """
+
+        for condition in list(self.waiters):
+            condition.notify_all()
+
+    # ------------------------------------------------------------------------------
+    def listen(self, host: str, port: int, backlog: int) -> SimulatedListener:
+        # --------------------------------------------------------------------------
+        with self.lock:
+            address = (host, int(port))
+            if address in self.listeners:
+                raise OSError('Address already in use: {}:{}'.format(*address))
+            listener = self.listeners[address] = SimulatedListener(
+                self, address, backlog)
+            self.listening.notify_all()
+            return listener
+
+    # ------------------------------------------------------------------------------
+    def wait_listening(self, host: str, port: int, timeout: float = None) -> bool:
+        # --------------------------------------------------------------------------
+        """Blocks until something listens on host:port. Returns False if timeout
+        seconds of wall time passed first.
+        """
+
+        address = (host, int(port))
+        with self.lock:
+            return self.listening.wait_for(lambda: address in self.listeners, timeout)
+
+    # ------------------------------------------------------------------------------
+    def connect(self, local_host: str, host: str, port: int, timeout: float = None) -> SimulatedSocket:
+        # --------------------------------------------------------------------------
+        """Connects local_host to a listener, taking one round trip of virtual time"""
+
+        link = self.get_link(local_host, host)
+        self.clock.sleep(2 * link.latency)
+
+        with self.lock:
+            listener = self.listeners.get((host, int(port)))
+            if listener is None or listener.closed or len(listener.pending) >= max(1, listener.backlog):
+                raise ConnectionRefusedError(
+                    'Connection refused: {}:{}'.format(host, port))
+
+            local_port = self.next_port.get(local_host, 49152)
+            self.next_port[local_host] = local_port + 1
+            local_address = (local_host, local_port)
+            remote_address = (host, int(port))
+
+            client = SimulatedSocket(self, local_address, remote_address)
+            server = SimulatedSocket(self, remote_address, local_address)
+            client.remote, server.remote = server, client
+
+            listener.pending.append(server)
+            listener.condition.notify()
+            self.connections += 1
+
+        return client
+
+# end SimulatedNetwork class
+
+
+class SimulatedTransport(Transport):
+    """Transport for one host on a SimulatedNetwork"""
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, network: SimulatedNetwork, host: str) -> None:
+        # --------------------------------------------------------------------------
+        self.network = network
+        self.host = host
+
+    # ------------------------------------------------------------------------------
+    def connect(self, host: str, port: int, timeout: float = None) -> SimulatedSocket:
+        # --------------------------------------------------------------------------
+        connection = self.network.connect(self.host, host, port, timeout)
+        connection.settimeout(timeout)
+        return connection
+
+    # ------------------------------------------------------------------------------
+    def listen(self, host: str, port: int, backlog: int = 5) -> SimulatedListener:
+        # --------------------------------------------------------------------------
+        # Binding to '' means every address of this host, which is just one here
+        return self.network.listen(host or self.host, port, backlog)
+
+# end SimulatedTransport class
@@ -0,0 +1,64 @@
+# startup_profile.py
+from contextlib import contextmanager
+import time
+
+
+class StartupProfile:
+    """Records how long each phase of bringing up a node takes, so slow cold
+    starts can be traced back to the phase responsible.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes an empty StartupProfile, starting the total clock now"""
+
+        self.start_time = time.perf_counter()
+        self.phases = []
+
+    # ------------------------------------------------------------------------------
+    @contextmanager
+    def phase(self, name: str):
+        # --------------------------------------------------------------------------
+        """Times the body of a with-statement and records it under the given name.
+        Nested phases are recorded with an indented name.
+        """
+
+        depth = sum(1 for phase in self.phases if phase[2] is None)
+        entry = [('  ' * depth) + name, time.perf_counter(), None]
+        self.phases.append(entry)
+        try:
+            yield
+        finally:
+            entry[2] = time.perf_counter()
+
+    # ------------------------------------------------------------------------------
+    def total(self) -> float:
+        # --------------------------------------------------------------------------
+        """Returns the seconds elapsed since the profile was created"""
+
+        return time.perf_counter() - self.start_time
+
+    # ------------------------------------------------------------------------------
+    def to_dict(self) -> dict:
+        # --------------------------------------------------------------------------
+        """Returns the duration of every finished phase in milliseconds"""
+
+        return {name.strip(): round((end - start) * 1000, 3) for name, start, end in self.phases if end is not None}
+
+    # ------------------------------------------------------------------------------
+    def report(self) -> str:
+        # --------------------------------------------------------------------------
+        """Returns a printable table with the duration of each phase"""
+
+        lines = ['Startup Timing Report:']
+        for name, start, end in self.phases:
+            duration = 'running' if end is None else '{:.2f} ms'.format(
+                (end - start) * 1000)
+            lines.append('\t{:<32} {:>12}'.format(name, duration))
+        lines.append('\t{:<32} {:>12}'.format(
+            'Total', '{:.2f} ms'.format(self.total() * 1000)))
+
+        return '\n'.join(lines)
+
+# end StartupProfile class
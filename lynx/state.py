@@ -1,10 +1,16 @@
 from io import TextIOWrapper
+from profiler import PROFILER
+from log import get_logger
 import json
 
+logger = get_logger(__name__)
+
 
 class State:
     '''This class is responsible for managing a current or past state of an account.'''
 
+    __slots__ = ('nonce', 'previous_reference', 'current_reference', 'balance')
+
     # ------------------------------------------------------------------------------
     def __init__(self, nonce: str, previous_reference: str, current_reference: str, balance: int) -> None:
         # --------------------------------------------------------------------------
@@ -21,8 +27,24 @@ class State:
         # --------------------------------------------------------------------------
         """Returns a serialized version of a State object"""
 
-        return json.dumps(self, default=lambda o: o.__dict__,
-                          sort_keys=True, indent=4)
+        return json.dumps(self.to_dict(), sort_keys=True, indent=4)
+
+    # ------------------------------------------------------------------------------
+    def to_dict(self) -> dict:
+        # --------------------------------------------------------------------------
+        return {'nonce': self.nonce, 'previous_reference': self.previous_reference,
+                'current_reference': self.current_reference, 'balance': self.balance}
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def from_dict(self, data: dict):
+        # --------------------------------------------------------------------------
+        """Returns a State object given a dict like the one to_dict returns. Raises
+        KeyError if a field is missing.
+        """
+
+        return State(nonce=data['nonce'], previous_reference=data['previous_reference'],
+                     current_reference=data['current_reference'], balance=data['balance'])
 
     @classmethod
     # ------------------------------------------------------------------------------
@@ -37,20 +59,20 @@ class State:
             if not isinstance(data, dict):
                 raise ValueError
 
-            state = State(nonce=data['nonce'], previous_reference=data['previous_reference'],
-                          current_reference=data['current_reference'], balance=data['balance'])
+            state = State.from_dict(data)
             return state
         except ValueError:
-            print('State data is not a "dict".')
+            logger.warning('State data is not a "dict".')
             return None
         except KeyError:
-            print('State is not formatted correctly.')
+            logger.warning('State is not formatted correctly.')
             return None
         except:
-            print('Unable to convert data in State object.')
+            logger.warning('Unable to convert data in State object.')
             return None
 
     @classmethod
+    @PROFILER.profile('state_from_File')
     # ------------------------------------------------------------------------------
     def from_File(self, file: TextIOWrapper):
         # --------------------------------------------------------------------------
@@ -63,15 +85,14 @@ class State:
             if not isinstance(data, dict):
                 raise ValueError
 
-            state = State(nonce=data['nonce'], previous_reference=data['previous_reference'],
-                          current_reference=data['current_reference'], balance=data['balance'])
+            state = State.from_dict(data)
             return state
         except ValueError:
-            print('State data is not a "dict".')
+            logger.warning('State data is not a "dict".')
             return None
         except KeyError:
-            print('State is not formatted correctly.')
+            logger.warning('State is not formatted correctly.')
             return None
         except:
-            print('Unable to convert data in State object.')
+            logger.warning('Unable to convert data in State object.')
             return None
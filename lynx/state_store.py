@@ -0,0 +1,331 @@
+# state_store.py
+from state import State
+from log import get_logger
+from typing import Callable
+import threading
+import os
+
+logger = get_logger(__name__)
+
+
+class StateStore:
+    """Reads and writes the states of each account under the accounts directory
+    (<accounts>/<account>/states/*.dat) and keeps every account's chain ordered
+    by previous_reference linkage. An account is only parsed again when its
+    states directory changed. Listeners are called with (account, state) for
+    every state written through the store, batch listeners once per batch.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, accounts_directory: str = '../accounts') -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a StateStore over accounts_directory"""
+
+        self.accounts_directory = accounts_directory
+        self.lock = threading.RLock()
+        # account -> (states directory mtime, ordered chain, {reference: State})
+        self.accounts = {}
+        self.listeners = []
+        self.batch_listeners = []
+
+    # ------------------------------------------------------------------------------
+    def add_listener(self, listener: Callable) -> None:
+        # --------------------------------------------------------------------------
+        self.listeners.append(listener)
+
+    # ------------------------------------------------------------------------------
+    def add_batch_listener(self, listener: Callable) -> None:
+        # --------------------------------------------------------------------------
+        """Registers a listener called once per written batch with the list of
+        (account, state) pairs that were stored.
+        """
+
+        self.batch_listeners.append(listener)
+
+    # ------------------------------------------------------------------------------
+    def state_path(self, account: str) -> str:
+        # --------------------------------------------------------------------------
+        return os.path.join(self.accounts_directory, account, 'states')
+
+    # ------------------------------------------------------------------------------
+    def list_accounts(self) -> list:
+        # --------------------------------------------------------------------------
+        try:
+            return [account for account in os.listdir(self.accounts_directory)
+                    if os.path.isdir(self.state_path(account))]
+        except OSError:
+            return []
+
+    # ------------------------------------------------------------------------------
+    def __load(self, account: str) -> tuple:
+        # --------------------------------------------------------------------------
+        """Returns the cached (mtime, chain, states) of an account, parsing its
+        states directory again if it changed. Called with the lock held.
+        """
+
+        state_path = self.state_path(account)
+        try:
+            modified = os.stat(state_path).st_mtime_ns
+        except OSError:
+            self.accounts.pop(account, None)
+            return None, [], {}
+
+        cached = self.accounts.get(account)
+        if cached is not None and cached[0] == modified:
+            return cached
+
+        states = {}
+        for file in os.listdir(state_path):
+            try:
+                with open(os.path.join(state_path, file), 'r') as state_file:
+                    state = State.from_File(state_file)
+            except OSError:
+                continue
+            if state is not None:
+                states[state.current_reference] = state
+
+        entry = (modified, self.order_chain(states), states)
+        self.accounts[account] = entry
+        return entry
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def order_chain(self, states: dict) -> list:
+        # --------------------------------------------------------------------------
+        """Orders {reference: State} by previous_reference linkage. The chain
+        starts at a state whose previous reference is not one of the given
+        states; if the states hold several chains or forks, the longest path is
+        returned.
+        """
+
+        children = {}
+        for state in states.values():
+            children.setdefault(state.previous_reference, []).append(state)
+
+        best_chain = []
+        roots = [state for state in states.values()
+                 if state.previous_reference not in states]
+        for root in roots:
+            chain = [root]
+            visited = {root.current_reference}
+            while True:
+                next_states = [state for state in children.get(chain[-1].current_reference, [])
+                               if state.current_reference not in visited]
+                if len(next_states) == 0:
+                    break
+                next_state = next_states[0]
+                if len(next_states) > 1:
+                    next_state = max(next_states, key=lambda state: len(
+                        self.__descendants(state, children)))
+                visited.add(next_state.current_reference)
+                chain.append(next_state)
+            if len(chain) > len(best_chain):
+                best_chain = chain
+
+        return best_chain
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __descendants(self, state: State, children: dict) -> set:
+        # --------------------------------------------------------------------------
+        """Returns the references reachable from state (only used at forks)"""
+
+        reachable = set()
+        pending = [state]
+        while len(pending) > 0:
+            current = pending.pop()
+            for child in children.get(current.current_reference, []):
+                if child.current_reference not in reachable:
+                    reachable.add(child.current_reference)
+                    pending.append(child)
+
+        return reachable
+
+    # ------------------------------------------------------------------------------
+    def get_chain(self, account: str) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the ordered chain of States of an account (oldest first)"""
+
+        with self.lock:
+            return list(self.__load(account)[1])
+
+    # ------------------------------------------------------------------------------
+    def get_tip(self, account: str) -> State:
+        # --------------------------------------------------------------------------
+        """Returns the newest State of an account, or None if it has none"""
+
+        with self.lock:
+            chain = self.__load(account)[1]
+            return chain[-1] if len(chain) > 0 else None
+
+    # ------------------------------------------------------------------------------
+    def get(self, account: str, reference: str) -> State:
+        # --------------------------------------------------------------------------
+        """Returns the State of an account with the given current reference"""
+
+        with self.lock:
+            return self.__load(account)[2].get(reference)
+
+    # ------------------------------------------------------------------------------
+    def count(self, account: str) -> int:
+        # --------------------------------------------------------------------------
+        """Returns the number of states stored for an account"""
+
+        with self.lock:
+            return len(self.__load(account)[2])
+
+    # ------------------------------------------------------------------------------
+    def put(self, account: str, state: State) -> bool:
+        # --------------------------------------------------------------------------
+        """Writes a state to <current_reference>.dat in the account's states
+        directory. Returns False if it could not be written.
+        """
+
+        return self.put_many([(account, state)]) == 1
+
+    # ------------------------------------------------------------------------------
+    def put_many(self, items: list, durable: bool = False) -> int:
+        # --------------------------------------------------------------------------
+        """Writes a batch of (account, state) pairs. If durable, the batch is
+        flushed to disk (each file is synced at one point, before any is
+        renamed into place) and each touched states directory is synced once
+        afterwards. Listeners are called after the whole batch is written.
+        Returns the number of states stored.
+        """
+
+        pending = []
+        for account, state in items:
+            if os.path.basename(account) != account or os.path.basename(state.current_reference) != state.current_reference:
+                logger.warning('Refusing to store state with unsafe name %s/%s',
+                               account, state.current_reference)
+                continue
+            path = os.path.join(self.state_path(account),
+                                '{}.dat'.format(state.current_reference))
+            pending.append((account, state, path))
+
+        stored = []
+        with self.lock:
+            written = []
+            # Durable batches keep their files open until the single sync point
+            open_files = []
+            try:
+                for account, state, path in pending:
+                    try:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        state_file = open(path + '.tmp', 'w')
+                    except OSError:
+                        logger.warning('Unable to store state %s/%s', account,
+                                       state.current_reference, exc_info=True)
+                        continue
+                    try:
+                        state_file.write(state.to_JSON())
+                        state_file.flush()
+                    except OSError:
+                        state_file.close()
+                        logger.warning('Unable to store state %s/%s', account,
+                                       state.current_reference, exc_info=True)
+                        continue
+                    if durable:
+                        open_files.append((account, state, path, state_file))
+                    else:
+                        state_file.close()
+                        written.append((account, state, path))
+
+                # Only the batch's own files are synced, not the whole host
+                for account, state, path, state_file in open_files:
+                    try:
+                        os.fsync(state_file.fileno())
+                    except OSError:
+                        logger.warning('Unable to store state %s/%s', account,
+                                       state.current_reference, exc_info=True)
+                        continue
+                    written.append((account, state, path))
+            finally:
+                for _, _, _, state_file in open_files:
+                    state_file.close()
+
+            for account, state, path in written:
+                try:
+                    os.replace(path + '.tmp', path)
+                except OSError:
+                    logger.warning('Unable to store state %s/%s', account,
+                                   state.current_reference, exc_info=True)
+                    continue
+                stored.append((account, state))
+
+            if durable:
+                for state_path in {os.path.dirname(path) for _, _, path in written}:
+                    self.__sync_directory(state_path)
+
+            for account, state in stored:
+                self.__update_cache(account, state)
+
+        for account, state in stored:
+            for listener in self.listeners:
+                listener(account, state)
+        if len(stored) > 0:
+            for listener in self.batch_listeners:
+                listener(stored)
+        return len(stored)
+
+    # ------------------------------------------------------------------------------
+    def notify(self, items: list) -> None:
+        # --------------------------------------------------------------------------
+        """Calls the listeners for [account, reference] pairs that another process
+        wrote to the accounts directory.
+        """
+
+        stored = []
+        for account, reference in items:
+            state = self.get(account, reference)
+            if state is not None:
+                stored.append((account, state))
+
+        for account, state in stored:
+            for listener in self.listeners:
+                listener(account, state)
+        if len(stored) > 0:
+            for listener in self.batch_listeners:
+                listener(stored)
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __sync_directory(self, path: str) -> None:
+        # --------------------------------------------------------------------------
+        """Makes the renames in a directory durable (not possible on Windows)"""
+
+        try:
+            directory_fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(directory_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(directory_fd)
+
+    # ------------------------------------------------------------------------------
+    def __update_cache(self, account: str, state: State) -> None:
+        # --------------------------------------------------------------------------
+        """Adds a state that was just written to the cached chain instead of
+        parsing the account again. Called with the lock held.
+        """
+
+        cached = self.accounts.get(account)
+        if cached is None:
+            return
+
+        _, chain, states = cached
+        replaced = state.current_reference in states
+        states[state.current_reference] = state
+        # Appending is only safe if no stored state could hang off the new one
+        if not replaced and len(chain) == len(states) - 1 \
+                and (len(chain) == 0 or state.previous_reference == chain[-1].current_reference):
+            chain.append(state)
+        else:
+            chain = self.order_chain(states)
+        self.accounts[account] = (os.stat(self.state_path(
+            account)).st_mtime_ns, chain, states)
+
+# end StateStore class
@@ -0,0 +1,166 @@
+# state_writer.py
+from state_store import StateStore
+from chain_verifier import ChainVerifier
+from metrics import Metrics
+from log import get_logger
+from typing import Callable
+import threading
+import time
+
+logger = get_logger(__name__)
+
+
+class StateWriter:
+    """Buffers states received from peers and writes them to a StateStore in
+    batches from one writer thread. A batch is written once max_batch states
+    are buffered or the oldest one has waited max_delay seconds, with one sync
+    per batch when durable.
+
+    States are verified by verifier, if given, in the submitting thread so that
+    responses from several peers are checked in parallel and the writer thread
+    only writes. Producers block in submit() while max_pending states are
+    buffered. The writer reports backlogged() once half of that is buffered so
+    the download scheduler can stop requesting more, and calls on_drain() when
+    the buffer has emptied again.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, state_store: StateStore, max_batch: int = 256, max_delay: float = 0.05,
+                 max_pending: int = 4096, durable: bool = True, on_drain: Callable = None,
+                 metrics: Metrics = None, verifier: ChainVerifier = None) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a StateWriter for state_store; its thread starts with the
+        first submitted state.
+        """
+
+        self.state_store = state_store
+        self.max_batch = max(1, int(max_batch))
+        self.max_delay = float(max_delay)
+        self.max_pending = max(self.max_batch, int(max_pending))
+        self.durable = durable
+        self.on_drain = on_drain if on_drain is not None else lambda: None
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.verifier = verifier
+        self.condition = threading.Condition()
+        self.pending = []
+        self.writing = 0
+        self.was_backlogged = False
+        self.shutdown = False
+        self.thread = None
+
+    # ------------------------------------------------------------------------------
+    def submit(self, items: list, timeout: float = 30.0) -> int:
+        # --------------------------------------------------------------------------
+        """Queues (account, state) pairs for writing, waiting up to timeout for
+        room in the buffer. Returns the number of states queued; the rest are
+        dropped and can be requested again. States that fail verification are
+        never queued.
+        """
+
+        if self.verifier is not None:
+            items = self.verifier.filter(items, self.state_store.get, self.state_store.get_tip)
+
+        queued = 0
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            if self.thread is None and not self.shutdown:
+                self.thread = threading.Thread(
+                    target=self.__run, name='State Writer Thread', daemon=True)
+                self.thread.start()
+
+            while queued < len(items) and not self.shutdown:
+                room = self.max_pending - len(self.pending)
+                if room <= 0:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.metrics.inc('state_writer_waits_total')
+                    self.condition.wait(remaining)
+                    continue
+                self.pending.extend(items[queued:queued + room])
+                queued += min(room, len(items) - queued)
+                self.condition.notify_all()
+
+            if self.backlogged():
+                self.was_backlogged = True
+
+        if queued < len(items):
+            logger.warning('State writer is full, dropped %s states', len(items) - queued)
+            self.metrics.inc('states_dropped_total', len(items) - queued)
+        return queued
+
+    # ------------------------------------------------------------------------------
+    def backlogged(self) -> bool:
+        # --------------------------------------------------------------------------
+        return len(self.pending) >= self.max_pending // 2
+
+    # ------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        # --------------------------------------------------------------------------
+        return len(self.pending) + self.writing
+
+    # ------------------------------------------------------------------------------
+    def flush(self, timeout: float = None) -> bool:
+        # --------------------------------------------------------------------------
+        """Waits until every queued state is written. Returns False on timeout."""
+
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self) == 0, timeout)
+
+    # ------------------------------------------------------------------------------
+    def stop(self, timeout: float = None) -> None:
+        # --------------------------------------------------------------------------
+        """Writes what is queued and stops the writer thread"""
+
+        self.flush(timeout)
+        with self.condition:
+            self.shutdown = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    # ------------------------------------------------------------------------------
+    def __run(self) -> None:
+        # --------------------------------------------------------------------------
+        """Writer thread: takes batches off the buffer and writes them"""
+
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: len(self.pending) > 0 or self.shutdown)
+                if len(self.pending) == 0:
+                    return
+                # Give a partial batch a moment to fill up
+                deadline = time.monotonic() + self.max_delay
+                while len(self.pending) < self.max_batch and not self.shutdown:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+                self.writing = len(batch)
+                self.condition.notify_all()
+
+            start_time = time.perf_counter()
+            try:
+                stored = self.state_store.put_many(batch, durable=self.durable)
+            except Exception:
+                logger.warning('Unable to write a batch of %s states',
+                               len(batch), exc_info=True)
+                stored = 0
+            self.metrics.observe('state_writer_batch_seconds',
+                                 time.perf_counter() - start_time)
+            self.metrics.inc('state_writer_batches_total')
+            self.metrics.inc('state_writer_states_total', stored)
+
+            with self.condition:
+                self.writing = 0
+                drained = self.was_backlogged and len(self.pending) == 0
+                if drained:
+                    self.was_backlogged = False
+                self.condition.notify_all()
+            if drained:
+                self.on_drain()
+
+# end StateWriter class
@@ -0,0 +1,245 @@
+# supervisor.py
+from state_store import StateStore
+from tip_index import TipIndex
+from worker_channel import WorkerChannel
+from transport import TcpTransport
+from metrics import Metrics
+from log import get_logger
+import multiprocessing
+import argparse
+import threading
+import signal
+import socket
+import queue
+import time
+import uuid
+import os
+
+logger = get_logger(__name__)
+
+
+class Supervisor:
+    """Runs a node as several worker processes that all accept on the same port
+    (SO_REUSEPORT), so message handling is not limited to the one core the GIL
+    allows a single process. Workers publish changes to the peer table,
+    inventory and stored states on a queue; the supervisor relays them to the
+    other workers, keeps the tip index on disk up to date and restarts workers
+    that exit, backing off when a worker keeps crashing. A restarted worker is
+    sent the peers added so far; its share of the inventory is lost until the
+    states are announced again.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, workers: int = None, port: int = 6969, host: str = None, max_peers: int = 12,
+                 accounts_directory: str = '../accounts', restart_delay: float = 1.0,
+                 max_restart_delay: float = 30.0, stable_after: float = 60.0) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a Supervisor for workers processes (one per core by default)
+        serving port. A worker that ran for stable_after seconds is restarted
+        after restart_delay, otherwise the delay doubles up to max_restart_delay.
+        """
+
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise OSError('SO_REUSEPORT is not supported on this platform')
+
+        self.workers = int(workers) if workers is not None else (
+            os.cpu_count() or 1)
+        self.port = int(port)
+        self.host = host
+        self.max_peers = int(max_peers)
+        self.accounts_directory = accounts_directory
+        self.restart_delay = float(restart_delay)
+        self.max_restart_delay = float(max_restart_delay)
+        self.stable_after = float(stable_after)
+        self.nonce = uuid.uuid4().hex + uuid.uuid1().hex
+        self.metrics = Metrics()
+        self.shutdown = False
+        self.processes = {}
+        # host:port -> peer event payload, replayed to restarted workers
+        self.peers = {}
+
+        methods = multiprocessing.get_all_start_methods()
+        # Forking this (threaded) process directly is not safe, fork from a clean server
+        self.context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in methods else 'spawn')
+        self.events = None
+        self.known_peers_lock = None
+        self.state_store = StateStore(accounts_directory)
+        self.tip_index = TipIndex(os.path.join(os.path.dirname(os.path.normpath(
+            accounts_directory)), 'tip_index.json'), self.state_store)
+        self.relay_thread = None
+
+    # ------------------------------------------------------------------------------
+    def start(self) -> None:
+        # --------------------------------------------------------------------------
+        """Starts every worker and the event relay"""
+
+        self.events = self.context.Queue()
+        self.known_peers_lock = self.context.RLock()
+        for index in range(self.workers):
+            self.processes[index] = {'process': None, 'inbox': None, 'started': 0.0,
+                                     'restarts': 0, 'delay': self.restart_delay, 'restart_at': None}
+            self.__start_worker(index)
+
+        self.relay_thread = threading.Thread(
+            target=self.__relay, name='Supervisor Relay Thread', daemon=True)
+        self.relay_thread.start()
+        logger.info('Supervisor started %s workers on port %s',
+                    self.workers, self.port)
+
+    # ------------------------------------------------------------------------------
+    def __start_worker(self, index: int) -> None:
+        # --------------------------------------------------------------------------
+        worker = self.processes[index]
+        # A worker killed while reading may leave its queue unusable, start fresh
+        worker['inbox'] = self.context.Queue()
+        for payload in list(self.peers.values()):
+            worker['inbox'].put(('peer', payload))
+        worker['process'] = self.context.Process(target=run_worker, name='Lynx Worker {}'.format(index), args=(
+            index, self.workers, self.nonce, self.port, self.host, self.max_peers, self.accounts_directory,
+            self.events, worker['inbox'], self.known_peers_lock))
+        worker['process'].start()
+        worker['started'] = time.monotonic()
+        worker['restart_at'] = None
+        logger.info('Worker %s started (pid %s)',
+                    index, worker['process'].pid)
+
+    # ------------------------------------------------------------------------------
+    def __relay(self) -> None:
+        # --------------------------------------------------------------------------
+        """Passes every worker event on to the other workers"""
+
+        while not self.shutdown:
+            try:
+                index, kind, payload = self.events.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+
+            self.metrics.inc('worker_events_total', kind=kind)
+            if kind == 'peer':
+                self.peers['{}:{}'.format(
+                    payload['host'], payload['port'])] = payload
+            elif kind == 'states':
+                # Keeps the tip index on disk, the workers only hold it in memory
+                self.state_store.notify(payload)
+            for other_index, worker in list(self.processes.items()):
+                if other_index != index and worker['process'] is not None and worker['process'].is_alive():
+                    worker['inbox'].put((kind, payload))
+
+    # ------------------------------------------------------------------------------
+    def monitor(self) -> None:
+        # --------------------------------------------------------------------------
+        """Schedules restarts of workers that exited and starts those that are due"""
+
+        now = time.monotonic()
+        for index, worker in self.processes.items():
+            process = worker['process']
+            if worker['restart_at'] is not None:
+                if now >= worker['restart_at']:
+                    self.__start_worker(index)
+                continue
+            if process.is_alive():
+                continue
+
+            if now - worker['started'] >= self.stable_after:
+                worker['delay'] = self.restart_delay
+            else:
+                worker['delay'] = min(
+                    worker['delay'] * 2, self.max_restart_delay)
+            worker['restarts'] += 1
+            worker['restart_at'] = now + worker['delay']
+            self.metrics.inc('worker_restarts_total')
+            logger.warning('Worker %s exited with code %s, restarting in %.1f s',
+                           index, process.exitcode, worker['delay'])
+
+    # ------------------------------------------------------------------------------
+    def status(self) -> list:
+        # --------------------------------------------------------------------------
+        return [{'worker': index, 'pid': worker['process'].pid, 'alive': worker['process'].is_alive(),
+                 'restarts': worker['restarts']} for index, worker in self.processes.items()]
+
+    # ------------------------------------------------------------------------------
+    def run(self) -> None:
+        # --------------------------------------------------------------------------
+        """Starts the workers and supervises them until SIGINT or SIGTERM"""
+
+        def handle_signal(signum, frame):
+            self.shutdown = True
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+        self.start()
+        while not self.shutdown:
+            self.monitor()
+            time.sleep(0.5)
+        self.stop()
+
+    # ------------------------------------------------------------------------------
+    def stop(self, timeout: float = 15.0) -> None:
+        # --------------------------------------------------------------------------
+        """Asks every worker to finish its writes and exit, killing stragglers"""
+
+        self.shutdown = True
+        for worker in self.processes.values():
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        deadline = time.monotonic() + timeout
+        for index, worker in self.processes.items():
+            worker['process'].join(max(0.0, deadline - time.monotonic()))
+            if worker['process'].is_alive():
+                logger.warning('Killing worker %s', index)
+                worker['process'].kill()
+                worker['process'].join()
+        logger.info('Supervisor stopped')
+
+# end Supervisor class
+
+
+# ------------------------------------------------------------------------------
+def run_worker(index: int, workers: int, nonce: str, port: int, host: str, max_peers: int,
+               accounts_directory: str, events, inbox, known_peers_lock) -> None:
+    # --------------------------------------------------------------------------
+    """Entry point of a worker process: serves port until SIGTERM, then writes
+    out its buffered states.
+    """
+
+    import peer
+    from server import Server
+
+    # known_peers.json is shared by every worker
+    peer.KNOWN_PEERS_LOCK = known_peers_lock
+
+    channel = WorkerChannel(index, workers, events, inbox)
+    server = Server(nonce=nonce, port=port, host=host, max_peers=max_peers,
+                    transport=TcpTransport(reuse_port=True), accounts_directory=accounts_directory,
+                    channel=channel)
+
+    def handle_signal(signum, frame):
+        server.shutdown = True
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    channel.start(server)
+    server.start_server_listen()
+    server.state_writer.stop(timeout=10.0)
+
+
+# ------------------------------------------------------------------------------
+def main() -> None:
+    # --------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(
+        description='Runs a node as several worker processes sharing one port.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--port', type=int, default=6969)
+    parser.add_argument('--max-peers', type=int, default=12)
+    parser.add_argument('--accounts-directory', type=str, default='../accounts')
+    arguments = parser.parse_args()
+
+    Supervisor(workers=arguments.workers, port=arguments.port, max_peers=arguments.max_peers,
+               accounts_directory=arguments.accounts_directory).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# sync_engine.py
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from message_validation import MessageValidation
+from constants import MAX_REFERENCES_PER_RESPONSE
+from state import State
+from deadline import Deadline
+from log import get_logger
+from typing import TYPE_CHECKING
+import time
+if TYPE_CHECKING:
+    from server import Server
+
+logger = get_logger(__name__)
+
+
+class SyncEngine:
+    """Headers-first account sync. The ordered chain of references of an account
+    is fetched from one peer and its previous_reference linkage verified, then
+    the missing state bodies are downloaded in batches from several peers in
+    parallel and checked against the references before they are stored in
+    chain order.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, server: Server, batch_size: int = 10, workers: int = 8, max_attempts: int = 3) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a SyncEngine downloading batch_size states per data request
+        with up to workers requests in flight. A failed batch is retried on the
+        next peer, at most max_attempts times.
+        """
+
+        self.server = server
+        self.batch_size = int(batch_size)
+        self.workers = int(workers)
+        self.max_attempts = int(max_attempts)
+
+    # ------------------------------------------------------------------------------
+    def fetch_references(self, account: str, host: str, port: int, from_reference: str = None,
+                         deadline: Deadline = None) -> list:
+        # --------------------------------------------------------------------------
+        """Returns the [current_reference, previous_reference] pairs of an
+        account's chain after from_reference, as announced by host:port. Returns
+        None if the peer did not answer properly before deadline.
+        """
+
+        references = []
+        while True:
+            replies = self.server.connect_and_send(host, port, 'request', 7, {
+                'account': account, 'from_reference': from_reference,
+                'max_count': MAX_REFERENCES_PER_RESPONSE}, dispatch=False, deadline=deadline)
+            reply = next((reply for reply in replies
+                          if MessageValidation.validate_references_response(message=reply)), None)
+            if reply is None or reply.data['account'] != account:
+                return None
+
+            page = reply.data['references']
+            references.extend(page)
+            if len(page) < MAX_REFERENCES_PER_RESPONSE:
+                return references
+            from_reference = page[-1][0]
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def verify_references(self, references: list, tip_reference: str = None) -> bool:
+        # --------------------------------------------------------------------------
+        """Checks that every reference points at the one before it, that the first
+        one follows tip_reference (if the account is known locally) and that no
+        reference repeats.
+        """
+
+        previous = tip_reference
+        seen = set()
+        for current_reference, previous_reference in references:
+            if previous is not None and previous_reference != previous:
+                return False
+            if current_reference in seen:
+                return False
+            seen.add(current_reference)
+            previous = current_reference
+
+        return True
+
+    # ------------------------------------------------------------------------------
+    def sync_account(self, account: str, peers: list, deadline: Deadline = None) -> dict:
+        # --------------------------------------------------------------------------
+        """Syncs an account from peers, a list of (host, port). The references are
+        taken from the first peer whose chain verifies. Every request is made
+        within deadline; once it passes, or is cancelled, no more are made and
+        whatever was downloaded is stored. Returns a summary of the sync.
+        """
+
+        start_time = time.perf_counter()
+        store = self.server.state_store
+        tip = store.get_tip(account)
+        tip_reference = tip.current_reference if tip is not None else None
+
+        references = None
+        for host, port in peers:
+            if deadline is not None and deadline.done():
+                break
+            references = self.fetch_references(
+                account, host, port, tip_reference, deadline=deadline)
+            if references is not None and self.verify_references(references, tip_reference):
+                break
+            logger.warning('Rejected references of %s from %s:%s',
+                           account, host, port)
+            self.server.metrics.inc('sync_references_rejected_total')
+            references = None
+
+        summary = {'account': account, 'references': 0, 'downloaded': 0, 'stored': 0,
+                   'skipped': 0, 'failed': 0, 'rejected': 0, 'seconds': 0.0}
+        if references is None:
+            summary['failed'] = -1
+            summary['seconds'] = time.perf_counter() - start_time
+            return summary
+
+        expected = {current_reference: previous_reference
+                    for current_reference, previous_reference in references}
+        missing = [current_reference for current_reference, _ in references
+                   if '{}/{}'.format(account, current_reference) not in self.server.local_states]
+        batches = [missing[index:index + self.batch_size]
+                   for index in range(0, len(missing), self.batch_size)]
+
+        downloaded = {}
+        if len(batches) > 0:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(batches)),
+                                    thread_name_prefix='Sync Thread') as executor:
+                for states in executor.map(lambda indexed: self.__download_batch(account, indexed[1], expected, peers, indexed[0], deadline),
+                                           enumerate(batches)):
+                    downloaded.update(states)
+
+        # Store in chain order and stop at the first gap so the chain stays linked
+        ordered = []
+        for current_reference, _ in references:
+            state = downloaded.get(current_reference)
+            if state is None:
+                if '{}/{}'.format(account, current_reference) in self.server.local_states:
+                    continue
+                break
+            ordered.append((account, state))
+        result = self.server.chain_verifier.verify_account(
+            account, [state for _, state in ordered], store.get, store.get_tip)
+        if len(result['rejected']) > 0 or len(result['orphaned']) > 0:
+            if len(result['rejected']) > 0:
+                logger.warning('Rejected %s states of %s (%s)', len(result['rejected']), account,
+                               result['rejected'][0]['reason'])
+            if len(result['orphaned']) > 0:
+                logger.warning('%s states of %s do not follow its stored chain',
+                               len(result['orphaned']), account)
+            # Only the states before the first refused one still form a chain
+            refused = {item['reference'] for item in result['rejected']} | set(result['orphaned'])
+            ordered = ordered[:next(index for index, (_, state) in enumerate(ordered)
+                                    if state.current_reference in refused)]
+        stored = 0
+        for index in range(0, len(ordered), self.server.state_writer.max_batch):
+            batch = ordered[index:index + self.server.state_writer.max_batch]
+            stored += store.put_many(batch, durable=True)
+            if stored < index + len(batch):
+                break
+
+        summary.update({'references': len(references), 'downloaded': len(downloaded), 'stored': stored,
+                        'skipped': len(references) - len(missing), 'failed': len(missing) - len(downloaded),
+                        'rejected': len(result['rejected']),
+                        'seconds': time.perf_counter() - start_time})
+        self.server.metrics.inc('sync_states_stored_total', stored)
+        return summary
+
+    # ------------------------------------------------------------------------------
+    def __download_batch(self, account: str, batch: list, expected: dict, peers: list, index: int,
+                         deadline: Deadline = None) -> dict:
+        # --------------------------------------------------------------------------
+        """Requests a batch of states, starting with the index-th peer and moving to
+        the next peer for whatever is still missing. Returns {reference: State}
+        for the states that match their announced references.
+        """
+
+        states = {}
+        remaining = list(batch)
+        for attempt in range(min(self.max_attempts, len(peers))):
+            if deadline is not None and deadline.done():
+                break
+            host, port = peers[(index + attempt) % len(peers)]
+            inventory = ['{}/{}'.format(account, reference)
+                         for reference in remaining]
+            replies = self.server.connect_and_send(host, port, 'request', 4, {
+                'inventory_count': len(inventory), 'inventory': inventory}, dispatch=False, deadline=deadline)
+
+            for reply in replies:
+                if reply.type != 'response' or reply.flag != 4 or not isinstance(reply.data, dict) \
+                        or not isinstance(reply.data.get('inventory'), list):
+                    continue
+                for state_data in reply.data['inventory']:
+                    state = self.__to_state(state_data)
+                    if state is None or state.current_reference not in remaining:
+                        continue
+                    if expected.get(state.current_reference) != state.previous_reference:
+                        self.server.metrics.inc('sync_states_rejected_total')
+                        continue
+                    states[state.current_reference] = state
+
+            remaining = [
+                reference for reference in remaining if reference not in states]
+            if len(remaining) == 0:
+                break
+            self.server.metrics.inc('sync_batch_retries_total')
+
+        return states
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __to_state(self, state_data) -> State:
+        # --------------------------------------------------------------------------
+        try:
+            return State(nonce=state_data['nonce'], previous_reference=state_data['previous_reference'],
+                         current_reference=state_data['current_reference'], balance=state_data['balance'])
+        except (KeyError, TypeError):
+            return None
+
+# end SyncEngine class
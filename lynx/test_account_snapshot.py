@@ -0,0 +1,63 @@
+from test_sync_engine import write_chain
+from account_snapshot import AccountSnapshot
+from state_store import StateStore
+from tip_index import TipIndex
+from state import State
+import tempfile
+import random
+import time
+import os
+
+
+def test_account_snapshot(accounts=2000, length=3):
+    with tempfile.TemporaryDirectory(prefix='lynx-snapshot-') as directory:
+        accounts_directory = os.path.join(directory, 'accounts')
+        chains = {}
+        for _ in range(accounts):
+            account = hex(random.getrandbits(160))
+            chains[account] = write_chain(accounts_directory, account, length)
+
+        store = StateStore(accounts_directory)
+        tip_index = TipIndex(os.path.join(directory, 'tip_index.json'), store)
+        snapshot = AccountSnapshot(tip_index, os.path.join(directory, 'snapshot'))
+        start_time = time.perf_counter()
+        snapshot.build()
+        snapshot.save()
+        print('Built and saved {} accounts in {:.3f} s'.format(
+            len(snapshot), time.perf_counter() - start_time))
+        assert len(snapshot) == accounts
+        total_balance_correct = snapshot.total_balance() == sum(chain[-1].balance for chain in chains.values())
+        print('Total Balance Correct: {}'.format(total_balance_correct))
+        assert total_balance_correct
+
+        # A richer tip for one account and one new account
+        account, chain = next(iter(chains.items()))
+        store.put(account, State(nonce=str(length + 1), previous_reference=chain[-1].current_reference,
+                                 current_reference=hex(random.getrandbits(256)), balance=10 ** 6))
+        store.put('0x1', State(nonce='1', previous_reference='0x0',
+                               current_reference=hex(random.getrandbits(256)), balance=5 * 10 ** 5))
+        refreshed = snapshot.refresh()
+        print('Refreshed Accounts: {}'.format(refreshed))
+        assert refreshed == 2
+        top = snapshot.top_accounts(2)
+        print('Top 2: {}'.format([balance for _, balance in top]))
+        assert top == [(account, 10.0 ** 6), ('0x1', 5.0 * 10 ** 5)]
+        print('Top Account Correct: {}'.format(top[0][0] == account))
+
+        snapshot.save()
+        mapped = AccountSnapshot(TipIndex(os.path.join(directory, 'tip_index.json')),
+                                 os.path.join(directory, 'snapshot'))
+        memory_mapped = mapped.load()
+        print('Memory Mapped: {}'.format(memory_mapped))
+        assert memory_mapped
+        print('Accounts: {}, Above 100000: {}, Percentiles: {}'.format(
+            len(mapped), mapped.count_above(100000), mapped.balance_percentiles()))
+        assert len(mapped) == accounts + 1
+        assert mapped.count_above(100000) == 2
+        histogram = mapped.balance_histogram(5)[0].tolist()
+        print('Histogram: {}'.format(histogram))
+        assert sum(histogram) == accounts + 1
+
+
+if __name__ == "__main__":
+    test_account_snapshot()
@@ -0,0 +1,74 @@
+from admission import AdmissionControl
+from simulated_network import SimulatedNetwork
+from server import Server
+import threading
+import tempfile
+import os
+
+
+def test_admission():
+    now = [0.0]
+    admission = AdmissionControl(max_connections=2, max_connections_per_host=1,
+                                 rate_limits={3: (1.0, 2)}, max_tracked_buckets=3, clock=lambda: now[0])
+
+    admitted = [admission.admit('10.0.0.2'), admission.admit('10.0.0.2'),
+                admission.admit('10.0.0.3'), admission.admit('10.0.0.4')]
+    print('Admitted: {}'.format(admitted))
+    assert admitted == [None, 'host_limit', None, 'overloaded']
+    admission.release('10.0.0.2')
+    admission.release('10.0.0.3')
+    assert admission.status()['connections'] == 0
+
+    allowed = [admission.allow_message('10.0.0.2', 3) for _ in range(4)]
+    print('States requests allowed: {}'.format(allowed))
+    assert allowed == [True, True, False, False]
+    now[0] += 1.0
+    refilled = [admission.allow_message('10.0.0.2', 3) for _ in range(2)]
+    print('After one second: {}'.format(refilled))
+    assert refilled == [True, False]
+    loopback = all(admission.allow_message('127.0.0.1', 3) for _ in range(10))
+    print('Loopback is exempt: {}'.format(loopback))
+    assert loopback
+
+    # Buckets still draining are evicted least recently used first
+    for host in ['10.0.0.3', '10.0.0.4', '10.0.0.5']:
+        admission.allow_message(host, 3)
+    tracked = admission.status()['tracked_buckets']
+    print('Tracked Buckets: {} (limit 3)'.format(tracked))
+    assert tracked == 3
+    assert ('10.0.0.2', 3) not in admission.buckets
+    admission.allow_message('10.0.0.4', 3)
+    admission.allow_message('10.0.0.6', 3)
+    assert list(admission.buckets) == [('10.0.0.5', 3), ('10.0.0.4', 3), ('10.0.0.6', 3)]
+
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-admission-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            # A flood of states requests from one host over a simulated network.
+            # The server's clock never moves, so only the burst of 10 is served.
+            network = SimulatedNetwork()
+            server = Server(nonce='server', host='10.0.0.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.0.1'),
+                            admission=AdmissionControl(clock=lambda: 0.0),
+                            accounts_directory=os.path.join(directory, 'server', 'accounts'))
+            threading.Thread(target=server.start_server_listen, daemon=True).start()
+            assert network.wait_listening('10.0.0.1', 6969, timeout=10)
+            flooder = Server(nonce='flooder', host='10.0.0.9', port=6969, max_peers=0,
+                             transport=network.transport('10.0.0.9'),
+                             accounts_directory=os.path.join(directory, 'flooder', 'accounts'))
+            for _ in range(30):
+                flooder.connect_and_send('10.0.0.1', 6969, 'request', 3, {
+                    'version': 1, 'account': '0x69420', 'best_state': '0x4206996420'}, dispatch=False)
+            rate_limited = server.metrics.get('requests_rate_limited_total', flag=3)
+            print('Rate limited: {}'.format(rate_limited))
+            assert rate_limited == 20
+            server.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_admission()
@@ -0,0 +1,38 @@
+from bloom_filter import BloomFilter
+
+
+def test_bloom_filter(false_positive_rate=0.01):
+    known = ['10.0.{}.{}:6969'.format(i // 250, i % 250) for i in range(1000)]
+    known_filter = BloomFilter.for_capacity(len(known), false_positive_rate)
+    for address in known:
+        known_filter.add(address)
+
+    restored = BloomFilter.from_dict(known_filter.to_dict())
+    print('Size: {} bytes, {} hashes'.format(
+        len(known_filter.bits), known_filter.hash_count))
+    assert (restored.size, restored.hash_count, restored.bits) == \
+        (known_filter.size, known_filter.hash_count, known_filter.bits)
+    assert restored.to_dict() == known_filter.to_dict()
+
+    all_found = all(address in restored for address in known)
+    print('All Known Found: {}'.format(all_found))
+    assert all_found
+
+    false_positives = sum('10.1.{}.{}:6969'.format(i // 250, i % 250) in restored
+                          for i in range(10000))
+    print('False Positive Rate: {:.4f}'.format(false_positives / 10000))
+    assert false_positives / 10000 <= 2 * false_positive_rate
+
+    # A filter that does not match its own size is rejected
+    corrupted = known_filter.to_dict()
+    corrupted['size'] += 64
+    for data in [corrupted, {'size': 8, 'hashes': 1, 'bits': '!'}, {}]:
+        try:
+            BloomFilter.from_dict(data)
+        except ValueError:
+            continue
+        raise AssertionError('Invalid filter accepted: {}'.format(data))
+
+
+if __name__ == "__main__":
+    test_bloom_filter()
@@ -0,0 +1,92 @@
+from simulated_network import SimulatedNetwork
+from server import Server
+from peer import Peer
+import threading
+import tempfile
+import time
+import os
+
+
+def start_nodes(directory, count, transport=None, base_port=6969, host_format='10.0.0.{}'):
+    servers = []
+    deliveries = {}
+    for index in range(count):
+        host = host_format.format(index + 1)
+        port = base_port + index if transport is None else base_port
+        server = Server(nonce='node{}'.format(index), host=host, port=port, max_peers=0,
+                        transport=transport(host) if transport is not None else None,
+                        accounts_directory=os.path.join(directory, str(index), 'accounts'))
+        server.relay.add_handler('test', lambda data, index=index: deliveries.setdefault(
+            index, []).append(data['number']))
+        threading.Thread(target=server.start_server_listen, daemon=True).start()
+        servers.append(server)
+    return servers, deliveries
+
+
+def run_broadcasts(source, servers, deliveries, messages):
+    source.peers = {'{}:{}'.format(server.host, server.port): Peer(host=server.host, port=server.port)
+                    for server in servers}
+    # Nothing listens here, so the broadcast only partly succeeds
+    source.peers['{}:7399'.format(source.host)] = Peer(host=source.host, port=7399)
+
+    start_time = time.perf_counter()
+    results = [source.broadcaster.broadcast('request', 9, {'kind': 'test', 'data': {'number': number},
+                                                           'hops': 0, 'sender': 'source'})
+               for number in range(messages)]
+    completed = all(result.wait(30) for result in results)
+    while sum(len(numbers) for numbers in deliveries.values()) < len(servers) * messages \
+            and time.perf_counter() - start_time < 30:
+        time.sleep(0.05)
+
+    print('Completed: {}, Sent Per Message: {}, Failed: {}'.format(
+        completed, [len(result.sent) for result in results], results[0].failed))
+    assert completed
+    assert all(len(result.sent) == len(servers) for result in results)
+    assert list(results[0].failed) == ['{}:7399'.format(source.host)]
+    in_order = len(deliveries) == len(servers) and all(
+        numbers == list(range(messages)) for numbers in deliveries.values())
+    print('Delivered In Order Everywhere: {}'.format(in_order))
+    assert in_order
+    # One stream per peer carries every message
+    streams_opened = int(source.metrics.get('streams_opened_total'))
+    print('Streams Opened: {} (peers: {}), Broadcast Time: {:.3f} s'.format(
+        streams_opened, len(servers), time.perf_counter() - start_time))
+    assert streams_opened == len(servers)
+
+
+def test_broadcast(nodes=20, messages=5):
+    network = SimulatedNetwork(latency=0.005, bandwidth=2000000)
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-broadcast-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            print('Simulated Network ({} peers):'.format(nodes))
+            servers, deliveries = start_nodes(directory, nodes, transport=network.transport)
+            source = Server(nonce='source', host='10.0.1.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.1.1'),
+                            accounts_directory=os.path.join(directory, 'source', 'accounts'))
+            time.sleep(0.1)
+            run_broadcasts(source, servers, deliveries, messages)
+            print('Connections Made: {}'.format(network.connections))
+            assert network.connections == nodes
+            for server in servers + [source]:
+                server.shutdown = True
+
+            print('TCP With Event Loop (4 peers):')
+            servers, deliveries = start_nodes(os.path.join(directory, 'tcp'), 4, base_port=7420,
+                                              host_format='127.0.0.1')
+            source = Server(nonce='source', host='127.0.0.1', port=7419, max_peers=0,
+                            accounts_directory=os.path.join(directory, 'tcp', 'source', 'accounts'))
+            time.sleep(0.2)
+            run_broadcasts(source, servers, deliveries, messages)
+
+            for server in servers + [source]:
+                server.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_broadcast()
@@ -0,0 +1,115 @@
+from test_sync_engine import write_chain
+from chain_verifier import ChainVerifier
+from state import State
+import tempfile
+import random
+import time
+
+
+def test_chain_verifier(accounts=200, length=100):
+    with tempfile.TemporaryDirectory(prefix='lynx-verifier-') as directory:
+        chains = {}
+        for _ in range(accounts):
+            account = hex(random.getrandbits(160))
+            chains[account] = write_chain(directory, account, length)
+    verifier = ChainVerifier()
+
+    items = [(account, state) for account, chain in chains.items() for state in chain]
+    random.shuffle(items)
+    start_time = time.perf_counter()
+    results = verifier.verify_batch(items, lambda account, reference: None, lambda account: None)
+    valid = sum(result['valid'] for result in results.values())
+    print('Verified {} states of {} accounts in {:.3f} s, Valid: {}'.format(
+        len(items), accounts, time.perf_counter() - start_time, valid == len(items)))
+    assert valid == len(items)
+    assert len(results) == accounts
+
+    account, chain = next(iter(chains.items()))
+    tampered = list(chain)
+    tampered[50] = State(nonce='3', previous_reference=chain[49].current_reference,
+                         current_reference=chain[50].current_reference, balance=10)
+    result = verifier.verify_segment(account, tampered)
+    print('Nonce Regression: valid {}, first rejected {}'.format(
+        result['valid'], result['rejected'][0]['reason']))
+    assert result['valid'] == 50
+    assert result['rejected'][0]['reason'] == 'nonce'
+    assert all(item['reason'] == 'after_invalid' for item in result['rejected'][1:])
+    assert len(result['rejected']) == length - 50
+
+    tampered = list(chain)
+    tampered[20] = State(nonce='21', previous_reference='0x0',
+                         current_reference=chain[20].current_reference, balance=10)
+    result = verifier.verify_segment(account, tampered)
+    print('Broken Linkage: valid {}, first rejected {}'.format(
+        result['valid'], result['rejected'][0]['reason']))
+    assert result['valid'] == 20
+    assert result['rejected'][0]['reason'] == 'linkage'
+
+    fork = State(nonce='11', previous_reference=chain[9].current_reference,
+                 current_reference=hex(random.getrandbits(256)), balance=-5)
+    result = verifier.verify_account(account, chain + [fork],
+                                     lambda account, reference: None, lambda account: None)
+    print('Fork: valid {}, rejected {}'.format(result['valid'], result['rejected']))
+    assert result['valid'] == length
+    assert result['rejected'] == [{'reference': fork.current_reference, 'reason': 'fork'}]
+
+    stored = {state.current_reference: state for state in chain[:60]}
+
+    def lookup(account, reference):
+        return stored.get(reference)
+
+    def get_tip(account):
+        return chain[len(stored) - 1] if len(stored) > 0 else None
+
+    result = verifier.verify_account(account, chain[60:], lookup, get_tip)
+    print('Continues Stored Chain: {}'.format(result['valid'] == length - 60))
+    assert result['valid'] == length - 60
+    assert result['rejected'] == [] and result['orphaned'] == []
+    print('Rejected: {}'.format(verifier.metrics.snapshot()['counters'].get('states_rejected_total')))
+    assert verifier.metrics.get('states_rejected_total', reason='fork') == 1
+
+    # A second first state of a stored chain is a fork
+    restart = State(nonce='1', previous_reference='0x0', current_reference=hex(random.getrandbits(256)), balance=10)
+    result = verifier.verify_account(account, [restart], lookup, get_tip)
+    assert result['rejected'] == [{'reference': restart.current_reference, 'reason': 'fork'}]
+
+    # A segment whose predecessor is not stored is neither accepted nor rejected
+    result = verifier.verify_account(account, chain[70:], lookup, get_tip)
+    print('Orphaned Segment: valid {}, orphaned {}'.format(result['valid'], len(result['orphaned'])))
+    assert result['valid'] == 0 and result['rejected'] == []
+    assert result['orphaned'] == [state.current_reference for state in chain[70:]]
+
+    # filter() holds it until the missing states arrive
+    assert verifier.filter([(account, state) for state in chain[70:]], lookup, get_tip) == []
+    assert verifier.orphan_count == length - 70
+    released = verifier.filter([(account, state) for state in chain[60:70]], lookup, get_tip)
+    print('Released With Predecessor: {}'.format(len(released)))
+    assert sorted(int(state.nonce) for _, state in released) == list(range(61, length + 1))
+    assert verifier.orphan_count == 0
+
+    # States accepted but not stored yet are known to the next batch
+    verifier = ChainVerifier()
+    stored.clear()
+    assert len(verifier.filter([(account, state) for state in chain[:50]], lookup, get_tip)) == 50
+    assert len(verifier.filter([(account, state) for state in chain[50:]], lookup, get_tip)) == length - 50
+
+    # A new account's chain starts at its first nonce, later segments wait for their predecessor
+    verifier = ChainVerifier(max_orphans=15)
+    accepted = verifier.filter([(account, state) for state in chain[20:30] + chain[:10]], lookup, get_tip)
+    assert [state for _, state in accepted] == chain[:10]
+    assert verifier.orphan_count == 10
+    # Holding is bounded, the accounts held longest are dropped first
+    other = hex(random.getrandbits(160))
+    other_chain = [State(nonce=str(nonce), previous_reference=hex(random.getrandbits(256)),
+                         current_reference=hex(random.getrandbits(256)), balance=10) for nonce in range(1, 21)]
+    for previous, state in zip(other_chain, other_chain[1:]):
+        state.previous_reference = previous.current_reference
+    verifier.filter([(other, state) for state in other_chain[10:] + other_chain[:5]], lookup, get_tip)
+    print('Orphans Held: {}, Dropped: {}'.format(
+        verifier.orphan_count, int(verifier.metrics.get('states_orphans_dropped_total'))))
+    assert verifier.orphan_count == 10 and list(verifier.orphans) == [other]
+    assert verifier.metrics.get('states_orphans_dropped_total') == 10
+
+
+if __name__ == "__main__":
+    test_chain_verifier()
@@ -0,0 +1,140 @@
+from simulated_network import SimulatedNetwork
+from admission import AdmissionControl
+from deadline import Deadline, DeadlineExceeded, OperationCancelled
+from server import Server
+import threading
+import tempfile
+import socket
+import time
+import os
+
+
+def timed_request(server, host, port, **kwargs):
+    start_time = time.perf_counter()
+    replies = server.connect_and_send(host, port, 'request', 3, {}, dispatch=False, **kwargs)
+    return replies, time.perf_counter() - start_time
+
+
+def cancel_after(seconds, cancel, server, host, port, **kwargs):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(timed_request(server, host, port, **kwargs)))
+    thread.start()
+    time.sleep(seconds)
+    cancel_time = time.perf_counter()
+    cancel()
+    thread.join(5)
+    return not thread.is_alive(), time.perf_counter() - cancel_time
+
+
+def test_deadline():
+    parent = Deadline(1.0)
+    child = parent.child(60.0)
+    grandchild = child.child()
+    print('Child Bound By Parent: {}'.format(child.remaining() <= 1.0))
+    assert child.remaining() <= 1.0
+    parent.cancel()
+    try:
+        grandchild.check()
+        assert False, 'cancelled deadline did not raise'
+    except OperationCancelled:
+        print('Cancel Reaches Grandchild: True')
+    try:
+        Deadline(0).check()
+        assert False, 'expired deadline did not raise'
+    except DeadlineExceeded:
+        print('Expired Deadline Raises: True')
+    assert Deadline().remaining() is None and not Deadline().done()
+
+    network = SimulatedNetwork(latency=0.005)
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-deadline-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            # Accepts connections and never answers
+            hung_listener = network.transport('10.0.0.9').listen('', 6969, backlog=32)
+            client = Server(nonce='client', host='10.0.1.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.1.1'), request_timeout=0.5,
+                            accounts_directory=os.path.join(directory, 'client', 'accounts'))
+
+            replies, seconds = timed_request(client, '10.0.0.9', 6969)
+            print('Hung Peer: {} replies after {:.2f} s, timed out: {}'.format(
+                len(replies), seconds, int(client.metrics.get('requests_timed_out_total', flag=3))))
+            assert len(replies) == 0 and 0.4 < seconds < 2.0
+            assert client.metrics.get('requests_timed_out_total', flag=3) == 1
+
+            deadline = client.root_deadline.child()
+            released, seconds = cancel_after(0.2, deadline.cancel, client, '10.0.0.9', 6969,
+                                             timeout=30, deadline=deadline)
+            print('Cancelled Request Released: {} in {:.3f} s'.format(released, seconds))
+            assert released and seconds < 1.0
+
+            threads = [threading.Thread(target=timed_request, args=(client, '10.0.0.9', 6969),
+                                        kwargs={'timeout': 30}) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+            client.cancel_requests()
+            for thread in threads:
+                thread.join(5)
+            print('cancel_requests Released {} Of 5, Cancelled: {}'.format(
+                sum(not thread.is_alive() for thread in threads),
+                int(client.metrics.get('requests_cancelled_total', flag=3))))
+            assert not any(thread.is_alive() for thread in threads)
+            assert client.metrics.get('requests_cancelled_total', flag=3) == 6
+
+            # A client trickling a byte at a time is dropped after read_timeout
+            server = Server(nonce='server', host='10.0.2.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.2.1'),
+                            admission=AdmissionControl(read_timeout=1.0, idle_timeout=1.0),
+                            accounts_directory=os.path.join(directory, 'server', 'accounts'))
+            threading.Thread(target=server.start_server_listen, daemon=True).start()
+            time.sleep(0.1)
+            trickle = network.transport('10.0.3.1').connect('10.0.2.1', 6969)
+            start_time = time.perf_counter()
+            dropped_after = None
+            for byte in b'{"type": "request", "flag": 3, "data": {}':
+                try:
+                    trickle.send(bytes((byte,)))
+                except OSError:
+                    break
+                trickle.settimeout(0.3)
+                try:
+                    if trickle.recv(1) == b'':
+                        dropped_after = time.perf_counter() - start_time
+                        break
+                except socket.timeout:
+                    pass
+            print('Slow Sender Dropped After: {} s, Timed Out: {}'.format(
+                None if dropped_after is None else round(dropped_after, 1),
+                int(server.metrics.get('connections_timed_out_total'))))
+            assert dropped_after is not None and dropped_after < 3.0
+            assert server.metrics.get('connections_timed_out_total') == 1
+            server.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+    # Real sockets: shutdown() must wake a thread blocked in recv
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(5)
+    port = listener.getsockname()[1]
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-deadline-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            client = Server(nonce='client', host='127.0.0.1', port=port + 1, max_peers=0,
+                            accounts_directory=os.path.join(directory, 'accounts'))
+            released, seconds = cancel_after(0.2, client.cancel_requests, client, '127.0.0.1', port, timeout=30)
+            print('TCP Cancelled Request Released: {} in {:.3f} s'.format(released, seconds))
+            assert released and seconds < 1.0
+        finally:
+            os.chdir(working_directory)
+    listener.close()
+
+
+if __name__ == "__main__":
+    test_deadline()
@@ -0,0 +1,79 @@
+from admission import AdmissionControl
+from server import Server
+import threading
+import tempfile
+import socket
+import time
+import os
+
+
+def wait_until(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_event_loop(idle_connections=200, read_timeout=2.0):
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-event-loop-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            server = Server(nonce='event-loop', host='127.0.0.1', port=6965, max_peers=0,
+                            admission=AdmissionControl(max_connections=1000, read_timeout=read_timeout),
+                            accounts_directory=os.path.join(directory, 'server', 'accounts'))
+            client = Server(nonce='client', host='127.0.0.1', port=6966, max_peers=0,
+                            accounts_directory=os.path.join(directory, 'client', 'accounts'))
+            threading.Thread(target=server.start_server_listen,
+                             name='Server Thread', daemon=True).start()
+            assert wait_until(lambda: server.account_tree_loaded, 10)
+
+            # Silent clients hold a connection but no thread
+            threads = threading.active_count()
+            opened_at = time.monotonic()
+            idle_sockets = [socket.create_connection(('127.0.0.1', 6965))
+                            for _ in range(idle_connections)]
+            assert wait_until(lambda: server.admission.connections == idle_connections, 10)
+            print('Open Connections: {}, Threads: {} (before {})'.format(
+                server.admission.connections, threading.active_count(), threads))
+            assert threading.active_count() < threads + idle_connections // 10
+
+            # Requests are dispatched while the idle connections are open
+            start_time = time.perf_counter()
+            replies = [client.connect_and_send('127.0.0.1', 6965, 'request', 3, {
+                'version': 1, 'account': '0x69420', 'best_state': '0x4206996420'}, dispatch=False)
+                for _ in range(100)]
+            print('100 States Requests: {:.1f} ms'.format(
+                (time.perf_counter() - start_time) * 1000))
+            received = server.metrics.get('messages_received_total', type='request', flag=3)
+            print('Requests Received: {}, Replied: {}'.format(
+                received, sum(1 for reply in replies if len(reply) > 0)))
+            assert received == 100
+            assert all(len(reply) > 0 for reply in replies)
+            assert server.metrics.get('connections_timed_out_total') == 0
+
+            # The read deadline timer drops every silent connection, and not before it expires
+            assert wait_until(lambda: server.admission.connections == 0, read_timeout + 10)
+            dropped_after = time.monotonic() - opened_at
+            timed_out = server.metrics.get('connections_timed_out_total')
+            print('After Read Deadline: {} open, {} timed out after {:.1f} s'.format(
+                server.admission.connections, timed_out, dropped_after))
+            assert timed_out == idle_connections
+            assert dropped_after >= read_timeout
+
+            # The server closed them, so each client reads the end of the stream
+            for idle_socket in idle_sockets:
+                idle_socket.settimeout(5)
+                assert idle_socket.recv(1) == b''
+                idle_socket.close()
+            server.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_event_loop()
@@ -0,0 +1,97 @@
+from inventory_reference import InventoryReference, ReferenceArray, RECORD_SIZE, encode_inventory, decode_inventory, pack_item, pack_items
+from inventory import Inventory
+from message import Message
+import tracemalloc
+import random
+import time
+import json
+
+
+def test_inventory_reference(count=1000000):
+    items = ['0x0000000000000000000000000000000000000abc/0x00ff',
+             '0x69420/0x4206996420',
+             '0xE48a817DeaE16d9393d9a55F81470577A2987746/0x123456789',
+             'lynx-genesis/0x1']
+    references = [InventoryReference.from_item(item) for item in items]
+    print('Record Size: {} bytes'.format(RECORD_SIZE))
+    round_trips = [reference.to_item() for reference in references] == items
+    print('Round Trips: {}'.format(round_trips))
+    assert round_trips
+    hashable = InventoryReference.pack('0x69420', '0x4206996420') in set(references)
+    print('Equal And Hashable: {}'.format(hashable))
+    assert hashable
+    try:
+        InventoryReference.from_item('not an item')
+        assert False, 'malformed item was packed'
+    except ValueError:
+        print('Malformed Item Rejected: True')
+
+    # Items that cannot be packed are kept as strings rather than dropped
+    unpackable = ['0x69420/' + '0' * 63 + 'a', '0x69420/0x' + 'AB' * 32,
+                  '1BoatSLRHtKNngkdXEeobR76b53LETtpyT/0x123456789']
+    assert all(pack_item(*item.split('/')) == item for item in unpackable)
+    assert pack_item('0x69420', '0x4206996420') == references[1]
+    inventory = Inventory(items + unpackable, packed=True)
+    batch = inventory.get_batch(10)
+    print('Unpackable Items Kept: {}'.format([str(item) for item in batch] == items + unpackable))
+    assert [str(item) for item in batch] == items + unpackable
+    assert len(inventory) == 0
+
+    wire = encode_inventory(references)
+    wire_round_trip = decode_inventory(wire) == references
+    print('Wire Round Trip: {} ({} chars vs {} as a JSON list)'.format(
+        wire_round_trip, len(wire), len(json.dumps(items))))
+    assert wire_round_trip
+
+    array = ReferenceArray(references)
+    array.extend(references)
+    fifo = array.take(len(references) + 1) == references + references[:1]
+    print('FIFO Order: {}, Left: {}'.format(fifo, len(array)))
+    assert fifo and len(array) == len(references) - 1
+
+    pairs = [(hex(random.getrandbits(160)), hex(random.getrandbits(256))) for _ in range(count)]
+    tracemalloc.start()
+    items = ['{}/{}'.format(account, reference) for account, reference in pairs]
+    string_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start_time = time.perf_counter()
+    references = [InventoryReference.from_item(item) for item in items]
+    print('Packed {} items in {:.2f} s'.format(count, time.perf_counter() - start_time))
+    start_time = time.perf_counter()
+    packed, rest = pack_items(items)
+    print('Packed {} items as one batch in {:.2f} s'.format(count, time.perf_counter() - start_time))
+    assert packed == b''.join(references) and rest == []
+
+    # Checksummed accounts keep the case of every digit
+    checksummed = ['0x' + ''.join(random.choice('0123456789abcdefABCDEF') for _ in range(40)) + '/' + reference
+                   for _, reference in pairs[:1000]]
+    packed, rest = pack_items(checksummed)
+    assert rest == []
+    array = ReferenceArray()
+    array.extend_packed(packed)
+    assert [reference.to_item() for reference in array] == checksummed
+
+    tracemalloc.start()
+    array = ReferenceArray(references)
+    array_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('Bytes Per Item: list of strings {:.1f}, ReferenceArray {:.1f}'.format(
+        string_bytes / count, array_bytes / count))
+    assert len(array) == count
+    unpacked_match = all(reference.to_item() == item for reference, item in zip(array.take(1000), items))
+    print('Unpacked Match: {}'.format(unpacked_match))
+    assert unpacked_match
+
+    batch = references[:500]
+    list_JSON = Message('request', 4, {'inventory_count': 500, 'inventory': [
+                        reference.to_item() for reference in batch]}).to_JSON()
+    packed_JSON = Message('request', 4, {'inventory_count': 500,
+                                         'inventory': encode_inventory(batch)}).to_JSON()
+    print('Data Request Of 500: {} bytes as a list, {} bytes encoded'.format(
+        len(list_JSON), len(packed_JSON)))
+    assert len(packed_JSON) < len(list_JSON)
+
+
+if __name__ == "__main__":
+    test_inventory_reference()
@@ -0,0 +1,61 @@
+from key_pool import KeyPool
+import time
+
+MNEMONIC = ' '.join(['abandon'] * 11 + ['about'])
+# m/44'/60'/0'/0/0 and m/44'/60'/0'/0/1 of MNEMONIC without a passphrase
+KNOWN_ACCOUNTS = [
+    ('1ab42cc412b618bdea3a599e3c9bae199ebf030895b039e9db1e30dafb12b727',
+     '0237b0bb7a8288d38ed49a524b5dc98cff3eb5ca824c9f9dc0dfdb3d9cd600f299',
+     '0x9858EfFD232B4033E47d90003D41EC34EcaEda94'),
+    ('9a983cb3d832fbde5ab49d692b7a8bf5b5d232479c99333d0fc8e1d21f1b55b6',
+     '039fd0991d0222b4e1339c1a1a5b5f6d9f6a96672a3247b638ee6156d9ea877a2f',
+     '0x6Fac4D18c912343BF86fa7049364Dd4E424Ab9C0'),
+]
+
+
+def wait_for_size(key_pool: KeyPool, size: int, timeout: float = 30) -> bool:
+    deadline = time.monotonic() + timeout
+    while len(key_pool) < size:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_key_pool():
+    # Derivation matches the BIP44 test vector
+    key_pool = KeyPool(size=0, mnemonic=MNEMONIC, background=False)
+    for index, (private_key, public_key, address) in enumerate(KNOWN_ACCOUNTS):
+        account = key_pool.derive(index)
+        print('m/44\'/60\'/0\'/0/{}: {}'.format(index, account.address))
+        assert account.priv_key.lower().replace('0x', '') == private_key
+        assert account.pub_key.lower().replace('0x', '') == public_key
+        assert account.address == address
+    # Without a background thread accounts are derived on demand, in order
+    assert key_pool.get().address == KNOWN_ACCOUNTS[0][2]
+    assert [account.address for account in key_pool.get_batch(1)] == [KNOWN_ACCOUNTS[1][2]]
+
+    # The pool fills up, hands out precomputed accounts and refills
+    key_pool = KeyPool(size=50, mnemonic=MNEMONIC)
+    assert wait_for_size(key_pool, 50)
+    print('Precomputed Accounts: {}'.format(len(key_pool)))
+    assert [account.address for account in key_pool.get_batch(2)] == \
+        [address for _, _, address in KNOWN_ACCOUNTS]
+
+    start_time = time.time()
+    accounts = key_pool.get_batch(1000)
+    print('Derived {} accounts in {:.2f}s'.format(
+        len(accounts), time.time() - start_time))
+    assert len(accounts) == 1000
+    assert len(set(account.address for account in accounts)) == len(accounts)
+
+    refilled = wait_for_size(key_pool, 50)
+    print('Refilled: {}'.format(refilled))
+    assert refilled
+    handed_out = set(account.address for account in accounts)
+    assert not any(account.address in handed_out for account in key_pool.get_batch(50))
+    key_pool.close()
+
+
+if __name__ == "__main__":
+    test_key_pool()
@@ -0,0 +1,70 @@
+from local_states import LocalStates
+from state_store import StateStore
+from state import State
+import tempfile
+import random
+import os
+
+
+def test_local_states(accounts=50, states=20):
+    with tempfile.TemporaryDirectory(prefix='lynx-local-states-') as directory:
+        inventory = []
+        for _ in range(accounts):
+            account = hex(random.getrandbits(160))
+            state_path = os.path.join(directory, account, 'states')
+            os.makedirs(state_path)
+            for nonce in range(states):
+                reference = hex(random.getrandbits(256))
+                state = State(nonce=str(nonce), previous_reference='0x0',
+                              current_reference=reference, balance=100)
+                with open(os.path.join(state_path, 'state{}.dat'.format(nonce)), 'w') as state_file:
+                    state_file.write(state.to_JSON())
+                inventory.append('{}/{}'.format(account, reference))
+
+        store = StateStore(directory)
+        local_states = LocalStates(directory, store)
+        announced = inventory + ['0x1/{}'.format(hex(random.getrandbits(256)))
+                                 for _ in range(10)]
+        missing = local_states.missing(announced)
+        print('Stored: {}, Announced: {}, Missing: {}'.format(
+            len(inventory), len(announced), len(missing)))
+        assert missing == announced[len(inventory):]
+        parsed = local_states.refresh()
+        print('Accounts Parsed On Refresh: {}'.format(parsed))
+        assert parsed == 0
+
+        # States written through the store are recorded without parsing the account again
+        account = inventory[0].split('/')[0]
+        written = State(nonce=str(states), previous_reference='0x0',
+                        current_reference=hex(random.getrandbits(256)), balance=100)
+        store.put(account, written)
+        stored = '{}/{}'.format(account, written.current_reference)
+        parsed = local_states.refresh()
+        print('Stored State Seen: {}, Accounts Parsed On Refresh: {}'.format(stored in local_states, parsed))
+        assert stored in local_states and parsed == 0
+
+        # Another process writes a state and announces it through the store
+        state = State(nonce=str(states + 1), previous_reference='0x0',
+                      current_reference=hex(random.getrandbits(256)), balance=100)
+        state_path = os.path.join(directory, account, 'states')
+        with open(os.path.join(state_path, '{}.dat'.format(state.current_reference)), 'w') as state_file:
+            state_file.write(state.to_JSON())
+        external = '{}/{}'.format(account, state.current_reference)
+        store.notify([[account, state.current_reference]])
+        print('Announced Write Seen: {}'.format(external in local_states))
+        assert external in local_states
+
+        # Anything else is picked up by an explicit refresh
+        state = State(nonce=str(states + 2), previous_reference='0x0',
+                      current_reference=hex(random.getrandbits(256)), balance=100)
+        with open(os.path.join(state_path, 'external.dat'), 'w') as state_file:
+            state_file.write(state.to_JSON())
+        os.utime(state_path, ns=(0, os.stat(state_path).st_mtime_ns + 1))
+        external = '{}/{}'.format(account, state.current_reference)
+        assert external not in local_states
+        parsed = local_states.refresh()
+        print('External Write Seen After Refresh: {}'.format(external in local_states))
+        assert parsed == 1 and external in local_states
+
+if __name__ == "__main__":
+    test_local_states()
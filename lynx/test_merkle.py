@@ -0,0 +1,80 @@
+from simulated_network import SimulatedNetwork
+from test_sync_engine import write_chain
+from merkle import MerkleAccumulator
+from state import State
+from server import Server
+import threading
+import tempfile
+import random
+import shutil
+import time
+import os
+
+
+def test_merkle(accounts=2000, changed=5, length=3):
+    tree = MerkleAccumulator()
+    other = MerkleAccumulator()
+    for index in range(accounts):
+        tree.set_tip('account{}'.format(index), 'tip{}'.format(index))
+        other.set_tip('account{}'.format(index), 'tip{}'.format(index))
+    other.set_tip('account7', 'tip7b')
+    other.set_tip('account{}'.format(accounts), 'tip')
+    print('Roots Match Before: {}'.format(tree.root() == other.root()))
+    assert tree.root() != other.root()
+    other.set_tip('account{}'.format(accounts), None)
+    other.set_tip('account7', 'tip7')
+    print('Roots Match After: {}'.format(tree.root() == other.root()))
+    assert tree.root() == other.root()
+
+    network = SimulatedNetwork(latency=0.02, bandwidth=2000000)
+    with tempfile.TemporaryDirectory(prefix='lynx-merkle-') as directory:
+        # Each node keeps its tip index next to its accounts directory
+        source_directory = os.path.join(directory, 'source', 'accounts')
+        target_directory = os.path.join(directory, 'target', 'accounts')
+        account_references = [hex(random.getrandbits(160)) for _ in range(accounts)]
+        for account in account_references:
+            write_chain(source_directory, account, length)
+        shutil.copytree(source_directory, target_directory)
+
+        # Servers keep their known peers in '..', so they run from a directory of their own
+        working_directory = os.getcwd()
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            # The source moves ahead on a few accounts and gains a new one
+            changed_accounts = random.sample(account_references, changed)
+            new_account = hex(random.getrandbits(160))
+            write_chain(source_directory, new_account, length)
+            source = Server(nonce='source', host='10.0.0.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.0.1'), accounts_directory=source_directory)
+            for account in changed_accounts:
+                tip = source.state_store.get_tip(account)
+                source.state_store.put(account, State(nonce=str(length + 1), previous_reference=tip.current_reference,
+                                                      current_reference=hex(random.getrandbits(256)), balance=0))
+            threading.Thread(target=source.start_server_listen, daemon=True).start()
+
+            target = Server(nonce='target', host='10.0.1.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.1.1'), accounts_directory=target_directory)
+            time.sleep(0.1)
+
+            start_time = time.perf_counter()
+            differing = target.find_differing_accounts('10.0.0.1', 6969)
+            print('Found {} differing accounts out of {} in {:.2f} s ({} merkle requests)'.format(
+                len(differing), accounts, time.perf_counter() - start_time,
+                int(target.metrics.get('merkle_requests_total'))))
+            print('Differences Correct: {}'.format(
+                sorted(differing) == sorted(changed_accounts + [new_account])))
+            assert sorted(differing) == sorted(changed_accounts + [new_account])
+
+            # The target's tree follows the states the sync stores
+            target.sync_changed_accounts('10.0.0.1', 6969)
+            print('Roots Match After Sync: {}'.format(
+                target.get_account_tree().root() == source.get_account_tree().root()))
+            assert target.get_account_tree().root() == source.get_account_tree().root()
+            source.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_merkle()
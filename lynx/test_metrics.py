@@ -0,0 +1,114 @@
+from metrics import Metrics, MetricsEndpoint
+from peer_connection import MAX_MESSAGE_SIZE
+from node import Node
+from urllib.request import urlopen
+import threading
+import tempfile
+import socket
+import time
+import os
+
+
+def test_registry():
+    metrics = Metrics()
+    metrics.inc('messages_sent_total', type='request', flag=3)
+    metrics.inc('messages_sent_total', 2, flag=3, type='request')
+    metrics.inc('messages_sent_total', type='response', flag=3)
+    depth = [7]
+    metrics.register_gauge('inventory_depth', lambda: depth[0])
+    metrics.register_gauge('states_in_flight', lambda: {'10.0.0.2:6969': 4}, label='peer')
+    metrics.register_gauge('broken', lambda: 1 / 0)
+
+    assert metrics.get('messages_sent_total', type='request', flag=3) == 3
+    assert metrics.get('messages_sent_total', type='request', flag=4) == 0
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['messages_sent_total'] == [
+        {'labels': {'flag': 3, 'type': 'request'}, 'value': 3},
+        {'labels': {'flag': 3, 'type': 'response'}, 'value': 1}]
+    depth[0] = 9
+    assert metrics.snapshot()['gauges']['inventory_depth'] == [{'labels': {}, 'value': 9}]
+    assert 'broken' not in snapshot['gauges']
+
+    text = metrics.to_text()
+    print(text)
+    assert text == '\n'.join([
+        '# TYPE lynx_messages_sent_total counter',
+        'lynx_messages_sent_total{flag="3",type="request"} 3',
+        'lynx_messages_sent_total{flag="3",type="response"} 1',
+        '# TYPE lynx_inventory_depth gauge',
+        'lynx_inventory_depth 9',
+        '# TYPE lynx_states_in_flight gauge',
+        'lynx_states_in_flight{peer="10.0.0.2:6969"} 4']) + '\n'
+
+    # The endpoint serves the same text and releases its port when stopped
+    endpoint = MetricsEndpoint(metrics, port=0)
+    port = endpoint.http_server.server_address[1]
+    endpoint.start()
+    try:
+        with urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=5) as response:
+            assert response.status == 200
+            assert response.read().decode() == metrics.to_text()
+    finally:
+        endpoint.stop()
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+        raise AssertionError('Metrics endpoint still accepting after stop()')
+    except ConnectionRefusedError:
+        pass
+
+
+def test_metrics():
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-metrics-') as directory:
+        # The node keeps its data in '..', so it is run from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            node = Node(server_host='127.0.0.1', server_port='6967')
+            server_thread = threading.Thread(
+                target=node.server.start_server_listen, args=[], name=('Server Thread'), daemon=True)
+            server_thread.start()
+            while not node.server.account_tree_loaded:
+                time.sleep(0.05)
+
+            node.server.connect_and_send('127.0.0.1', 6967, 'request', 3, {
+                'version': 1, 'account': '0x69420', 'best_state': '0x4206996420'})
+            stats = node.server.send_stats_request(port=6967)
+            print('Counters: {}'.format(stats['counters']))
+            print('Gauges: {}'.format(stats['gauges']))
+            received = {(item['labels']['type'], item['labels']['flag']): item['value']
+                        for item in stats['counters']['messages_received_total']}
+            # Both ends share the registry: the request and its reply were counted
+            assert received[('request', 3)] == 1 and received[('response', 3)] == 1
+            assert received[('request', 6)] == 1
+            assert stats['gauges']['peers'][0]['value'] == len(node.server.peers)
+
+            # A peer that never finishes its message is dropped once it passes the cap
+            flood = socket.create_connection(('127.0.0.1', 6967))
+            flood.settimeout(10)
+            try:
+                flood.sendall(b'{"type": "request", "flag": 3, "data": "' + b'a' * (MAX_MESSAGE_SIZE + 1))
+                dropped = flood.recv(1) == b''
+            except ConnectionResetError:
+                dropped = True
+            flood.close()
+            print('Oversized Message Dropped: {}'.format(dropped))
+            assert dropped
+            assert node.server.metrics.get('messages_oversized_total') == 1
+
+            endpoint = node.server.start_metrics_endpoint(port=9469)
+            try:
+                with urlopen('http://127.0.0.1:9469/metrics', timeout=5) as response:
+                    text = response.read().decode()
+                assert 'lynx_messages_received_total{flag="3",type="request"} 1' in text
+                assert 'lynx_messages_oversized_total 1' in text
+            finally:
+                endpoint.stop()
+            node.server.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_registry()
+    test_metrics()
@@ -0,0 +1,63 @@
+from node import Node
+from profiler import PROFILER, Profiler
+import profiler
+import threading
+import tempfile
+import time
+import os
+
+
+def test_profiler():
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-profiler-') as directory:
+        PROFILER.output_directory = os.path.join(directory, 'profiles')
+        # The node keeps its data in '..', so it is run from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            node = Node(server_host='127.0.0.1', server_port='6966')
+            server_thread = threading.Thread(
+                target=node.server.start_server_listen, args=[], name=('Server Thread'), daemon=True)
+            server_thread.start()
+            time.sleep(0.5)
+
+            print('Started: {}'.format(node.server.send_profile_request('start', port=6966)))
+            for _ in range(20):
+                node.server.connect_and_send('127.0.0.1', 6966, 'request', 3, {
+                    'version': 1, 'account': '0x69420', 'best_state': '0x4206996420'})
+            status = node.server.send_profile_request('stop', port=6966)
+            print('Stopped: {}'.format(status))
+            assert status['path'].startswith(PROFILER.output_directory)
+
+            with open(status['path'], 'r') as report_file:
+                print(report_file.read())
+            node.server.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+        # Python 3.12+ refuses a second active profiler; the section is then only timed
+        class BusyProfile:
+            def enable(self):
+                raise ValueError('Another profiling tool is already active')
+
+        section_profiler = Profiler(output_directory=os.path.join(directory, 'busy'))
+        profile_class, profiler.cProfile.Profile = profiler.cProfile.Profile, BusyProfile
+        try:
+            section_profiler.start()
+            for _ in range(2):
+                with section_profiler.section('busy'):
+                    pass
+        finally:
+            profiler.cProfile.Profile = profile_class
+        with section_profiler.section('profiled'):
+            sum(range(1000))
+        assert section_profiler.sections['busy'][0] == 2
+        with open(section_profiler.stop(), 'r') as report_file:
+            report = report_file.read()
+        print('Timed Only When Busy: {}'.format('only timed (another profiler was active): 2' in report))
+        assert 'only timed (another profiler was active): 2' in report
+        assert '==== profiled ====' in report
+
+
+if __name__ == "__main__":
+    test_profiler()
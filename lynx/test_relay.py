@@ -0,0 +1,78 @@
+from simulated_network import SimulatedNetwork
+from seen_cache import SeenCache
+from server import Server
+from peer import Peer
+import threading
+import tempfile
+import time
+import os
+
+
+def test_relay(nodes=12):
+    clock = [0.0]
+    cache = SeenCache(ttl=10, max_entries=3, clock=lambda: clock[0])
+    first_add, second_add = cache.add('a', 'peer1'), cache.add('a', 'peer2')
+    print('First Add: {}, Second Add: {}'.format(first_add, second_add))
+    assert first_add and not second_add
+    unknown = cache.claim_unknown('a', ['peer1', 'peer2', 'peer3'])
+    print('Unknown Peers: {}'.format(unknown))
+    assert unknown == ['peer3']
+    clock[0] = 11
+    expired = 'a' not in cache and cache.add('a')
+    print('Expired: {}'.format(expired))
+    assert expired
+
+    network = SimulatedNetwork(latency=0.01, bandwidth=2000000)
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-relay-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            servers = []
+            deliveries = {}
+            for index in range(nodes):
+                host = '10.0.0.{}'.format(index + 1)
+                server = Server(nonce='node{}'.format(index), host=host, port=6969, max_peers=0,
+                                transport=network.transport(host), relay=True,
+                                accounts_directory=os.path.join(directory, str(index), 'accounts'))
+                server.relay.add_handler('test', lambda data, host=host: deliveries.__setitem__(
+                    host, deliveries.get(host, 0) + 1))
+                threading.Thread(target=server.start_server_listen, daemon=True).start()
+                servers.append(server)
+
+            # Full mesh: every node relays to every other node
+            for server in servers:
+                server.peers = {'{}:6969'.format(other.host): Peer(host=other.host, port=6969, relay=True)
+                                for other in servers if other is not server}
+            time.sleep(0.1)
+
+            start_time = time.perf_counter()
+            sent = servers[0].relay.broadcast('test', {'hello': 'mesh'})
+            expected_deliveries = nodes - 1
+            while sum(deliveries.values()) < expected_deliveries and time.perf_counter() - start_time < 30:
+                time.sleep(0.05)
+            time.sleep(0.5)
+
+            forwards = sum(server.metrics.get('relay_forwards_total') for server in servers)
+            duplicates = sum(server.metrics.get('relay_messages_total', result='duplicate') for server in servers)
+            delivered_once = len(deliveries) == expected_deliveries and set(deliveries.values()) == {1}
+            print('Sent: {}, Delivered Once Everywhere: {}'.format(sent, delivered_once))
+            assert sent == nodes - 1
+            assert delivered_once
+            print('Forwards: {} (mesh links: {}), Duplicates Dropped: {}'.format(
+                int(forwards), nodes * (nodes - 1), int(duplicates)))
+            # No node sends a message back to a peer it already had it from
+            assert forwards < nodes * (nodes - 1)
+            assert duplicates == forwards - expected_deliveries
+            rebroadcast = servers[0].relay.broadcast('test', {'hello': 'mesh'})
+            print('Rebroadcast Of Seen Message: {}'.format(rebroadcast))
+            assert rebroadcast == 0
+            for server in servers:
+                server.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_relay()
@@ -0,0 +1,139 @@
+from simulated_network import SimulatedNetwork, SimulatedClock
+from server import Server
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import tempfile
+import socket
+import time
+import os
+
+
+def test_links():
+    # With a manual clock nothing is delivered before the link latency has passed
+    network = SimulatedNetwork(latency=0.1, clock=SimulatedClock(manual=True), seed=1)
+    listener = network.listen('10.0.0.1', 6969, 5)
+    connections = []
+    connecting = threading.Thread(target=lambda: connections.append(
+        network.connect('10.0.0.2', '10.0.0.1', 6969)))
+    connecting.start()
+    assert network.wait_listening('10.0.0.1', 6969)
+    while len(connections) == 0:
+        # Connecting takes one round trip
+        network.clock.advance(0.1)
+        connecting.join(0.05)
+    client = connections[0]
+    server_side, _ = listener.accept()
+    server_side.settimeout(0)
+
+    client.send(b'lynx')
+    network.clock.advance(0.099)
+    try:
+        server_side.recv(1024)
+        raise AssertionError('Delivered before the link latency')
+    except socket.timeout:
+        pass
+    network.clock.advance(0.001)
+    assert server_side.recv(1024) == b'lynx'
+    print('Latency: delivered after 100 ms (virtual)')
+
+    # Lost segments are delivered one retransmit timeout later
+    network.set_link('10.0.0.3', '10.0.0.1', loss=0.5, retransmit_timeout=0.2)
+    lost_connections = []
+    for _ in range(200):
+        client = network.connect('10.0.0.3', '10.0.0.1', 6969)
+        server_side, _ = listener.accept()
+        server_side.settimeout(0)
+        client.send(b'x')
+        try:
+            server_side.recv(1)
+        except socket.timeout:
+            lost_connections.append(server_side)
+    print('Loss: {} of 200 delayed'.format(len(lost_connections)))
+    assert 60 <= len(lost_connections) <= 140
+    network.clock.advance(10)
+    assert all(server_side.recv(1) == b'x' for server_side in lost_connections)
+
+    # Timeouts are virtual too: 60 s at 1000 times real time take 60 ms
+    network = SimulatedNetwork(clock=SimulatedClock(speed=1000))
+    listener = network.listen('10.0.0.1', 6969, 5)
+    listener.settimeout(60)
+    start_time = time.perf_counter()
+    try:
+        listener.accept()
+        raise AssertionError('Accepted without a connection')
+    except socket.timeout:
+        pass
+    client = network.connect('10.0.0.2', '10.0.0.1', 6969)
+    server_side, _ = listener.accept()
+    server_side.settimeout(60)
+    virtual_start = network.clock.now()
+    try:
+        server_side.recv(1)
+        raise AssertionError('Received without data')
+    except socket.timeout:
+        pass
+    elapsed = time.perf_counter() - start_time
+    print('Timeouts: 2 x 60 s (virtual) in {:.2f} s'.format(elapsed))
+    assert network.clock.now() - virtual_start >= 60
+    assert elapsed < 5
+
+
+def test_simulated_network(number_of_nodes=100, latency=0.05):
+    # 50 ms links with 1% loss, running 20 times faster than real time
+    network = SimulatedNetwork(latency=latency, jitter=0.01, bandwidth=1000000,
+                               loss=0.01, clock=SimulatedClock(speed=20), seed=1)
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-simulated-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            servers = []
+            for index in range(number_of_nodes):
+                host = '10.0.{}.{}'.format(index // 250, index % 250 + 1)
+                server = Server(nonce=str(index), host=host, port=6969, max_peers=0,
+                                transport=network.transport(host),
+                                accounts_directory=os.path.join(directory, str(index), 'accounts'))
+                threading.Thread(target=server.start_server_listen,
+                                 name='Server Thread ({})'.format(host), daemon=True).start()
+                servers.append(server)
+
+            seed = servers[0]
+            assert network.wait_listening(seed.host, seed.port, timeout=10)
+            handshake_times = []
+            replies = []
+
+            def handshake(server):
+                start_time = network.clock.now()
+                replies.append(server.connect_and_send(seed.host, seed.port, 'request', 1,
+                                                       server.make_version_message('{}:{}'.format(seed.host, seed.port)), dispatch=False))
+                handshake_times.append(network.clock.now() - start_time)
+
+            with ThreadPoolExecutor(max_workers=32) as executor:
+                list(executor.map(handshake, servers[1:]))
+
+            handshake_times.sort()
+            print('Nodes: {}'.format(number_of_nodes))
+            print('Seed Peers: {}'.format(len(seed.peers)))
+            print('Handshake p50: {:.1f} ms (virtual)'.format(
+                handshake_times[len(handshake_times) // 2] * 1000))
+            print('Handshake max: {:.1f} ms (virtual)'.format(
+                handshake_times[-1] * 1000))
+            print('Connections: {}, Bytes: {}'.format(
+                network.connections, network.bytes_sent))
+            # Every node got the seed's reply and became its peer
+            assert all(len(reply) > 0 for reply in replies)
+            assert all('{}:{}'.format(server.host, server.port) in seed.peers for server in servers[1:])
+            assert network.connections == number_of_nodes - 1
+            # Connecting and the request each take at least one round trip
+            assert handshake_times[0] >= 4 * latency
+
+            for server in servers:
+                server.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_links()
+    test_simulated_network()
@@ -0,0 +1,83 @@
+from simulated_network import SimulatedNetwork
+from test_sync_engine import write_chain
+from state_writer import StateWriter
+from state_store import StateStore
+from tip_index import TipIndex
+from server import Server
+from peer import Peer
+import threading
+import tempfile
+import random
+import time
+import os
+
+
+def test_state_writer(accounts=20, length=50):
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-state-writer-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            chains = {hex(random.getrandbits(160)): None for _ in range(accounts)}
+            for account in chains:
+                chains[account] = write_chain(os.path.join(directory, 'source', 'accounts'), account, length)
+            items = [(account, state) for account, chain in chains.items() for state in chain]
+            random.shuffle(items)
+
+            # Direct writes, out of order, with a small buffer to exercise backpressure
+            store = StateStore(os.path.join(directory, 'local', 'accounts'))
+            tip_index = TipIndex(os.path.join(directory, 'local', 'tip_index.json'), store)
+            writer = StateWriter(store, max_batch=64, max_pending=128)
+            start_time = time.perf_counter()
+            for index in range(0, len(items), 100):
+                writer.submit(items[index:index + 100])
+            writer.flush()
+            print('Wrote {} states in {} batches in {:.2f} s ({} producer waits)'.format(
+                int(writer.metrics.get('state_writer_states_total')), int(writer.metrics.get('state_writer_batches_total')),
+                time.perf_counter() - start_time, int(writer.metrics.get('state_writer_waits_total'))))
+            writer.stop()
+            assert int(writer.metrics.get('state_writer_states_total')) == len(items)
+            tips_correct = all(tip_index.get(account)['reference'] == chain[-1].current_reference
+                               for account, chain in chains.items())
+            print('Tips Correct: {}'.format(tips_correct))
+            assert tips_correct
+            state_count = TipIndex(os.path.join(directory, 'local', 'tip_index.json')).state_count()
+            print('State Count: {}'.format(state_count))
+            assert state_count == len(items)
+
+            # A durable batch leaves no temporary files behind
+            durable_store = StateStore(os.path.join(directory, 'durable', 'accounts'))
+            assert durable_store.put_many(items[:100], durable=True) == 100
+            assert not any(file.endswith('.tmp') for _, _, files in os.walk(os.path.join(directory, 'durable'))
+                           for file in files)
+
+            # Data responses from a peer end up on disk
+            network = SimulatedNetwork(latency=0.02, bandwidth=2000000)
+            source = Server(nonce='source', host='10.0.0.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.0.1'), accounts_directory=os.path.join(directory, 'source', 'accounts'))
+            threading.Thread(target=source.start_server_listen, daemon=True).start()
+            target = Server(nonce='target', host='10.0.1.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.1.1'), accounts_directory=os.path.join(directory, 'target', 'accounts'))
+            target.peers = {'10.0.0.1:6969': Peer(host='10.0.0.1', port=6969, max_states_in_transit=100)}
+            time.sleep(0.1)
+
+            start_time = time.perf_counter()
+            target.inventory.extend(['{}/{}'.format(account, state.current_reference) for account, state in items])
+            while target.tip_index.state_count() < len(items) and time.perf_counter() - start_time < 60:
+                time.sleep(0.05)
+            print('Downloaded {} of {} states in {:.2f} s'.format(
+                target.tip_index.state_count(), len(items), time.perf_counter() - start_time))
+            assert target.tip_index.state_count() == len(items)
+            chains_match = all([state.current_reference for state in target.state_store.get_chain(account)] ==
+                               [state.current_reference for state in chain] for account, chain in chains.items())
+            print('Chains Match: {}'.format(chains_match))
+            assert chains_match
+            source.shutdown = True
+            target.shutdown = True
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_state_writer()
@@ -0,0 +1,84 @@
+from supervisor import Supervisor
+from server import Server
+from peer import Peer
+import tempfile
+import signal
+import time
+import os
+
+
+def stats(client: Server, port: int) -> dict:
+    replies = client.connect_and_send('127.0.0.1', port, 'request', 6, {'command': 'stats'}, dispatch=False)
+    return replies[0].data if len(replies) > 0 else None
+
+
+def worker_of(snapshot: dict) -> int:
+    return snapshot['gauges']['worker'][0]['value'] if snapshot is not None else None
+
+
+def test_supervisor(workers=4, port=7350, requests=200):
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-supervisor-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            supervisor = Supervisor(workers=workers, port=port, max_peers=0,
+                                    accounts_directory=os.path.join(directory, 'workers', 'accounts'),
+                                    restart_delay=0.2, stable_after=5.0)
+            supervisor.start()
+            time.sleep(2.0)
+            client = Server(nonce='client', host='127.0.0.1', port=port + 1, max_peers=0,
+                            accounts_directory=os.path.join(directory, 'client', 'accounts'))
+
+            served_by = {}
+            start_time = time.perf_counter()
+            for _ in range(requests):
+                worker = worker_of(stats(client, port))
+                served_by[worker] = served_by.get(worker, 0) + 1
+            print('{} requests in {:.2f} s, served by: {}'.format(
+                requests, time.perf_counter() - start_time, dict(sorted(served_by.items(), key=str))))
+            assert None not in served_by
+            assert set(served_by) <= set(range(workers))
+
+            # A peer added by one worker shows up in every worker's peer table
+            client.connect_and_send('127.0.0.1', port, 'request', 1, client.make_version_message(
+                '127.0.0.1:{}'.format(port)), dispatch=False)
+            time.sleep(0.5)
+            peer_counts = set()
+            for _ in range(requests // 4):
+                snapshot = stats(client, port)
+                peer_counts.add((worker_of(snapshot), snapshot['gauges']['peers'][0]['value']))
+            print('Peers per worker: {}'.format(sorted(peer_counts)))
+            assert len({count for _, count in peer_counts}) == 1
+            known_peers = next(iter(peer_counts))[1]
+
+            crashed = supervisor.status()[0]['pid']
+            os.kill(crashed, signal.SIGKILL)
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline and not (supervisor.status()[0]['alive'] and supervisor.status()[0]['pid'] != crashed):
+                supervisor.monitor()
+                time.sleep(0.1)
+            time.sleep(1.5)
+            restarted = supervisor.status()[0]
+            print('Restarted: {}'.format(restarted))
+            assert restarted['alive'] and restarted['pid'] != crashed and restarted['restarts'] == 1
+
+            # The restarted worker is given the peers the others already know
+            peer_counts = {(worker_of(snapshot), snapshot['gauges']['peers'][0]['value'])
+                           for snapshot in [stats(client, port) for _ in range(requests // 4)]}
+            print('Peers per worker: {}'.format(sorted(peer_counts)))
+            assert {count for _, count in peer_counts} == {known_peers}
+            serving = all(stats(client, port) is not None for _ in range(20))
+            print('Serving After Restart: {}'.format(serving))
+            assert serving
+            supervisor.stop()
+            stopped = not any(worker['alive'] for worker in supervisor.status())
+            print('Stopped: {}'.format(stopped))
+            assert stopped
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    test_supervisor()
@@ -0,0 +1,84 @@
+from simulated_network import SimulatedNetwork
+from state import State
+from server import Server
+from state_store import StateStore
+import threading
+import tempfile
+import random
+import time
+import os
+
+
+def write_chain(accounts_directory: str, account: str, length: int) -> list:
+    state_path = os.path.join(accounts_directory, account, 'states')
+    os.makedirs(state_path, exist_ok=True)
+    previous_reference = hex(random.getrandbits(256))
+    chain = []
+    for nonce in range(1, length + 1):
+        state = State(nonce=str(nonce), previous_reference=previous_reference,
+                      current_reference=hex(random.getrandbits(256)), balance=nonce * 10)
+        with open(os.path.join(state_path, 'state{}.dat'.format(nonce)), 'w') as state_file:
+            state_file.write(state.to_JSON())
+        chain.append(state)
+        previous_reference = state.current_reference
+    return chain
+
+
+def test_sync_engine(number_of_sources=3, accounts=5, length=200):
+    network = SimulatedNetwork(latency=0.02, bandwidth=2000000)
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lynx-sync-') as directory:
+        # Servers keep their known peers in '..', so the test runs from a directory of its own
+        os.makedirs(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            source_directories = [os.path.join(directory, 'source{}'.format(index), 'accounts')
+                                  for index in range(number_of_sources)]
+            account_references = [hex(random.getrandbits(160)) for _ in range(accounts)]
+            for account in account_references:
+                chain = write_chain(source_directories[0], account, length)
+                # The other sources hold copies of the same chains
+                for source_directory in source_directories[1:]:
+                    state_path = os.path.join(source_directory, account, 'states')
+                    os.makedirs(state_path)
+                    for state in chain:
+                        with open(os.path.join(state_path, '{}.dat'.format(state.current_reference)), 'w') as state_file:
+                            state_file.write(state.to_JSON())
+
+            peers = []
+            for index, source_directory in enumerate(source_directories):
+                host = '10.0.0.{}'.format(index + 1)
+                source = Server(nonce='source{}'.format(index), host=host, port=6969, max_peers=0,
+                                transport=network.transport(host), accounts_directory=source_directory)
+                threading.Thread(target=source.start_server_listen, daemon=True).start()
+                peers.append((host, 6969))
+
+            target_directory = os.path.join(directory, 'target', 'accounts')
+            os.makedirs(target_directory)
+            # Half of the first account is already stored locally
+            source_store = StateStore(source_directories[0])
+            first_chain = source_store.get_chain(account_references[0])
+            target = Server(nonce='target', host='10.0.1.1', port=6969, max_peers=0,
+                            transport=network.transport('10.0.1.1'), accounts_directory=target_directory)
+            for state in first_chain[:length // 2]:
+                target.state_store.put(account_references[0], state)
+            time.sleep(0.1)
+
+            start_time = time.perf_counter()
+            summaries = target.sync_accounts(account_references, peers)
+            print('Synced {} accounts in {:.2f} s'.format(
+                accounts, time.perf_counter() - start_time))
+            for summary in summaries:
+                print(summary)
+
+            chains_match = all(
+                [state.current_reference for state in target.state_store.get_chain(account)] ==
+                [state.current_reference for state in source_store.get_chain(account)]
+                for account in account_references)
+            print('Chains Match: {}'.format(chains_match))
+            assert chains_match
+        finally:
+            os.chdir(working_directory)
+
+if __name__ == "__main__":
+    test_sync_engine()
@@ -0,0 +1,65 @@
+from test_sync_engine import write_chain
+from state_store import StateStore
+from tip_index import TipIndex
+from accounts import Accounts
+from state import State
+import tempfile
+import random
+import time
+import os
+
+
+def test_tip_index(accounts=500, length=20, lookups=100000):
+    with tempfile.TemporaryDirectory(prefix='lynx-tip-index-') as directory:
+        accounts_directory = os.path.join(directory, 'accounts')
+        index_path = os.path.join(directory, 'tip_index.json')
+        chains = {hex(random.getrandbits(160)): None for _ in range(accounts)}
+        for account in chains:
+            chains[account] = write_chain(accounts_directory, account, length)
+
+        start_time = time.perf_counter()
+        rebuilt = TipIndex(index_path).rebuild(StateStore(accounts_directory))
+        print('Rebuilt {} accounts in {:.2f} s'.format(rebuilt, time.perf_counter() - start_time))
+        assert rebuilt == accounts
+
+        store = StateStore(accounts_directory)
+        tip_index = TipIndex(index_path, store)
+        account = next(iter(chains))
+        tip = chains[account][-1]
+        tip = State(nonce=str(length + 1), previous_reference=tip.current_reference,
+                    current_reference=hex(random.getrandbits(256)), balance=12345)
+        store.put(account, tip)
+
+        reloaded = TipIndex(index_path)
+        assert reloaded.get_balance(account) == 12345
+        assert all(reloaded.get_balance(other) == chains[other][-1].balance
+                   for other in chains if other != account)
+        assert (reloaded.account_count(), reloaded.state_count()) == (accounts, accounts * length + 1)
+        print('Tip Followed Write, Balances And Counts Correct: True')
+
+        os.remove(index_path)
+        os.remove(index_path + '.journal')
+        counts = (TipIndex(index_path, StateStore(accounts_directory)).account_count(),
+                  TipIndex(index_path).state_count())
+        print('Counts After Automatic Rebuild: {}'.format(counts))
+        assert counts == (accounts, accounts * length + 1)
+
+        addresses = list(chains)
+        start_time = time.perf_counter()
+        for index in range(lookups):
+            reloaded.get_balance(addresses[index % accounts])
+        print('{} balance lookups in {:.3f} s'.format(
+            lookups, time.perf_counter() - start_time))
+
+        wallet = Accounts(tip_index)
+        wallet.address = account
+        print('Accounts Balance: {}'.format(wallet.getBalance()))
+        assert wallet.getBalance() == 12345
+        # The wallet reads the index the store keeps current, so it sees later writes
+        store.put(account, State(nonce=str(length + 2), previous_reference=tip.current_reference,
+                                 current_reference=hex(random.getrandbits(256)), balance=54321))
+        assert wallet.getBalance() == 54321
+
+
+if __name__ == "__main__":
+    test_tip_index()
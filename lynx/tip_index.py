@@ -0,0 +1,272 @@
+# tip_index.py
+from __future__ import annotations
+from state_store import StateStore
+from state import State
+from log import get_logger
+import threading
+import argparse
+import json
+import os
+
+logger = get_logger(__name__)
+
+
+class TipIndex:
+    """Persistent index of the tip of every account: its latest reference, nonce,
+    balance and number of stored states. Balance lookups and the account and
+    state totals are served from memory instead of scanning the accounts
+    directory.
+
+    The index is kept in a JSON snapshot plus an append-only journal with one
+    JSON line per batch of updates, so recording new tips costs one small
+    append and a torn line drops its whole batch. The journal is folded into
+    the snapshot once it grows past the size of the index. When attached to a
+    StateStore the index follows every batch written through it, and an index
+    that was never written is built from the store on first use. An index that
+    does not persist (a worker process following another process's index) only
+    keeps its updates in memory.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, path: str = '../tip_index.json', state_store: StateStore = None, persist: bool = True) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes a TipIndex stored at path, following state_store if given"""
+
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.state_store = state_store
+        self.persist = persist
+        self.lock = threading.RLock()
+        # account -> {'reference': ..., 'nonce': ..., 'balance': ..., 'states': ...}
+        self.tips = {}
+        self.total_states = 0
+        self.journal_entries = 0
+        self.loaded = False
+        if state_store is not None:
+            state_store.add_batch_listener(self.__on_states_stored)
+
+    # ------------------------------------------------------------------------------
+    def load(self) -> None:
+        # --------------------------------------------------------------------------
+        """Reads the snapshot and replays the journal. A torn last journal line
+        (from a crash during an append) is ignored.
+        """
+
+        with self.lock:
+            if self.state_store is not None and not os.path.exists(self.path) \
+                    and not os.path.exists(self.journal_path):
+                self.rebuild()
+                return
+
+            tips = {}
+            try:
+                with open(self.path, 'r') as index_file:
+                    tips = json.load(index_file)
+                if not isinstance(tips, dict):
+                    raise ValueError
+            except FileNotFoundError:
+                tips = {}
+            except ValueError:
+                logger.warning('Tip index %s is corrupt, rebuild it', self.path)
+                tips = {}
+
+            journal_entries = 0
+            try:
+                with open(self.journal_path, 'r') as journal_file:
+                    for line in journal_file:
+                        try:
+                            batch = dict(json.loads(line))
+                        except (ValueError, TypeError):
+                            continue
+                        tips.update(batch)
+                        journal_entries += len(batch)
+            except FileNotFoundError:
+                pass
+
+            self.tips = tips
+            self.total_states = sum(entry.get('states', 0)
+                                    for entry in tips.values())
+            self.journal_entries = journal_entries
+            self.loaded = True
+
+    # ------------------------------------------------------------------------------
+    def save(self) -> None:
+        # --------------------------------------------------------------------------
+        """Writes the whole index to the snapshot and empties the journal"""
+
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w') as index_file:
+                json.dump(self.tips, index_file)
+            os.replace(temporary_path, self.path)
+            with open(self.journal_path, 'w'):
+                pass
+            self.journal_entries = 0
+
+    # ------------------------------------------------------------------------------
+    def get(self, account: str) -> dict:
+        # --------------------------------------------------------------------------
+        """Returns the indexed tip of an account, or None if it is not indexed"""
+
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return self.tips.get(account)
+
+    # ------------------------------------------------------------------------------
+    def items(self) -> list:
+        # --------------------------------------------------------------------------
+        """Returns [(account, indexed tip), ...] for every indexed account"""
+
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return list(self.tips.items())
+
+    # ------------------------------------------------------------------------------
+    def get_balance(self, account: str):
+        # --------------------------------------------------------------------------
+        """Returns the balance at the tip of an account, or None if it has no
+        states. Accounts missing from the index are looked up once in the
+        attached StateStore and indexed.
+        """
+
+        entry = self.get(account)
+        if entry is None and self.state_store is not None:
+            tip = self.state_store.get_tip(account)
+            if tip is not None:
+                self.update(account, tip, self.state_store.count(account))
+                entry = self.get(account)
+
+        return entry['balance'] if entry is not None else None
+
+    # ------------------------------------------------------------------------------
+    def account_count(self) -> int:
+        # --------------------------------------------------------------------------
+        """Returns the number of accounts that have states"""
+
+        return len(self)
+
+    # ------------------------------------------------------------------------------
+    def state_count(self) -> int:
+        # --------------------------------------------------------------------------
+        """Returns the number of states stored over all accounts"""
+
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return self.total_states
+
+    # ------------------------------------------------------------------------------
+    def update(self, account: str, state: State, states: int = None) -> None:
+        # --------------------------------------------------------------------------
+        """Records state as the tip of an account holding states states (kept
+        as is if not given).
+        """
+
+        self.update_many([(account, state, states)])
+
+    # ------------------------------------------------------------------------------
+    def update_many(self, updates: list) -> None:
+        # --------------------------------------------------------------------------
+        """Records a batch of (account, tip state, states) updates with a single
+        journal append.
+        """
+
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            batch = []
+            for account, state, states in updates:
+                previous_entry = self.tips.get(account)
+                previous_states = previous_entry.get(
+                    'states', 0) if previous_entry is not None else 0
+                if states is None:
+                    states = previous_states
+                entry = {'reference': state.current_reference, 'nonce': state.nonce,
+                         'balance': state.balance, 'states': states}
+                if previous_entry == entry:
+                    continue
+                self.tips[account] = entry
+                self.total_states += states - previous_states
+                batch.append([account, entry])
+
+            if len(batch) == 0 or not self.persist:
+                return
+            try:
+                with open(self.journal_path, 'a') as journal_file:
+                    journal_file.write(json.dumps(batch) + '\n')
+                self.journal_entries += len(batch)
+                if self.journal_entries > max(1024, len(self.tips)):
+                    self.save()
+            except OSError:
+                logger.warning('Unable to persist %s tips', len(batch), exc_info=True)
+
+    # ------------------------------------------------------------------------------
+    def __on_states_stored(self, items: list) -> None:
+        # --------------------------------------------------------------------------
+        """States may arrive out of order, so index the tip of each stored chain"""
+
+        updates = []
+        for account in dict.fromkeys(account for account, _ in items):
+            tip = self.state_store.get_tip(account)
+            if tip is not None:
+                updates.append(
+                    (account, tip, self.state_store.count(account)))
+        self.update_many(updates)
+
+    # ------------------------------------------------------------------------------
+    def rebuild(self, state_store: StateStore = None) -> int:
+        # --------------------------------------------------------------------------
+        """Rebuilds the index from the states on disk and saves it. Returns the
+        number of accounts indexed.
+        """
+
+        state_store = state_store or self.state_store or StateStore()
+        tips = {}
+        for account in state_store.list_accounts():
+            tip = state_store.get_tip(account)
+            if tip is not None:
+                tips[account] = {'reference': tip.current_reference, 'nonce': tip.nonce,
+                                 'balance': tip.balance, 'states': state_store.count(account)}
+
+        with self.lock:
+            self.tips = tips
+            self.total_states = sum(entry['states'] for entry in tips.values())
+            self.loaded = True
+            if self.persist:
+                self.save()
+
+        logger.info('Tip index rebuilt (%s accounts)', len(tips))
+        return len(tips)
+
+    # ------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        # --------------------------------------------------------------------------
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return len(self.tips)
+
+# end TipIndex class
+
+
+# ------------------------------------------------------------------------------
+def main() -> None:
+    # --------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(
+        description='Rebuilds the account tip index from the states on disk.')
+    parser.add_argument('--accounts-directory', type=str, default='../accounts')
+    parser.add_argument('--index', type=str, default='../tip_index.json')
+    arguments = parser.parse_args()
+
+    count = TipIndex(arguments.index).rebuild(
+        StateStore(arguments.accounts_directory))
+    print('Indexed {} accounts into {}'.format(count, arguments.index))
+
+
+if __name__ == "__main__":
+    main()
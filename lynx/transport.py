@@ -0,0 +1,77 @@
+# transport.py
+from abc import ABC, abstractmethod
+import socket
+
+
+class Transport(ABC):
+    """Creates the stream connections used by PeerConnection and Server. The
+    objects returned behave like sockets: connections support send, sendall,
+    recv, settimeout, getpeername, shutdown and close; listeners support
+    accept, settimeout and close. Connections from a selectable transport
+    are real sockets that can be registered with a selector.
+    """
+
+    selectable = False
+
+    @abstractmethod
+    # ------------------------------------------------------------------------------
+    def connect(self, host: str, port: int, timeout: float = None):
+        # --------------------------------------------------------------------------
+        """Opens a connection to host:port"""
+
+    @abstractmethod
+    # ------------------------------------------------------------------------------
+    def listen(self, host: str, port: int, backlog: int = 5):
+        # --------------------------------------------------------------------------
+        """Returns a listener accepting connections on host:port"""
+
+# end Transport class
+
+
+class TcpTransport(Transport):
+    """Transport over real TCP sockets. With reuse_port, listeners set
+    SO_REUSEPORT so that several processes can accept on the same port and
+    the kernel spreads connections between them.
+    """
+
+    selectable = True
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, reuse_port: bool = False) -> None:
+        # --------------------------------------------------------------------------
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise OSError('SO_REUSEPORT is not supported on this platform')
+        self.reuse_port = reuse_port
+
+    # ------------------------------------------------------------------------------
+    def connect(self, host: str, port: int, timeout: float = None) -> socket.socket:
+        # --------------------------------------------------------------------------
+        """Opens a TCP connection to host:port"""
+
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if timeout is not None:
+            connection.settimeout(timeout)
+        connection.connect((host, int(port)))
+        return connection
+
+    # ------------------------------------------------------------------------------
+    def listen(self, host: str, port: int, backlog: int = 5) -> socket.socket:
+        # --------------------------------------------------------------------------
+        """Constructs and prepares a server socket listening on given port.
+
+        For more information on port forwarding visit: https://stackoverflow.com/questions/45097727/python-sockets-port-forwarding
+        """
+
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((host, int(port)))
+        server_socket.listen(backlog)
+        return server_socket
+
+# end TcpTransport class
+
+
+TCP_TRANSPORT = TcpTransport()
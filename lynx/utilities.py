@@ -4,18 +4,16 @@ from message import SignedMessage
 from peer_connection import PeerConnection
 from ipaddress import ip_address, IPv4Address
 from hashlib import sha3_256
+from log import get_logger
 import json
+import socket
+import struct
 import threading
 
+logger = get_logger(__name__)
 
-class Utilities:
 
-    @classmethod
-    # ------------------------------------------------------------------------------
-    def __debug(self, msg) -> None:
-        # --------------------------------------------------------------------------
-        """Prints a message to the screen with the name of the current thread"""
-        print(msg)
+class Utilities:
 
     @classmethod
     # ------------------------------------------------------------------------------
@@ -25,10 +23,10 @@ class Utilities:
 
         try:
             if not exists('../accounts/'):
-                self.__debug('Initializing Accounts Folder...')
+                logger.info('Initializing Accounts Folder...')
                 makedirs('../accounts/')
         except:
-            self.__debug('Unable to initialize transactions folder.')
+            logger.warning('Unable to initialize transactions folder.')
 
     @classmethod
     # ------------------------------------------------------------------------------
@@ -44,7 +42,7 @@ class Utilities:
                 transaction_count = len(transaction_list)
                 return transaction_count
         except:
-            self.__debug(
+            logger.warning(
                 'Unable to read transactions folder and return transaction count.')
             return None
 
@@ -61,4 +59,74 @@ class Utilities:
         except ValueError:
             return None
 
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def get_local_host(self, timeout: float = 0.5) -> str:
+        # --------------------------------------------------------------------------
+        """Returns the IPv4 address of the first non-loopback local interface. Never
+        sends any traffic and never waits longer than timeout, falling back to
+        127.0.0.1 if no address could be found in time.
+        """
+
+        host = self.__get_interface_host()
+        if host is not None:
+            return host
+
+        # Resolving the hostname may hit DNS, so give it a bounded amount of time
+        result = []
+        resolver_thread = threading.Thread(
+            target=lambda: result.append(self.__get_hostname_host()), name='Host Discovery Thread', daemon=True)
+        resolver_thread.start()
+        resolver_thread.join(timeout)
+
+        if len(result) > 0 and result[0] is not None:
+            return result[0]
+        return '127.0.0.1'
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __get_interface_host(self) -> str:
+        # --------------------------------------------------------------------------
+        """Reads interface addresses directly from the kernel (SIOCGIFADDR). Returns
+        None on platforms where this is not available.
+        """
+
+        try:
+            import fcntl
+        except ImportError:
+            return None
+
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as interface_socket:
+                for _, name in socket.if_nameindex():
+                    try:
+                        request = struct.pack('256s', name[:15].encode())
+                        response = fcntl.ioctl(
+                            interface_socket.fileno(), 0x8915, request)  # SIOCGIFADDR
+                    except OSError:
+                        continue
+                    host = socket.inet_ntoa(response[20:24])
+                    if not ip_address(host).is_loopback:
+                        return host
+        except OSError:
+            return None
+
+        return None
+
+    @classmethod
+    # ------------------------------------------------------------------------------
+    def __get_hostname_host(self) -> str:
+        # --------------------------------------------------------------------------
+        """Returns the first non-loopback IPv4 address the local hostname resolves to"""
+
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                host = info[4][0]
+                if not ip_address(host).is_loopback:
+                    return host
+        except OSError:
+            return None
+
+        return None
+
 # end Utilities class
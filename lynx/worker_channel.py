@@ -0,0 +1,101 @@
+# worker_channel.py
+from __future__ import annotations
+from peer import Peer
+from log import get_logger
+from hashlib import sha3_256
+from typing import TYPE_CHECKING
+import threading
+import queue
+if TYPE_CHECKING:
+    from server import Server
+
+logger = get_logger(__name__)
+
+
+class WorkerChannel:
+    """Connects the Server of one worker process to the Supervisor. Changes a
+    worker makes to shared node state are published as events ('peer' when a
+    peer is added, 'states' when states are stored, 'inventory' when states
+    are announced); the supervisor relays them to every other worker, where
+    they are applied to that worker's Server without being published again.
+
+    Inventory is sharded by account so that every announced state is
+    downloaded by exactly one worker.
+    """
+
+    # ------------------------------------------------------------------------------
+    def __init__(self, index: int, workers: int, events, inbox) -> None:
+        # --------------------------------------------------------------------------
+        """Initializes the channel of worker index (of workers) publishing on the
+        events queue and receiving relayed events on the inbox queue.
+        """
+
+        self.index = int(index)
+        self.workers = max(1, int(workers))
+        self.events = events
+        self.inbox = inbox
+        self.server = None
+        self.local = threading.local()
+        self.thread = None
+
+    # ------------------------------------------------------------------------------
+    def owns(self, item: str) -> bool:
+        # --------------------------------------------------------------------------
+        """Returns True if the 'account/reference' item belongs to this worker"""
+
+        account = item.split('/')[0]
+        return int.from_bytes(sha3_256(account.encode()).digest()[:4], 'big') % self.workers == self.index
+
+    # ------------------------------------------------------------------------------
+    def publish(self, kind: str, payload) -> None:
+        # --------------------------------------------------------------------------
+        """Sends an event to the supervisor, unless it is being applied here"""
+
+        if getattr(self.local, 'applying', False):
+            return
+        try:
+            self.events.put((self.index, kind, payload))
+        except (OSError, ValueError):
+            logger.warning('Unable to publish %s event', kind, exc_info=True)
+
+    # ------------------------------------------------------------------------------
+    def start(self, server: Server) -> None:
+        # --------------------------------------------------------------------------
+        """Starts applying relayed events to server"""
+
+        self.server = server
+        self.thread = threading.Thread(
+            target=self.__run, name='Worker Channel Thread', daemon=True)
+        self.thread.start()
+
+    # ------------------------------------------------------------------------------
+    def __run(self) -> None:
+        # --------------------------------------------------------------------------
+        self.local.applying = True
+        while not self.server.shutdown:
+            try:
+                kind, payload = self.inbox.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                logger.warning('Supervisor channel closed')
+                return
+            try:
+                self.apply(kind, payload)
+            except Exception:
+                logger.warning('Unable to apply %s event', kind, exc_info=True)
+
+    # ------------------------------------------------------------------------------
+    def apply(self, kind: str, payload) -> None:
+        # --------------------------------------------------------------------------
+        """Applies an event published by another worker"""
+
+        if kind == 'peer':
+            self.server.add_peer(Peer(**payload))
+        elif kind == 'states':
+            self.server.state_store.notify(payload)
+        elif kind == 'inventory':
+            self.server.inventory.extend(
+                [item for item in payload if self.owns(item)])
+
+# end WorkerChannel class